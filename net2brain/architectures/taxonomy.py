@@ -0,0 +1,275 @@
+import bisect
+import os
+import pickle
+
+import pandas as pd
+
+
+TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "taxonomy.csv")
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "net2brain")
+CACHE_VERSION = 1
+
+_CATALOG = None
+
+
+def read_taxonomy_csv(taxonomy_path=TAXONOMY_PATH):
+    """Reads and cleans the taxonomy csv with pandas
+
+    Args:
+        taxonomy_path (str): path to taxonomy.csv
+
+    Returns:
+        DataFrame: taxonomy with "x" replaced by 1 and empty cells by 0
+    """
+
+    # Read the CSV file
+    df = pd.read_csv(taxonomy_path)
+
+    # Replace "x" with 1 and empty cells with 0
+    df = df.replace({'x': 1, '': 0, pd.NA: 0})
+
+    # Drop the 'Unnamed: 34' column if it exists
+    if 'Unnamed: 34' in df.columns:
+        df = df.drop(columns=['Unnamed: 34'])
+
+    return df
+
+
+class ModelCatalog:
+    """In-memory index of the model taxonomy. The csv is parsed once, every
+    category column is stored as a bitset over the models (bit i is set if
+    model i belongs to the category) and the model names are indexed for
+    substring and prefix lookups.
+    """
+
+    def __init__(self, df):
+        """Builds the catalog from a cleaned taxonomy dataframe
+
+        Args:
+            df (DataFrame): taxonomy as returned by read_taxonomy_csv
+        """
+
+        self.df = df
+
+        # The first row holds the category of every column, the rest are models
+        header = df.loc[df['Header'] == 'Header Category']
+        data = df.loc[df['Header'] != 'Header Category']
+
+        self.columns = [c for c in df.columns if c not in ['Header', 'Netset', 'Model']]
+        self.categories = {}
+        if len(header) > 0:
+            for col in self.columns:
+                self.categories.setdefault(str(header.iloc[0][col]), []).append(col)
+
+        self.models = [str(m) for m in data['Model']]
+        self.netsets = [str(n) for n in data['Netset']]
+        self.row_index = list(data.index)
+
+        # One integer bitset per category column
+        self.bits = {}
+        for col in self.columns:
+            bitset = 0
+            for i, value in enumerate(data[col]):
+                if value == 1 or value == '1':
+                    bitset |= 1 << i
+            self.bits[col] = bitset
+        self.all_bits = (1 << len(self.models)) - 1
+
+        # Name index: lower-cased names and a sorted copy for prefix search
+        self.lower_names = [m.lower() for m in self.models]
+        self.sorted_names = sorted((name, i) for i, name in enumerate(self.lower_names))
+        self._sorted_keys = [name for name, _ in self.sorted_names]
+
+    @classmethod
+    def load(cls, taxonomy_path=TAXONOMY_PATH, cache_dir=CACHE_DIR):
+        """Loads the catalog from the binary cache, parsing the csv only if
+        the cache is missing or outdated
+
+        Args:
+            taxonomy_path (str): path to taxonomy.csv
+            cache_dir (str, optional): folder for the binary cache. If None, no cache is used.
+
+        Returns:
+            ModelCatalog: the catalog
+        """
+
+        stat = os.stat(taxonomy_path)
+        key = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+        cache_file = None
+
+        if cache_dir is not None:
+            cache_file = os.path.join(cache_dir, "taxonomy.pkl")
+            try:
+                with open(cache_file, 'rb') as f:
+                    cached_key, catalog = pickle.load(f)
+                if cached_key == key:
+                    return catalog
+            except Exception:
+                pass  # unreadable or from another version, rebuild it
+
+        catalog = cls(read_taxonomy_csv(taxonomy_path))
+
+        if cache_file is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(cache_file, 'wb') as f:
+                    pickle.dump((key, catalog), f, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError:
+                pass  # a read-only home only costs us the cache
+
+        return catalog
+
+    def __len__(self):
+        return len(self.models)
+
+    def _column_bits(self, category):
+        """Returns the bitset of a category column
+
+        Args:
+            category (str): name of the column
+
+        Raises:
+            KeyError: If the column does not exist
+        """
+        try:
+            return self.bits[category]
+        except KeyError:
+            raise KeyError(f"Column '{category}' not found in the taxonomy. Available columns are: {self.columns}")
+
+    def name_bits(self, name, prefix=False):
+        """Bitset of models whose name contains (or starts with) the string
+
+        Args:
+            name (str): (part of) the model name, case insensitive
+            prefix (bool, optional): Only match names starting with name. Defaults to False.
+
+        Returns:
+            int: bitset of matching models
+        """
+
+        name = name.lower()
+        bitset = 0
+
+        if prefix:
+            start = bisect.bisect_left(self._sorted_keys, name)
+            for key, i in self.sorted_names[start:]:
+                if not key.startswith(name):
+                    break
+                bitset |= 1 << i
+        else:
+            for i, key in enumerate(self.lower_names):
+                if name in key:
+                    bitset |= 1 << i
+        return bitset
+
+    def query_bits(self, all_of=None, any_of=None, name=None, prefix=False, netsets=None):
+        """Combines category, name and netset filters into one bitset
+
+        Args:
+            all_of (str or list, optional): Categories that all have to be set (AND).
+            any_of (str or list, optional): Categories of which at least one has to be set (OR).
+            name (str, optional): Substring (or prefix) of the model name.
+            prefix (bool, optional): Match name as prefix instead of substring. Defaults to False.
+            netsets (list, optional): Only keep models from these netsets.
+
+        Returns:
+            int: bitset of matching models
+        """
+
+        bitset = self.all_bits
+
+        if all_of is not None:
+            for category in ([all_of] if isinstance(all_of, str) else all_of):
+                bitset &= self._column_bits(category)
+
+        if any_of is not None:
+            any_bits = 0
+            for category in ([any_of] if isinstance(any_of, str) else any_of):
+                any_bits |= self._column_bits(category)
+            bitset &= any_bits
+
+        if name is not None:
+            bitset &= self.name_bits(name, prefix=prefix)
+
+        if netsets is not None:
+            netset_bits = 0
+            for i, netset in enumerate(self.netsets):
+                if netset in netsets:
+                    netset_bits |= 1 << i
+            bitset &= netset_bits
+
+        return bitset
+
+    def indices(self, bitset):
+        """Turns a bitset into the list of model indices
+
+        Args:
+            bitset (int): bitset over the models
+
+        Returns:
+            list: indices of the set bits in ascending order
+        """
+        out = []
+        while bitset:
+            low = bitset & -bitset
+            out.append(low.bit_length() - 1)
+            bitset ^= low
+        return out
+
+    def query(self, all_of=None, any_of=None, name=None, prefix=False, netsets=None):
+        """Returns all models matching the query
+
+        Args:
+            all_of (str or list, optional): Categories that all have to be set (AND).
+            any_of (str or list, optional): Categories of which at least one has to be set (OR).
+            name (str, optional): Substring (or prefix) of the model name.
+            prefix (bool, optional): Match name as prefix instead of substring. Defaults to False.
+            netsets (list, optional): Only keep models from these netsets.
+
+        Returns:
+            list: (netset, model) tuples
+        """
+        bitset = self.query_bits(all_of, any_of, name, prefix, netsets)
+        return [(self.netsets[i], self.models[i]) for i in self.indices(bitset)]
+
+    def sweep(self, available_networks, **query):
+        """Yields the matching models that can be loaded in this installation,
+        ready to be passed on to the FeatureExtractor
+
+        Args:
+            available_networks (dict): {netset: [models]}, e.g. AVAILABLE_NETWORKS
+            **query: Arguments of ModelCatalog.query
+
+        Yields:
+            tuple: (netset, model)
+        """
+        available = {netset: set(models) for netset, models in available_networks.items()}
+        for netset, model in self.query(**query):
+            if model in available.get(netset, ()):
+                yield netset, model
+
+    def to_frame(self, bitset=None):
+        """Returns the taxonomy rows of the bitset as dataframe
+
+        Args:
+            bitset (int, optional): bitset over the models. If None, return the whole taxonomy.
+
+        Returns:
+            DataFrame: copy of the selected taxonomy rows
+        """
+        if bitset is None:
+            return self.df.copy()
+        rows = [self.row_index[i] for i in self.indices(bitset)]
+        return self.df.loc[rows].copy()
+
+
+def get_catalog():
+    """Returns the process-wide model catalog, loading it on first use
+
+    Returns:
+        ModelCatalog: the catalog
+    """
+    global _CATALOG
+    if _CATALOG is None:
+        _CATALOG = ModelCatalog.load()
+    return _CATALOG
@@ -0,0 +1,278 @@
+import numpy as np
+
+from .eval_helper import standardize
+
+
+class Comparator():
+    """Compares model with brain RDM vectors. Vectors are prepared once (e.g.
+    ranked) with prepare, compare then returns the values of all layers with
+    all brain vectors at once. By default the prepared vectors are normalized
+    so that their dot product is the value. A comparator is permutable if its
+    value is that dot product and permuting the stimuli of an RDM only
+    reorders its prepared vector, which the permutation test relies on.
+    """
+
+    name = None
+    permutable = True
+
+    def prepare(self, vectors):
+        """Prepares RDM vectors for compare
+
+        Args:
+            vectors (numpy array): RDM upper triangles (..., num_pairs)
+
+        Returns:
+            numpy array: prepared vectors (..., num_pairs)
+        """
+        raise NotImplementedError
+
+    def compare(self, model_vectors, brain_vectors):
+        """Compares all prepared model vectors with all prepared brain vectors
+
+        Args:
+            model_vectors (numpy array): (layers, num_pairs)
+            brain_vectors (numpy array): (..., num_pairs), e.g. (subjects, [timepoints,] num_pairs)
+
+        Returns:
+            numpy array: (layers, ...)
+        """
+        return np.einsum("lp,...p->l...", model_vectors, brain_vectors)
+
+
+class Spearman(Comparator):
+    """Spearman correlation"""
+
+    name = "spearman"
+
+    def prepare(self, vectors):
+        return standardize(vectors, "spearman")
+
+
+class Pearson(Comparator):
+    """Pearson correlation"""
+
+    name = "pearson"
+
+    def prepare(self, vectors):
+        return standardize(np.asarray(vectors, dtype=np.float64), "pearson")
+
+
+class Cosine(Comparator):
+    """Cosine similarity"""
+
+    name = "cosine"
+
+    def prepare(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def rdm_covariance(num_stimuli):
+    """Covariance of the entries of a (squared Euclidean) RDM when all
+    patterns carry independent noise of equal variance: the squared
+    cross-products of the pair contrasts. Pairs sharing no stimulus are
+    uncorrelated, pairs sharing one stimulus have covariance 1, and the
+    variance is 4.
+
+    Args:
+        num_stimuli (int): number of stimuli
+
+    Returns:
+        numpy array: covariance (num_pairs, num_pairs)
+    """
+    rows, cols = np.triu_indices(num_stimuli, 1)
+    contrasts = np.zeros((len(rows), num_stimuli))
+    contrasts[np.arange(len(rows)), rows] = 1
+    contrasts[np.arange(len(rows)), cols] = -1
+    return np.square(contrasts @ contrasts.T)
+
+
+class WhitenedPearson(Comparator):
+    """Pearson correlation after whitening with the covariance of the RDM
+    entries, which removes the dependence of RDM entries that share a
+    stimulus. The whitening matrix is computed once per number of pairs.
+    """
+
+    name = "whitened_pearson"
+    permutable = False
+
+    def __init__(self, covariance=None):
+        """
+        Args:
+            covariance (numpy array, optional): covariance of the RDM entries (num_pairs, num_pairs).
+                Defaults to rdm_covariance of the number of stimuli.
+        """
+        self.covariance = covariance
+        self._whitening = {}
+
+    def whitening(self, num_pairs):
+        """Inverse square root of the covariance
+
+        Args:
+            num_pairs (int): length of the RDM vectors
+
+        Returns:
+            numpy array: (num_pairs, num_pairs)
+        """
+        if num_pairs not in self._whitening:
+            covariance = self.covariance
+            if covariance is None:
+                num_stimuli = int(round((1 + np.sqrt(1 + 8 * num_pairs)) / 2))
+                covariance = rdm_covariance(num_stimuli)
+            eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+            eigenvalues = np.maximum(eigenvalues, eigenvalues.max() * 1e-12)
+            self._whitening[num_pairs] = (eigenvectors / np.sqrt(eigenvalues)) @ eigenvectors.T
+        return self._whitening[num_pairs]
+
+    def prepare(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        vectors = vectors - vectors.mean(-1, keepdims=True)
+        vectors = vectors @ self.whitening(vectors.shape[-1])
+        return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def _dense_ranks(values):
+    """Dense integer ranks (0, 1, ... for ascending unique values) along the last axis"""
+    shape = values.shape
+    values = values.reshape(-1, shape[-1])
+    order = np.argsort(values, axis=-1)
+    sorted_values = np.take_along_axis(values, order, axis=-1)
+    new_value = np.zeros(values.shape, dtype=np.int64)
+    new_value[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    ranks = np.empty(values.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, np.cumsum(new_value, axis=-1), axis=-1)
+    return ranks.reshape(shape)
+
+
+def _tied_pairs(ranks):
+    """Number of pairs with equal rank in every row of dense ranks"""
+    num_rows, length = ranks.shape
+    counts = np.bincount((ranks + np.arange(num_rows)[:, None] * length).ravel(), minlength=num_rows * length)
+    return (counts * (counts - 1) // 2).reshape(num_rows, length).sum(-1)
+
+
+def _merge_inversions(ranks, block=8):
+    """Inversions of every row of dense integer ranks by a bottom-up merge
+    sort. Inversions within the first blocks are counted by comparing all
+    pairs, which avoids many tiny sorts. Each further level sorts blocks
+    that consist of two sorted runs, which numpy's stable sort merges in
+    linear time."""
+    num_rows, length = ranks.shape
+    size = max(block, 1 << max(0, (length - 1).bit_length()))
+
+    # The ranks are shifted left by one bit: the lowest bit marks the right
+    # run of a block, so on ties the left run sorts first. Padding with the
+    # largest key at the end adds no inversions.
+    dtype = np.int32 if 2 * length < np.iinfo(np.int32).max else np.int64
+    keys = np.full((num_rows, size), 2 * length, dtype=dtype)
+    keys[:, :length] = 2 * ranks
+
+    keys = keys.reshape(num_rows, -1, block)
+    upper = np.triu(np.ones((block, block), dtype=bool), 1)
+    inversions = ((keys[..., :, None] > keys[..., None, :]) & upper).sum(axis=(1, 2, 3))
+    keys.sort(axis=-1)
+
+    width = block
+    while width < size:
+        keys = keys.reshape(num_rows, -1, 2 * width)
+        keys[..., width:] |= 1
+        keys.sort(axis=-1, kind="stable")
+        # The right elements before the k-th left element at merged position p
+        # are p - k, each is smaller than it and came after it. The positions
+        # of the right elements are summed instead, with a matrix product.
+        right_positions = (keys & 1).astype(np.float64) @ np.arange(2 * width, dtype=np.float64)
+        left_positions = keys.shape[1] * width * (2 * width - 1) - right_positions.sum(-1)
+        inversions += np.rint(left_positions).astype(np.int64) - keys.shape[1] * width * (width - 1) // 2
+        keys &= ~1
+        width *= 2
+    return inversions
+
+
+def count_inversions(values):
+    """Number of pairs i < j with values[i] > values[j] in every row, counted
+    with a merge sort in O(n log n) per row
+
+    Args:
+        values (numpy array): (rows, n)
+
+    Returns:
+        numpy array: int inversions per row (rows,)
+    """
+    return _merge_inversions(_dense_ranks(values))
+
+
+def _tau_a(x_ranks, y_ranks):
+    """Kendall tau-a of the dense ranks x_ranks (n,) with every row of y_ranks (rows, n)"""
+    length = len(x_ranks)
+    all_pairs = length * (length - 1) // 2
+
+    # One integer key sorts by x and ties of x by y; equal keys are tied in both
+    joint = np.sort(x_ranks * length + y_ranks, axis=-1)
+    starts = np.ones(joint.shape, dtype=bool)
+    starts[:, 1:] = joint[:, 1:] != joint[:, :-1]
+    first = np.flatnonzero(starts)
+    runs = np.diff(np.append(first, joint.size))
+    joint_ties = np.bincount(first // length, weights=runs * (runs - 1) // 2, minlength=len(joint))
+
+    difference = (all_pairs - _tied_pairs(x_ranks[None])[0] - _tied_pairs(y_ranks) + joint_ties
+                  - 2 * _merge_inversions(joint % length))
+    return difference / all_pairs
+
+
+def kendall_tau_a(x, y):
+    """Kendall tau-a of x with every row of y, (concordant - discordant pairs)
+    / all pairs. Ties count as neither, as recommended for categorical model
+    RDMs. Discordant pairs are counted as inversions of y after sorting by x
+    and y (Knight's algorithm), so the cost is O(n log n) instead of O(n²).
+
+    Args:
+        x (numpy array): (n,)
+        y (numpy array): (rows, n)
+
+    Returns:
+        numpy array: tau-a per row (rows,)
+    """
+    return _tau_a(_dense_ranks(np.asarray(x)), _dense_ranks(np.atleast_2d(y)))
+
+
+class KendallTauA(Comparator):
+    """Kendall tau-a"""
+
+    name = "kendall_tau_a"
+    permutable = False
+
+    def prepare(self, vectors):
+        # Every vector is ranked once, compare only merges
+        return _dense_ranks(np.asarray(vectors))
+
+    def compare(self, model_vectors, brain_vectors):
+        shape = brain_vectors.shape[:-1]
+        brain_vectors = brain_vectors.reshape(-1, brain_vectors.shape[-1])
+        return np.stack([_tau_a(model_vector, brain_vectors).reshape(shape) for model_vector in model_vectors])
+
+
+COMPARATORS = {"spearman": Spearman,
+               "pearson": Pearson,
+               "cosine": Cosine,
+               "kendall_tau_a": KendallTauA,
+               "whitened_pearson": WhitenedPearson}
+
+
+def get_comparator(comparator):
+    """Returns a comparator by name, comparator instances are passed through
+
+    Args:
+        comparator (str or Comparator): one of COMPARATORS or an instance
+
+    Raises:
+        ValueError: If the name is unknown
+
+    Returns:
+        Comparator: the comparator
+    """
+    if isinstance(comparator, Comparator):
+        return comparator
+    name = comparator.lower()
+    if name not in COMPARATORS:
+        raise ValueError(f"Unknown distance metric {comparator}, choose from {list(COMPARATORS)}")
+    return COMPARATORS[name]()
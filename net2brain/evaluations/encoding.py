@@ -3,12 +3,13 @@ import os
 from tqdm import tqdm
 import numpy as np
 import random
-import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.decomposition import IncrementalPCA
 from sklearn.linear_model import LinearRegression
 from scipy.stats import pearsonr, ttest_1samp
 
+from .results_store import ResultsStore
+
 def get_layers_ncondns(feat_path):
     """Function to return facts about the npz-file
 
@@ -66,7 +67,7 @@ def train_regression_per_ROI(trn_x,tst_x,trn_y,tst_y):
         correlation_lst[v] = pearsonr(y_prd[:,v], tst_y[:,v])[0]
     return correlation_lst
 
-def linear_encoding(feat_path, roi_path, model_name, trn_tst_split=0.8, n_folds=3, n_components=100, batch_size=100, just_corr=True, return_correlations = False,random_state=14):
+def linear_encoding(feat_path, roi_path, model_name, trn_tst_split=0.8, n_folds=3, n_components=100, batch_size=100, just_corr=True, return_correlations = False,random_state=14, store=None):
     fold_dict = {}
     corr_dict = {}
     model_name = os.path.basename(feat_path)
@@ -98,7 +99,8 @@ def linear_encoding(feat_path, roi_path, model_name, trn_tst_split=0.8, n_folds=
                     if fold_ii == n_folds-1:
                         corr_dict[layer_id][roi_name] = np.mean(np.array(corr_dict[layer_id][roi_name], dtype=np.float16),axis=0)
                     fold_dict[layer_id][roi_name].append(r)
-    all_rois_df = pd.DataFrame(columns=['ROI', 'Layer', "Model", 'R', '%R2', 'Significance', 'SEM', 'LNC', 'UNC'])
+    columns = ['ROI', 'Layer', "Model", 'R', '%R2', 'Significance', 'SEM', 'LNC', 'UNC']
+    results = ResultsStore()
     for layer_id,layer_dict in fold_dict.items():
         for roi_name,r_lst in layer_dict.items():
             significance = ttest_1samp(r_lst, 0)[1]
@@ -106,14 +108,17 @@ def linear_encoding(feat_path, roi_path, model_name, trn_tst_split=0.8, n_folds=
             output_dict = {"ROI":roi_name,
             "Layer": layer_id,
             "Model": model_name,
-            "R": [R],
-            "%R2": [np.nan],
-            "Significance": [significance],
-            "SEM": [np.nan],
-            "LNC": [np.nan],
-            "UNC": [np.nan]}
-            layer_df = pd.DataFrame.from_dict(output_dict)
-            all_rois_df = pd.concat([all_rois_df, layer_df], ignore_index=True)
+            "R": R,
+            "%R2": np.nan,
+            "Significance": significance,
+            "SEM": np.nan,
+            "LNC": np.nan,
+            "UNC": np.nan}
+            results.append(output_dict)
+    all_rois_df = results.to_dataframe(columns)
+    if store is not None:
+        store.extend(all_rois_df, "linear_encoding")
+        store.flush()
     if return_correlations:
         return all_rois_df,corr_dict
     return all_rois_df
@@ -1,6 +1,8 @@
 import numpy as np
 import h5py
 import os
+import threading
+from collections import OrderedDict
 from scipy import io
 from scipy.spatial.distance import squareform
 import re
@@ -43,11 +45,12 @@ def loadmat(matfile):
         numpy array: loaded file
     """
     try:
-        f = h5py.File(matfile)
+        f = h5py.File(matfile, 'r')
     except (IOError, OSError):
         return io.loadmat(matfile)
-    else:
-        return {name: np.transpose(f.get(name)) for name in f.keys()}
+    with f:
+        # MATLAB v7.3 files are HDF5 with column-major arrays
+        return {name: np.transpose(f[name][()]) for name in f.keys()}
 
 
 def loadnpy(npyfile):
@@ -74,8 +77,8 @@ def loadnpz(npzfile):
     return np.load(npzfile, allow_pickle=True)
 
 
-def load(data_file):
-    """organizing loading functions
+def load_file(data_file):
+    """organizing loading functions, without the cache
 
     Args:
         data_file (str/path): path to roi file
@@ -90,8 +93,177 @@ def load(data_file):
             }.get(ext, loadnpy)(data_file)
 
 
+class RDMCache():
+    """Memoizes loaded RDM files, so that an evaluation opens every file once.
+    Entries are keyed by path, modification time and size, so a rewritten
+    file is loaded again, and the least recently used entries are dropped
+    once the cached arrays exceed max_bytes. The cached arrays are read-only.
+    The cache can be shared by threads.
+
+    The shared rdm_cache lives as long as the process, e.g. a notebook
+    session. rdm_cache.clear() frees the RDMs after an evaluation and
+    rdm_cache.resize(max_bytes) changes its budget, 0 turns it off:
+
+        from net2brain.evaluations.eval_helper import rdm_cache
+        rdm_cache.resize(1 << 30)
+    """
+
+    def __init__(self, max_bytes=256 << 20):
+        """
+        Args:
+            max_bytes (int, optional): memory cap of the cached arrays, 0 to cache nothing.
+                Defaults to 256 MB.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, data_file):
+        path = os.path.abspath(os.fspath(data_file))
+        stat = os.stat(path)
+        return path, stat.st_mtime_ns, stat.st_size
+
+    def load(self, data_file):
+        """Loads a file through the cache
+
+        Args:
+            data_file (str/path): path to .npz, .npy or .mat file
+
+        Returns:
+            dict or numpy array: {key: array} for .npz and .mat files, else the array
+        """
+        key = self._key(data_file)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            self.misses += 1
+
+        data = load_file(data_file)
+        if isinstance(data, np.lib.npyio.NpzFile):
+            # Read all arrays, the NpzFile keeps the file open otherwise
+            with data:
+                data = {name: data[name] for name in data.files}
+        arrays = data.values() if isinstance(data, dict) else [data]
+        nbytes = 0
+        for array in arrays:
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+                nbytes += array.nbytes
+
+        if nbytes <= self.max_bytes:
+            with self._lock:
+                # Drop older versions of the same file and the least recently used entries
+                for old in [k for k in self._entries if k[0] == key[0]]:
+                    self._drop(old)
+                while self._entries and self.nbytes + nbytes > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+                self._entries[key] = (data, nbytes)
+                self.nbytes += nbytes
+        return data
+
+    def _drop(self, key):
+        self.nbytes -= self._entries.pop(key)[1]
+
+    def resize(self, max_bytes):
+        """Changes the memory cap, dropping the least recently used entries
+        that no longer fit
+
+        Args:
+            max_bytes (int): memory cap of the cached arrays, 0 to cache nothing
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._entries and self.nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        """Empties the cache and frees the cached RDMs (unless they are still
+        referenced elsewhere)"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+# Shared by all evaluations, see RDMCache for clearing and resizing it
+rdm_cache = RDMCache()
+
+
+def load(data_file):
+    """organizing loading functions. Files are loaded through the shared
+    rdm_cache, so RSA, WRSA, Searchlight, VPA and the noise ceiling read
+    every file only once.
+
+    Args:
+        data_file (str/path): path to roi file
+
+    Returns:
+        numpy array: loaded file
+    """
+    return rdm_cache.load(data_file)
+
+
+RDM_METADATA = ["stimuli", "metric", "model", "layer", "feature_hash"]
+
+
+def get_rdm(data):
+    """Returns the RDM of a loaded file, no matter if it was saved under the
+    key "rdm" (condensed format) or anonymously (arr_0)
+
+    Args:
+        data (NpzFile or dict): loaded RDM file
+
+    Returns:
+        numpy array: RDM as square matrix or as condensed vector
+    """
+    if "rdm" in data:
+        return data["rdm"]
+    key = list(data.keys())[0]  # You need to access the keys to open a npy file
+    return data[key]
+
+
+def is_condensed(rdm):
+    """Checks if a RDM is stored as condensed upper-triangle vector
+
+    Args:
+        rdm (numpy array): RDM
+
+    Returns:
+        bool: True for a vector, False for a square matrix
+    """
+    return np.ndim(rdm) == 1
+
+
+def load_rdm(data_file, square=False):
+    """Loads a RDM file of either format together with its metadata
+
+    Args:
+        data_file (str/path): path to .npz file
+        square (bool, optional): Return a square matrix, even for condensed files. Defaults to False.
+
+    Returns:
+        numpy array: RDM (condensed vector if stored like that and square is False)
+        dict: metadata of the RDM, empty for the legacy format
+    """
+    with np.load(data_file, allow_pickle=False) as data:
+        rdm = get_rdm(data)
+        metadata = {}
+        for key in RDM_METADATA:
+            if key in data:
+                value = data[key]
+                metadata[key] = value.tolist() if value.ndim else value.item()
+    if square and is_condensed(rdm):
+        rdm = squareform(rdm, force='tomatrix', checks=False)
+    return rdm, metadata
+
+
 def sq(x):
-    """Converts a square-form distance matrix from a vector-form distance vector
+    """Converts a square-form distance matrix from a vector-form distance vector.
+    Condensed RDMs are already vectors and are returned as they are.
 
     Args:
         x (numpy array): numpy array that should be vector
@@ -99,8 +271,113 @@ def sq(x):
     Returns:
         numpy array: numpy array as vector
     """
+    if is_condensed(x):
+        return np.asarray(x)
     return squareform(x, force='tovector', checks=False)
 
+def upper_triangles(rdms):
+    """Vectorizes a stack of RDMs like sq does for a single one
+
+    Args:
+        rdms (numpy array): RDMs (..., num_stimuli, num_stimuli) or condensed (..., num_pairs)
+
+    Returns:
+        numpy array: upper triangles (..., num_pairs)
+    """
+    rdms = np.asarray(rdms)
+    if rdms.ndim >= 2 and rdms.shape[-1] == rdms.shape[-2]:
+        rows, cols = np.triu_indices(rdms.shape[-1], 1)
+        return rdms[..., rows, cols]
+    return rdms
+
+
+def rank_vectors(vectors):
+    """Ranks along the last axis with the average rank for ties, like
+    scipy.stats.rankdata, but for all vectors in one go. NaN stay NaN and
+    are not counted.
+
+    Args:
+        vectors (numpy array): (..., num_pairs), may contain NaN
+
+    Returns:
+        numpy array: ranks (..., num_pairs)
+    """
+    shape = vectors.shape
+    vectors = vectors.reshape(-1, shape[-1])
+    order = np.argsort(vectors, axis=-1, kind="stable")  # NaN are sorted to the end
+    values = np.take_along_axis(vectors, order, axis=-1)
+
+    # Groups of equal values; every row starts a new group
+    starts = np.ones(values.shape, dtype=bool)
+    starts[:, 1:] = values[:, 1:] != values[:, :-1]
+    starts = starts.ravel()
+    group = np.cumsum(starts) - 1
+    first = np.flatnonzero(starts)
+    counts = np.diff(np.append(first, starts.size))
+    position = first % shape[-1]
+    average = position + (counts - 1) / 2. + 1
+
+    ranks = np.empty(vectors.shape)
+    np.put_along_axis(ranks, order, average[group].reshape(vectors.shape), axis=-1)
+    ranks[np.isnan(vectors)] = np.nan
+    return ranks.reshape(shape)
+
+
+def standardize(vectors, method="spearman"):
+    """Ranks (for spearman), centers (not for cosine) and scales the vectors to
+    unit norm along the last axis, so that a dot product of two of them is
+    their correlation (or cosine similarity). NaN are ignored and set to 0
+    afterwards.
+
+    Args:
+        vectors (numpy array): RDM vectors (..., num_pairs), may contain NaN
+        method (str, optional): "spearman", "pearson" or "cosine". Defaults to "spearman".
+
+    Returns:
+        numpy array: standardized vectors (..., num_pairs)
+    """
+    if method == "spearman":
+        vectors = rank_vectors(vectors)
+    if method == "cosine":
+        vectors = np.array(vectors, dtype=np.float64)
+    else:
+        vectors = vectors - np.nanmean(vectors, axis=-1, keepdims=True)
+    vectors /= np.sqrt(np.nansum(np.square(vectors), axis=-1, keepdims=True))
+    return np.nan_to_num(vectors, copy=False)
+
+
+def covariate_basis(covariate_vectors, method="spearman"):
+    """Orthonormal basis of the standardized covariate RDM vectors from a QR
+    factorization. Covariates that are linear combinations of the others are
+    dropped.
+
+    Args:
+        covariate_vectors (numpy array): covariate RDM vectors (covariates, num_pairs)
+        method (str, optional): "spearman", "pearson" or "cosine", see standardize. Defaults to "spearman".
+
+    Returns:
+        numpy array: basis (num_pairs, rank)
+    """
+    covariates = standardize(np.atleast_2d(np.asarray(covariate_vectors, dtype=np.float64)), method)
+    q, r = np.linalg.qr(covariates.T)
+    diagonal = np.abs(np.diag(r))
+    return q[:, diagonal > 1e-10 * diagonal.max()]
+
+
+def residualize(vectors, basis):
+    """Removes the part of the vectors that lies in the span of the basis,
+    i.e. the residuals of a least squares regression on the covariates
+
+    Args:
+        vectors (numpy array): standardized vectors (..., num_pairs)
+        basis (numpy array): orthonormal basis (num_pairs, rank), see covariate_basis
+
+    Returns:
+        numpy array: residuals (..., num_pairs)
+    """
+    return vectors - (vectors @ basis) @ basis.T
+
+
 def error_message(message):
     """Helping function to print an error message
 
@@ -0,0 +1,139 @@
+import os
+import os.path as op
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .noiseceiling import NoiseCeiling
+from .rsa import RSA
+from .comparators import get_comparator
+from .eval_helper import *
+
+
+class Leaderboard():
+    """RSA of many models against all ROIs of one brain RDM folder. The brain
+    side (RDM vectors prepared by the comparator and noise ceilings) is
+    prepared once, and the layers of all models are evaluated in parallel.
+    """
+
+    def __init__(self, model_rdms_paths, brain_rdms_path, model_names=None, n_jobs=None,
+                 distance_metric="spearman"):
+        """Initiate the leaderboard
+
+        Args:
+            model_rdms_paths (list of str/path): one RDM folder per model, as written by RDMCreator
+            brain_rdms_path (str/path): folder with the brain RDMs
+            model_names (list of str, optional): names of the models. Defaults to the folder names.
+            n_jobs (int, optional): number of worker threads. Defaults to the number of cores.
+            distance_metric (str or Comparator, optional): how RDMs are compared, see RSA.
+                Defaults to "spearman".
+
+        Raises:
+            ValueError: If the number of model names does not match the number of folders
+        """
+
+        if isinstance(model_rdms_paths, (str, os.PathLike)):
+            model_rdms_paths = [model_rdms_paths]
+        self.model_rdms_paths = [str(path) for path in model_rdms_paths]
+
+        if model_names is None:
+            model_names = [op.basename(op.normpath(path)) for path in self.model_rdms_paths]
+        if len(model_names) != len(self.model_rdms_paths):
+            raise ValueError(f"Got {len(model_names)} model names for {len(self.model_rdms_paths)} model folders")
+        self.model_names = list(model_names)
+
+        # One RSA per model, all with the same comparator
+        self.comparator = get_comparator(distance_metric)
+        self.brain_rdms_path = str(brain_rdms_path)
+        self.rsas = [RSA(path, self.brain_rdms_path, name, distance_metric=self.comparator)
+                     for path, name in zip(self.model_rdms_paths, self.model_names)]
+        self.brain_rdms = RSA.folderlookup(self.brain_rdms_path)
+        self.n_jobs = n_jobs or os.cpu_count()
+
+        # [(scan_key, is_meg, brain vectors, noise ceiling)], built once
+        self._rois = None
+
+    @property
+    def rois(self):
+        """Brain RDM vectors prepared by the comparator and noise ceiling of every ROI"""
+
+        if self._rois is None:
+            rois = []
+            for counter, roi in enumerate(self.brain_rdms):
+                if "fmri" in roi.lower():
+                    is_meg = False
+                elif "meg" in roi.lower():
+                    is_meg = True
+                else:
+                    raise ValueError(f"No fmri/meg found in ROI-name {roi}")
+
+                roi_path = op.join(self.brain_rdms_path, roi)
+                vectors = self.comparator.prepare(upper_triangles(get_rdm(load(roi_path))))
+                noise_ceiling = NoiseCeiling(roi, roi_path).noise_ceiling()
+                scan_key = "(" + str(counter) + ") " + roi[:-4]
+                rois.append((scan_key, is_meg, vectors, noise_ceiling))
+            self._rois = rois
+        return self._rois
+
+    def evaluate_layer(self, model_rdms_path, layer):
+        """Correlations of one layer with all ROIs
+
+        Args:
+            model_rdms_path (str): RDM folder of the model
+            layer (str): file name of the layer RDM
+
+        Raises:
+            ValueError: If the layer RDM has another number of stimuli than the brain RDMs
+
+        Returns:
+            list: correlation per subject for every ROI
+        """
+
+        model_vectors = self.comparator.prepare(sq(get_rdm(load(op.join(model_rdms_path, layer))))[None])
+        correlations = []
+        for scan_key, is_meg, brain_vectors, _ in self.rois:
+            if brain_vectors.shape[-1] != model_vectors.shape[-1]:
+                raise ValueError(f"{layer} of {model_rdms_path} does not have the stimuli of {scan_key}")
+            corr = self.comparator.compare(model_vectors, brain_vectors)[0]
+            if is_meg:
+                corr = corr.mean(-1)  # over timepoints
+            correlations.append(corr)
+        return correlations
+
+    def evaluate(self, correction=None):
+        """Evaluates every (model, layer, ROI) combination
+
+        Args:
+            correction (str, optional): "bonferroni" to correct over the layers of a model. Defaults to None.
+
+        Returns:
+            pandas DataFrame: results with the columns of RSA.evaluate
+        """
+
+        rois = self.rois
+        model_layers = [rsa.model_rdms for rsa in self.rsas]
+
+        # One task per (model, layer), each correlates the layer with all ROIs
+        tasks = [(path, layer) for path, layers in zip(self.model_rdms_paths, model_layers) for layer in layers]
+        with ThreadPoolExecutor(self.n_jobs) as pool:
+            results = dict(zip(tasks, pool.map(lambda task: self.evaluate_layer(*task), tasks)))
+
+        # Same row order as RSA.evaluate for each model
+        rows = []
+        for model_rdms_path, model_name, layers in zip(self.model_rdms_paths, self.model_names, model_layers):
+            for i, (scan_key, _, _, noise_ceiling) in enumerate(rois):
+                for counter, layer in enumerate(layers):
+                    r2, significance, sem, _ = RSA.r2_statistics(results[(model_rdms_path, layer)][i])
+                    if correction == "bonferroni":
+                        significance = significance * len(layers)
+                    rows.append({"ROI": scan_key,
+                                 "Layer": "(" + str(counter) + ") " + layer,
+                                 "Model": model_name,
+                                 "R2": r2,
+                                 "%R2": (r2 / noise_ceiling["lnc"]) * 100.,
+                                 "Significance": significance,
+                                 "SEM": sem,
+                                 "LNC": noise_ceiling["lnc"],
+                                 "UNC": noise_ceiling["unc"]})
+
+        return pd.DataFrame(rows, columns=['ROI', 'Layer', "Model", 'R2', '%R2', 'Significance', 'SEM', 'LNC', 'UNC'])
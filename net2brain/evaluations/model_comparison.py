@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+def paired_statistics(r2, n_bootstrap=1000, ci=95, seed=0):
+    """Paired comparisons of every model with every other model over the same
+    subjects. The differences of all pairs are one broadcast (models, models,
+    subjects), and the bootstrap resamples the subjects once for all models.
+
+    Args:
+        r2 (numpy array): R² of the best layer of every model per subject (models, subjects)
+        n_bootstrap (int, optional): bootstrap resamples of the subjects, 0 for none. Defaults to 1000.
+        ci (float, optional): confidence level of the bootstrap in percent. Defaults to 95.
+        seed (int, optional): seed of the bootstrap. Defaults to 0.
+
+    Returns:
+        dict: {name: (models, models) array} with the mean difference row minus column
+            ("Difference"), the paired t-statistic ("T") and its two-sided p-value
+            ("Significance"), and with n_bootstrap the bootstrap CI of the difference
+            ("CI_low", "CI_high") and its two-sided bootstrap p-value ("Bootstrap_significance")
+    """
+    num_subjects = r2.shape[1]
+    differences = r2[:, None] - r2[None]
+    mean = differences.mean(-1)
+    sem = differences.std(-1, ddof=1) / np.sqrt(num_subjects)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = mean / sem
+    results = {"Difference": mean,
+               "T": t,
+               "Significance": 2 * stats.t.sf(np.abs(t), num_subjects - 1)}
+
+    if n_bootstrap:
+        rng = np.random.default_rng(seed)
+        indices = rng.integers(0, num_subjects, (n_bootstrap, num_subjects))
+        # Mean over resampled subjects per model, then all differences at once
+        means = r2[:, indices].mean(-1)
+        resampled = means[:, None] - means[None]
+        results["CI_low"] = np.percentile(resampled, (100 - ci) / 2, axis=-1)
+        results["CI_high"] = np.percentile(resampled, 100 - (100 - ci) / 2, axis=-1)
+        tails = np.minimum((resampled <= 0).mean(-1), (resampled >= 0).mean(-1))
+        results["Bootstrap_significance"] = np.minimum(2 * tails, 1.)
+    return results
+
+
+def compare_models(rsas, n_bootstrap=1000, ci=95, seed=0):
+    """Compares the best layers of N models on every ROI. The subject-level
+    correlations of each model come from RSA.roi_correlations, which caches
+    them, so a model that was evaluated before is not correlated again and
+    comparing N models costs N evaluations plus the pairwise statistics.
+
+    Args:
+        rsas (list of RSA): evaluations of the models on the same brain RDMs
+        n_bootstrap (int, optional): bootstrap resamples of the subjects, 0 for none. Defaults to 1000.
+        ci (float, optional): confidence level of the bootstrap in percent. Defaults to 95.
+        seed (int, optional): seed of the bootstrap. Defaults to 0.
+
+    Raises:
+        ValueError: If the model names are not unique or the models were evaluated on other ROIs
+
+    Returns:
+        dict: {name: pandas DataFrame} for every statistic of paired_statistics, with one
+            N x N matrix per ROI (rows indexed by ROI and model, one column per model),
+            and "Layer", the best layer of every model (rows ROI, columns model)
+    """
+    model_names = [rsa.model_name for rsa in rsas]
+    if len(set(model_names)) != len(model_names):
+        raise ValueError(f"The model names are not unique: {model_names}")
+    rois = rsas[0].brain_rdms
+    for rsa in rsas[1:]:
+        if sorted(rsa.brain_rdms) != sorted(rois):
+            raise ValueError(f"{rsa.model_name} was evaluated on other ROIs than {rsas[0].model_name}")
+
+    matrices = {}
+    scan_keys = []
+    best_layers = []
+    for counter, roi in enumerate(rois):
+        r2 = [np.square(rsa.roi_correlations(roi)) for rsa in rsas]
+        if len({layers.shape[1] for layers in r2}) > 1:
+            raise ValueError(f"The models were evaluated on different subjects of {roi}")
+
+        # Best layer of every model by the mean R² over subjects
+        best = [np.argmax(layers.mean(-1)) for layers in r2]
+        results = paired_statistics(np.stack([layers[i] for layers, i in zip(r2, best)]), n_bootstrap, ci, seed)
+
+        scan_keys.append("(" + str(counter) + ") " + roi[:-4])
+        best_layers.append(["(" + str(i) + ") " + rsa.model_rdms[i] for rsa, i in zip(rsas, best)])
+        for name, matrix in results.items():
+            matrices.setdefault(name, []).append(matrix)
+
+    index = pd.MultiIndex.from_product([scan_keys, model_names], names=["ROI", "Model"])
+    comparison = {name: pd.DataFrame(np.concatenate(matrix), index=index, columns=model_names)
+                  for name, matrix in matrices.items()}
+    comparison["Layer"] = pd.DataFrame(best_layers, index=pd.Index(scan_keys, name="ROI"), columns=model_names)
+    return comparison
@@ -107,7 +107,7 @@ class NoiseCeiling():
         Returns:
             dict: {"lnc": lnc, "unc": unc}
         """
-        target = np.load(self.roi_path)
+        target = load(self.roi_path)
         key_list = []
         for keys, values in target.items():
             key_list.append(keys)
@@ -126,7 +126,7 @@ class NoiseCeiling():
         Returns:
             dict: {"lnc": lnc, "unc": unc}
         """
-        target = np.load(self.roi_path)
+        target = load(self.roi_path)
         
         avg_stamps = []
         keys = []
@@ -0,0 +1,253 @@
+import numpy as np
+from scipy.spatial.distance import squareform
+
+from .eval_helper import is_condensed, standardize
+
+
+RESAMPLING_MODES = ["bootstrap", "subsample"]
+
+
+def resample_indices(num_stimuli, n_resamples=1000, mode="bootstrap", fraction=0.8, seed=0):
+    """Draws the stimulus indices of all resamples at once
+
+    Args:
+        num_stimuli (int): number of stimuli of the full RDMs
+        n_resamples (int, optional): number of resamples. Defaults to 1000.
+        mode (str, optional): "bootstrap" (with replacement, same size) or
+            "subsample" (without replacement). Defaults to "bootstrap".
+        fraction (float, optional): share of stimuli per subsample. Defaults to 0.8.
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Raises:
+        ValueError: If the mode is unknown or a subsample has less than 3 stimuli
+
+    Returns:
+        numpy array: indices (n_resamples, num_resampled)
+    """
+    rng = np.random.default_rng(seed)
+    if mode == "bootstrap":
+        return rng.integers(0, num_stimuli, size=(n_resamples, num_stimuli))
+    if mode == "subsample":
+        size = int(round(fraction * num_stimuli))
+        if size < 3:
+            raise ValueError(f"A subsample of {size} stimuli is too small")
+        # argsort of uniform noise gives a random permutation per row
+        order = np.argsort(rng.random((n_resamples, num_stimuli)), axis=1)
+        return np.sort(order[:, :size], axis=1)
+    raise ValueError(f"Unknown resampling mode {mode}, choose from {RESAMPLING_MODES}")
+
+
+def _square(rdm):
+    rdm = np.asarray(rdm)
+    if is_condensed(rdm):
+        rdm = squareform(rdm, force='tomatrix', checks=False)
+    return rdm
+
+
+def dense_ranks(rdm):
+    """Dense integer ranks (0, 1, ... for ascending unique values) of the
+    upper triangle of every RDM, put back into square matrices
+
+    Args:
+        rdm (numpy array): RDM(s) (..., num_stimuli, num_stimuli)
+
+    Returns:
+        numpy array: int ranks (..., num_stimuli, num_stimuli), diagonal 0
+    """
+    rdm = _square(rdm)
+    rows, cols = np.triu_indices(rdm.shape[-1], 1)
+    vectors = rdm[..., rows, cols].reshape(-1, len(rows))
+
+    order = np.argsort(vectors, axis=-1, kind="stable")
+    values = np.take_along_axis(vectors, order, axis=-1)
+    new_value = np.zeros(values.shape, dtype=np.int64)
+    new_value[:, 1:] = values[:, 1:] != values[:, :-1]
+    keys = np.empty_like(new_value)
+    np.put_along_axis(keys, order, np.cumsum(new_value, axis=-1), axis=-1)
+
+    ranks = np.zeros(rdm.shape, dtype=np.int64)
+    keys = keys.reshape(rdm.shape[:-2] + (-1,))
+    ranks[..., rows, cols] = keys
+    ranks[..., cols, rows] = keys
+    return ranks
+
+
+def _resampled_pairs(indices):
+    """Stimulus pairs of the resamples, always from the upper triangle like sq
+    does, which matters for RDMs that are not exactly symmetric"""
+    rows, cols = np.triu_indices(indices.shape[1], 1)
+    rows, cols = indices[:, rows], indices[:, cols]
+    return np.minimum(rows, cols), np.maximum(rows, cols)
+
+
+def resample_rdms(rdm, indices):
+    """Upper triangles of the resampled RDMs, indexed from the full RDM instead
+    of recomputing any distance. Pairs of a stimulus with its own bootstrap
+    duplicate have no defined dissimilarity and are NaN.
+
+    Args:
+        rdm (numpy array): full RDM(s) (..., num_stimuli, num_stimuli) or condensed vector
+        indices (numpy array): stimulus indices (n_resamples, num_resampled)
+
+    Returns:
+        numpy array: resampled RDM vectors (n_resamples, ..., num_pairs)
+    """
+    rows, cols = _resampled_pairs(indices)
+    vectors = np.moveaxis(_square(rdm)[..., rows, cols], -2, 0).astype(np.float64)
+    vectors[_duplicates(rows, cols, vectors.shape)] = np.nan
+    return vectors
+
+
+def resample_ranks(ranks, indices):
+    """Ranks of the resampled RDM vectors (average rank for ties, NaN for
+    duplicate pairs), the same as ranking the output of resample_rdms. The
+    dense ranks of the full RDM are computed once; every resample only takes
+    a subset of them, which is ranked by counting instead of sorting.
+
+    Args:
+        ranks (numpy array): dense_ranks of the full RDM(s) (..., num_stimuli, num_stimuli)
+        indices (numpy array): stimulus indices (n_resamples, num_resampled)
+
+    Returns:
+        numpy array: ranks (n_resamples, ..., num_pairs)
+    """
+    rows, cols = _resampled_pairs(indices)
+    keys = np.moveaxis(ranks[..., rows, cols], -2, 0)
+    shape = keys.shape
+    duplicates = _duplicates(rows, cols, shape).reshape(-1, shape[-1])
+    keys = keys.reshape(-1, shape[-1])
+
+    # Histogram of the keys of every vector, duplicates not counted
+    num_keys = int(ranks.max()) + 1
+    keys = keys + np.arange(len(keys))[:, None] * num_keys
+    counts = np.bincount(keys[~duplicates], minlength=len(keys) * num_keys)
+    counts = counts.reshape(-1, num_keys)
+
+    # Average rank of every key: number of smaller values + (number of ties + 1) / 2
+    average = np.cumsum(counts, axis=-1) - (counts - 1) / 2.
+    result = average.ravel()[keys]
+    result[duplicates] = np.nan
+    return result.reshape(shape)
+
+
+def _duplicates(rows, cols, shape):
+    """Mask of the pairs of a stimulus with itself, broadcast to shape"""
+    duplicates = rows == cols
+    duplicates = duplicates.reshape((len(rows),) + (1,) * (len(shape) - 2) + (-1,))
+    return np.broadcast_to(duplicates, shape)
+
+
+def batched_correlation(model_vectors, brain_vectors, method="spearman", standardized=False):
+    """Correlates the model with the brain RDM vectors of every resample in one
+    go. The NaN pattern is the same for the model and the brain vectors of a
+    resample, so those pairs simply drop out.
+
+    Args:
+        model_vectors (numpy array): (n_resamples, num_pairs)
+        brain_vectors (numpy array): (n_resamples, ..., num_pairs)
+        method (str, optional): "spearman" or "pearson". Defaults to "spearman".
+        standardized (bool, optional): The vectors already went through standardize,
+            e.g. to reuse the brain vectors for many layers. Defaults to False.
+
+    Returns:
+        numpy array: correlations (n_resamples, ...)
+    """
+    if not standardized:
+        model_vectors = standardize(model_vectors, method)
+        brain_vectors = standardize(brain_vectors, method)
+
+    # broadcast the model over the subject/time axes of the brain vectors
+    extra_axes = (1,) * (brain_vectors.ndim - 2)
+    model_vectors = model_vectors.reshape(model_vectors.shape[:1] + extra_axes + model_vectors.shape[-1:])
+    return np.einsum("...p,...p->...", model_vectors, brain_vectors)
+
+
+def permutation_indices(num_stimuli, n_permutations=10000, seed=0):
+    """Random stimulus permutations, one per row
+
+    Args:
+        num_stimuli (int): number of stimuli
+        n_permutations (int, optional): number of permutations. Defaults to 10000.
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        numpy array: permutations (n_permutations, num_stimuli)
+    """
+    rng = np.random.default_rng(seed)
+    return np.argsort(rng.random((n_permutations, num_stimuli)), axis=1)
+
+
+def permutation_test(model_vectors, brain_vectors, n_permutations=10000, batch_size=1000, seed=0):
+    """Stimulus-label permutation test of the mean correlation over subjects.
+    Permuting the stimuli only reorders the pairs of an RDM, so the
+    standardized model vectors are permuted by indexing and never re-ranked.
+    The mean over subjects is linear, so each permutation is a single dot
+    product with the averaged standardized brain vectors. All layers share
+    the same permutations, which the max-statistic correction requires.
+
+    Args:
+        model_vectors (numpy array): standardized model vectors (layers, num_pairs)
+        brain_vectors (numpy array): standardized brain vectors (subjects, [timepoints,] num_pairs)
+        n_permutations (int, optional): number of permutations. Defaults to 10000.
+        batch_size (int, optional): permutations per batch, bounds the memory. Defaults to 1000.
+        seed (int, optional): seed of the permutations. Defaults to 0.
+
+    Returns:
+        numpy array: observed mean correlation per layer (layers,)
+        numpy array: null distribution (layers, n_permutations)
+    """
+    model_vectors = np.atleast_2d(model_vectors)
+    brain_vector = brain_vectors.reshape(-1, brain_vectors.shape[-1]).mean(0)
+    observed = model_vectors @ brain_vector
+
+    model_rdms = squareform_stack(model_vectors)
+    num_stimuli = model_rdms.shape[-1]
+    rows, cols = np.triu_indices(num_stimuli, 1)
+    permutations = permutation_indices(num_stimuli, n_permutations, seed)
+
+    null = np.empty((len(model_vectors), n_permutations))
+    for start in range(0, n_permutations, batch_size):
+        batch = permutations[start:start + batch_size]
+        perm_rows, perm_cols = batch[:, rows], batch[:, cols]
+        for i, model_rdm in enumerate(model_rdms):
+            null[i, start:start + len(batch)] = model_rdm[perm_rows, perm_cols] @ brain_vector
+    return observed, null
+
+
+def permutation_p_values(observed, null):
+    """One-sided p-values of a permutation test, counting the observed
+    statistic as one of the permutations so that p is never 0, and p-values
+    corrected for the family-wise error over layers with the max statistic
+
+    Args:
+        observed (numpy array): statistic per layer (layers,)
+        null (numpy array): null distribution (layers, n_permutations)
+
+    Returns:
+        numpy array: uncorrected p-values (layers,)
+        numpy array: max-statistic FWE corrected p-values (layers,)
+    """
+    # Tolerance for permutations that reproduce the observed value up to rounding
+    tolerance = 1e-12
+    n_permutations = null.shape[1]
+    p = (1 + np.sum(null >= observed[:, None] - tolerance, axis=1)) / (n_permutations + 1)
+    max_null = null.max(0)
+    p_fwe = (1 + np.sum(max_null[None] >= observed[:, None] - tolerance, axis=1)) / (n_permutations + 1)
+    return p, p_fwe
+
+
+def squareform_stack(vectors):
+    """Square symmetric matrices of a stack of upper-triangle vectors
+
+    Args:
+        vectors (numpy array): (..., num_pairs)
+
+    Returns:
+        numpy array: (..., num_stimuli, num_stimuli) with a zero diagonal
+    """
+    num_stimuli = int(round((1 + np.sqrt(1 + 8 * vectors.shape[-1])) / 2))
+    rows, cols = np.triu_indices(num_stimuli, 1)
+    rdms = np.zeros(vectors.shape[:-1] + (num_stimuli, num_stimuli), dtype=vectors.dtype)
+    rdms[..., rows, cols] = vectors
+    rdms[..., cols, rows] = vectors
+    return rdms
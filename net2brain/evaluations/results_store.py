@@ -0,0 +1,173 @@
+import glob
+import os
+import os.path as op
+import time
+import uuid
+from urllib.parse import quote
+
+import pandas as pd
+
+
+class ResultsStore():
+    """Collects evaluation results row by row in columnar buffers, so that
+    building a table of n rows costs O(n) instead of the O(n²) of growing a
+    DataFrame with pd.concat. With a path, flush appends the buffered rows
+    to a Parquet or Feather dataset partitioned by model and ROI
+    (path/Model=.../ROI=.../part-....parquet). Rows are identified by
+    (Model, Layer, ROI, Metric), and a later row replaces an earlier one with
+    the same key, so interrupted sweeps can be resumed.
+    """
+
+    KEY = ["Model", "Layer", "ROI", "Metric"]
+    FORMATS = {"parquet": ".parquet", "feather": ".feather"}
+
+    def __init__(self, path=None, format="parquet"):
+        """
+        Args:
+            path (str/path, optional): folder of the on-disk dataset, None to keep the rows in memory.
+                Defaults to None.
+            format (str, optional): "parquet" or "feather", both need pyarrow. Defaults to "parquet".
+
+        Raises:
+            ValueError: If the format is unknown
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"Unknown format {format}, choose from {list(self.FORMATS)}")
+        self.path = None if path is None else str(path)
+        self.format = format
+        self._columns = {}
+        self._num_rows = 0
+        self._buffered_keys = set()
+        self._stored_keys = None  # keys on disk, read once
+
+    def __len__(self):
+        return self._num_rows
+
+    def append(self, row, metric=None):
+        """Adds one row to the buffers
+
+        Args:
+            row (dict): {column: value}, columns missing in some rows are filled with None
+            metric (str, optional): value of the Metric column. Defaults to None.
+        """
+        if metric is not None:
+            row = dict(row, Metric=metric)
+        for column in row:
+            if column not in self._columns:
+                self._columns[column] = [None] * self._num_rows
+        for column, values in self._columns.items():
+            values.append(row.get(column))
+        self._num_rows += 1
+        self._buffered_keys.add(tuple(row.get(column) for column in self.KEY))
+
+    def extend(self, rows, metric=None):
+        """Adds many rows to the buffers, one column at a time
+
+        Args:
+            rows (pandas DataFrame or dict): table or {column: list of values}
+            metric (str, optional): value of the Metric column. Defaults to None.
+        """
+        columns = {column: list(values) for column, values in dict(rows).items()}
+        num_rows = len(next(iter(columns.values()), []))
+        if metric is not None:
+            columns["Metric"] = [metric] * num_rows
+        for column in columns:
+            if column not in self._columns:
+                self._columns[column] = [None] * self._num_rows
+        for column, values in self._columns.items():
+            values.extend(columns.get(column, [None] * num_rows))
+        self._num_rows += num_rows
+        self._buffered_keys.update(zip(*(columns.get(column, [None] * num_rows) for column in self.KEY)))
+
+    def to_dataframe(self, columns=None):
+        """Buffered rows as a DataFrame, built once from the columns
+
+        Args:
+            columns (list, optional): columns and their order. Defaults to all buffered columns.
+
+        Returns:
+            pandas DataFrame: buffered rows, the last row of every key if the key columns exist
+        """
+        df = pd.DataFrame(self._columns, columns=columns)
+        return self._deduplicate(df)
+
+    def _deduplicate(self, df):
+        if all(column in df for column in self.KEY):
+            df = df.drop_duplicates(self.KEY, keep="last").reset_index(drop=True)
+        return df
+
+    def flush(self):
+        """Appends the buffered rows to the dataset, one file per model and ROI,
+        and empties the buffers. Without a path the rows stay in the buffers.
+        """
+        if self.path is None or not self._num_rows:
+            return
+        df = self.to_dataframe()
+        missing = [column for column in self.KEY if column not in df]
+        if missing:
+            raise ValueError(f"Rows need the columns {missing} to be stored")
+
+        for (model, roi), part in df.groupby(["Model", "ROI"], sort=False):
+            folder = op.join(self.path, "Model=" + quote(str(model), safe=""), "ROI=" + quote(str(roi), safe=""))
+            os.makedirs(folder, exist_ok=True)
+            # Names sort by writing time, so later files replace earlier rows
+            file = op.join(folder, f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}" + self.FORMATS[self.format])
+            part = part.reset_index(drop=True)
+            if self.format == "parquet":
+                part.to_parquet(file, index=False)
+            else:
+                part.to_feather(file)
+
+        if self._stored_keys is not None:
+            self._stored_keys.update(df[self.KEY].itertuples(index=False, name=None))
+        self._columns = {}
+        self._num_rows = 0
+        self._buffered_keys = set()
+
+    def read(self, model=None, roi=None, metric=None):
+        """Reads the stored and the buffered rows, only opening the partitions
+        of model and roi
+
+        Args:
+            model (str, optional): only rows of this model. Defaults to None.
+            roi (str, optional): only rows of this ROI. Defaults to None.
+            metric (str, optional): only rows of this metric. Defaults to None.
+
+        Returns:
+            pandas DataFrame: rows, the last written row of every key
+        """
+        # quote escapes the glob characters of the names
+        folders = ["Model=" + ("*" if model is None else quote(str(model), safe="")),
+                   "ROI=" + ("*" if roi is None else quote(str(roi), safe=""))]
+        files = [] if self.path is None else glob.glob(op.join(self.path, *folders, "part-*" + self.FORMATS[self.format]))
+        files.sort(key=op.basename)
+        read = pd.read_parquet if self.format == "parquet" else pd.read_feather
+        frames = [read(file) for file in files]
+        if all(column in self._columns for column in self.KEY):
+            frames.append(pd.DataFrame(self._columns))
+        if not frames:
+            return pd.DataFrame(columns=self.KEY)
+
+        df = self._deduplicate(pd.concat(frames, ignore_index=True))
+        for column, value in [("Model", model), ("ROI", roi), ("Metric", metric)]:
+            if value is not None:
+                df = df[df[column] == value]
+        return df.reset_index(drop=True)
+
+    def contains(self, model, layer, roi, metric):
+        """Checks if a result is stored or buffered
+
+        Args:
+            model (str): model name
+            layer (str): layer
+            roi (str): ROI
+            metric (str): metric
+
+        Returns:
+            bool: True if the key exists
+        """
+        key = (model, layer, roi, metric)
+        if self._stored_keys is None:
+            self._stored_keys = set(self.read()[self.KEY].itertuples(index=False, name=None))
+        return key in self._stored_keys or key in self._buffered_keys
+
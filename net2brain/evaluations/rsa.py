@@ -3,10 +3,17 @@ import os.path as op
 
 import numpy as np
 import pandas as pd
-from scipy import stats
+from scipy import ndimage, stats
+import statsmodels.stats.multitest
 
 from .noiseceiling import NoiseCeiling
 from .eval_helper import *
+from .resampling import (resample_indices, dense_ranks, resample_ranks, batched_correlation,
+                         permutation_test, permutation_p_values)
+from .temporal_generalization import temporal_generalization, cluster_permutation_test
+from .comparators import get_comparator
+from .model_comparison import compare_models
+from .results_store import ResultsStore
 
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -20,6 +27,9 @@ class RSA():
         """Initiate RSA
         Args:
             json_dir (str/path): Path to json dir
+            distance_metric (str or Comparator, optional): how RDMs are compared, one of
+                "spearman", "pearson", "cosine", "kendall_tau_a" or "whitened_pearson".
+                Defaults to "spearman".
         """
 
         # Find all model RDMs
@@ -40,8 +50,20 @@ class RSA():
         self.other_rdms_path = None
         self.other_rdms = None
 
-        if distance_metric.lower() == "spearman":
+        # Model RDM vectors prepared by the comparator (layers, pairs), built once
+        self._model_vectors = None
+
+        # Correlations of all layers per subject for every evaluated ROI {roi: (layers, subjects)}
+        self._roi_correlations = {}
+
+        # (covariate basis, residualized model vectors) of the last partial RSA
+        self._partial_model = None
+
+        self.comparator = get_comparator(distance_metric)
+        if self.comparator.name == "spearman":
             self.distance = self.model_spearman
+        else:
+            self.distance = self.model_distance
 
     def find_datatype(self, roi):
         """Function to find out if we should apply MEG or FMRI algorithm to the data
@@ -66,10 +88,143 @@ class RSA():
             float: Spearman correlation of model and roi
         """
 
-        model_rdm_sq = sq(model_rdm)
-        return [stats.spearmanr(sq(rdm), model_rdm_sq)[0] for rdm in rdms]
+        model_vector = standardize(sq(model_rdm))
+        return list(standardize(upper_triangles(rdms)) @ model_vector)
+
+    def model_distance(self, model_rdm, rdms):
+        """Compare the model with the ROI using the comparator
+        Args:
+            model_rdm (numpy array): RDM of model
+            rdms (list of numpy arrays): RDMs of ROI
+        Returns:
+            list: value of model and every roi RDM
+        """
+
+        model_vectors = self.comparator.prepare(sq(model_rdm)[None])
+        return list(self.comparator.compare(model_vectors, self.comparator.prepare(upper_triangles(rdms)))[0])
+
+    @property
+    def model_vectors(self):
+        """Upper triangles of all model RDMs prepared by the comparator (layers, pairs),
+        e.g. ranked and z-scored for spearman. Every layer is loaded and prepared
+        once for all ROIs."""
 
-    def folderlookup(self, path):
+        if self._model_vectors is None:
+            self._model_vectors = self.comparator.prepare(
+                np.stack([sq(get_rdm(load(op.join(self.model_rdms_path, layer)))) for layer in self.model_rdms]))
+        return self._model_vectors
+
+    def layer_correlations(self, brain_rdm):
+        """Correlations (or other comparator values) of all layers with all
+        subject (and timepoint) RDMs. Each brain RDM is prepared once, and the
+        comparators based on a dot product need a single batched product.
+        Args:
+            brain_rdm (numpy array): RDMs of ROI (subjects, [timepoints,] stimuli, stimuli)
+        Returns:
+            numpy array: correlations (layers, subjects, [timepoints])
+        """
+
+        brain_vectors = self.comparator.prepare(upper_triangles(brain_rdm))
+        return self.comparator.compare(self.model_vectors, brain_vectors)
+
+    @property
+    def partial_method(self):
+        """Method of standardize for the partial correlations, the comparator name
+
+        Raises:
+            ValueError: If the comparator is not spearman, pearson or cosine
+        """
+
+        if self.comparator.name not in ("spearman", "pearson", "cosine"):
+            raise ValueError(f"Partial correlations do not support the {self.comparator.name} comparator")
+        return self.comparator.name
+
+    def partial_correlations(self, brain_rdm, basis):
+        """Partial correlations (of the comparator) of all layers with all subject
+        (and timepoint) RDMs, controlling for covariate RDMs. The standardized,
+        e.g. ranked for spearman, model and brain vectors are residualized
+        against the covariates and the partial correlations are one batched
+        product of the normalized residuals. The residualized model vectors
+        are cached for the basis.
+        Args:
+            brain_rdm (numpy array): RDMs of ROI (subjects, [timepoints,] stimuli, stimuli)
+            basis (numpy array): basis of the covariates (num_pairs, rank), see covariate_basis
+                with the partial_method
+        Raises:
+            ValueError: If the comparator is not spearman, pearson or cosine
+        Returns:
+            numpy array: partial correlations (layers, subjects, [timepoints])
+            numpy array: standardized regression weights of the layers when the standardized brain
+                RDMs are regressed on the layer and the covariates (layers, subjects, [timepoints])
+        """
+
+        method = self.partial_method
+        if self._partial_model is None or self._partial_model[0] is not basis:
+            model_vectors = standardize(np.stack([sq(get_rdm(load(op.join(self.model_rdms_path, layer))))
+                                                  for layer in self.model_rdms]), method)
+            self._partial_model = (basis, residualize(model_vectors, basis))
+        model_residuals = self._partial_model[1]
+
+        brain_residuals = residualize(standardize(upper_triangles(brain_rdm), method), basis)
+        model_norms = np.linalg.norm(model_residuals, axis=-1)
+        brain_norms = np.linalg.norm(brain_residuals, axis=-1)
+        products = np.einsum("lp,...p->l...", model_residuals, brain_residuals)
+
+        # The standardized vectors have unit norm. A layer or brain RDM explained
+        # by the covariates only keeps rounding errors and gets 0.
+        model_norms[model_norms < 1e-8] = np.inf
+        brain_norms[brain_norms < 1e-8] = np.inf
+        model_norms = model_norms.reshape((-1,) + (1,) * brain_norms.ndim)
+        return products / model_norms / brain_norms, products / np.square(model_norms)
+
+    def evaluate_partial(self, covariate_rdms, correction=None):
+        """Partial-correlation RSA: the unique relation of every layer with every
+        ROI after controlling for covariate RDMs (e.g. pixel or GIST RDMs). The
+        covariates are factorized once for all ROIs and layers. The partial
+        correlations follow the comparator: spearman, pearson or cosine.
+        Args:
+            covariate_rdms (list): covariate RDMs as arrays or paths to RDM files
+            correction (str, optional): "bonferroni" to correct over the layers. Defaults to None.
+        Raises:
+            ValueError: If the comparator is not spearman, pearson or cosine
+            ValueError: If the covariate RDMs have another number of stimuli than the model RDMs
+        Returns:
+            pandas DataFrame: mean partial correlation R, R2 (mean squared partial correlation),
+                Significance and SEM of R2, and the mean standardized regression weight Beta
+        """
+
+        method = self.partial_method
+        covariates = [sq(get_rdm(load(rdm))) if isinstance(rdm, (str, os.PathLike)) else sq(np.asarray(rdm))
+                      for rdm in covariate_rdms]
+        if any(len(covariate) != self.model_vectors.shape[-1] for covariate in covariates):
+            raise ValueError("The covariate RDMs have another number of stimuli than the model RDMs")
+        basis = covariate_basis(np.stack(covariates), method)
+
+        rows = []
+        for counter, roi in enumerate(self.brain_rdms):
+            self.find_datatype(roi)
+            partial, beta = self.partial_correlations(get_rdm(load(op.join(self.brain_rdms_path, roi))), basis)
+            if self.rsa == self.rsa_meg:
+                partial, beta = partial.mean(-1), beta.mean(-1)  # over timepoints
+
+            scan_key = "(" + str(counter) + ") " + roi[:-4]
+            for i, layer in enumerate(self.model_rdms):
+                r2, significance, sem, _ = self.r2_statistics(partial[i])
+                if correction == "bonferroni":
+                    significance = significance * len(self.model_rdms)
+                rows.append({"ROI": scan_key,
+                             "Layer": "(" + str(i) + ") " + layer,
+                             "Model": self.model_name,
+                             "R": partial[i].mean(),
+                             "R2": r2,
+                             "Significance": significance,
+                             "SEM": sem,
+                             "Beta": beta[i].mean()})
+
+        return pd.DataFrame(rows, columns=['ROI', 'Layer', 'Model', 'R', 'R2', 'Significance', 'SEM', 'Beta'])
+
+    @staticmethod
+    def folderlookup(path):
         """Looks at the available files and returns the chosen one
         Args:
             path (str/path): path to folder
@@ -97,27 +252,13 @@ class RSA():
             dict: {layername: [r2, significance, sem]}
         """
 
-        key = list(model_rdm.keys())[0]  # You need to access the keys to open a npy file
-        model_rdm = model_rdm[key]
-        key = list(brain_rdm.keys())[0]  # You need to access the keys to open a npy file
-        meg_rdm = brain_rdm[key]
+        model_rdm = get_rdm(model_rdm)
+        meg_rdm = get_rdm(brain_rdm)
 
         # returns list of corrcoefs, depending on amount of participants in brain rdm
         corr = np.mean([self.distance(model_rdm, rdms)for rdms in meg_rdm], 1)
 
-        # Square correlation
-        corr_squared = np.square(corr)
-
-        # Take mean to retrieve R2
-        r2 = np.mean(corr_squared)
-
-        # ttest: Ttest_1sampResult(statistic=3.921946, pvalue=0.001534)
-        significance = stats.ttest_1samp(corr_squared, 0)[1]
-
-        # standard error of mean
-        sem = stats.sem(corr_squared)  # standard error of mean
-
-        return r2, significance, sem, corr_squared
+        return self.r2_statistics(corr)
 
     def rsa_fmri(self, model_rdm, brain_rdm, layername):
         """Creates the output dictionary for fMRI scans. Returns {layername: R², Significance}
@@ -130,10 +271,8 @@ class RSA():
         """
 
     
-        key = list(model_rdm.keys())[0] # You need to access the keys to open a npy file
-        model_rdm = model_rdm[key]
-        key = list(brain_rdm.keys())[0]  # You need to access the keys to open a npy file
-        fmri_rdm = brain_rdm[key]
+        model_rdm = get_rdm(model_rdm)
+        fmri_rdm = get_rdm(brain_rdm)
    
 
 
@@ -141,6 +280,17 @@ class RSA():
         # returns list of corrcoefs, depending on amount of participants in brain rdm
         corr = self.distance(model_rdm, fmri_rdm)
 
+        return self.r2_statistics(corr)
+
+    @staticmethod
+    def r2_statistics(corr):
+        """R², significance and SEM of the correlations of one layer
+        Args:
+            corr (numpy array): correlation per subject
+        Returns:
+            tuple: r2, significance, sem, corr_squared
+        """
+
         # Square correlation
         corr_squared = np.square(corr)
 
@@ -151,10 +301,28 @@ class RSA():
         significance = stats.ttest_1samp(corr_squared, 0)[1]
 
         # standard error of mean
-        sem = stats.sem(corr_squared)
+        sem = stats.sem(corr_squared)  # standard error of mean
 
         return r2, significance, sem, corr_squared
 
+    def roi_correlations(self, roi):
+        """Correlations of all layers with every subject of a ROI, averaged over
+        timepoints for MEG. They are computed once per ROI and cached, so model
+        comparisons reuse the results of evaluate.
+        Args:
+            roi (str): file name of the ROI
+        Returns:
+            numpy array: correlations (layers, subjects)
+        """
+
+        if roi not in self._roi_correlations:
+            self.find_datatype(roi)
+            correlations = self.layer_correlations(get_rdm(load(op.join(self.brain_rdms_path, roi))))
+            if self.rsa == self.rsa_meg:
+                correlations = correlations.mean(-1)  # over timepoints
+            self._roi_correlations[roi] = correlations
+        return self._roi_correlations[roi]
+
     def evaluate_roi(self, roi):
         """Functiion to evaulate the layers to the current roi , either fmri or meg
         Returns:
@@ -163,16 +331,14 @@ class RSA():
 
         all_layers_dicts = []
 
+        # Correlations of all layers with all subjects at once
+        correlations = self.roi_correlations(roi)
+
         # For each layer to RSA with the current ROI
         for counter, layer in enumerate(self.model_rdms):
 
-            # Load RDMS
-            roi_rdm = load(op.join(self.brain_rdms_path, roi))
-            model_rdm = load(op.join(self.model_rdms_path, layer))
-    
-
             # Calculate Correlations
-            r2, significance, sem, corr_squared = self.rsa(model_rdm, roi_rdm, layer)
+            r2, significance, sem, corr_squared = self.r2_statistics(correlations[counter])
 
             # Add relationship to Noise Ceiling to this data
             lnc = self.this_nc["lnc"]
@@ -195,16 +361,35 @@ class RSA():
 
         return all_layers_dicts
 
-    def evaluate(self,correction=None):
+    def evaluate(self,correction=None, store=None):
         """Function to evaluate all DNN RDMs to all ROI RDMs
+        Args:
+            correction (str, optional): "bonferroni" to correct over the layers. Defaults to None.
+            store (ResultsStore, optional): results are appended to it after every ROI, and ROIs
+                with all layers in it are read instead of evaluated. The store is keyed on the
+                ROI and layer file names, the displayed keys are kept as ROI_label and Layer_label.
+                Defaults to None.
         Returns:
             dict: final dict containing all results
         """
 
-        all_rois_df = pd.DataFrame(columns=['ROI', 'Layer', "Model", 'R2', '%R2', 'Significance', 'SEM', 'LNC', 'UNC'])
+        columns = ['ROI', 'Layer', "Model", 'R2', '%R2', 'Significance', 'SEM', 'LNC', 'UNC']
+        metric = "rsa_" + self.comparator.name + ("_bonferroni" if correction == "bonferroni" else "")
+        results = ResultsStore()
 
         for counter, roi in enumerate(self.brain_rdms):
 
+            # Create dict with these results
+            scan_key = "(" + str(counter) + ") " + roi[:-4]
+
+            # Resume from the store, the displayed keys follow the current folders
+            if store is not None and all(store.contains(self.model_name, layer, roi, metric) for layer in self.model_rdms):
+                stored = store.read(self.model_name, roi, metric).set_index("Layer").loc[self.model_rdms]
+                stored = stored.reset_index().assign(ROI=scan_key, Layer=[
+                    "(" + str(i) + ") " + layer for i, layer in enumerate(self.model_rdms)])
+                results.extend(stored[columns])
+                continue
+
             self.find_datatype(roi)
 
             # Calculate Noise Ceiing for this ROI
@@ -213,55 +398,254 @@ class RSA():
             # Return Correlation Values for this ROI to all model layers
             all_layers_dict = self.evaluate_roi(roi)
 
-            # Create dict with these results
-            scan_key = "(" + str(counter) + ") " + roi[:-4]
-
-            for layer_dict in all_layers_dict:
-                layer_dict["ROI"] = scan_key
-                layer_dict["Model"] = self.model_name
+            for layer, layer_dict in zip(self.model_rdms, all_layers_dict):
                 del layer_dict["R2_array"]
-                layer_df = pd.DataFrame.from_dict(layer_dict)
+                row = {key: values[0] for key, values in layer_dict.items()}
+                row["ROI"] = scan_key
+                row["Model"] = self.model_name
                 if correction == "bonferroni":
-                    layer_df['Significance'] = layer_df['Significance'] * len(all_layers_dict)
-                all_rois_df = pd.concat([all_rois_df, layer_df], ignore_index=True)
-            
-        return all_rois_df
-        
-    def compare_model(self,other_RSA):
-        """Function to evaluate all DNN RDMs to all ROI RDMs
+                    row['Significance'] = row['Significance'] * len(all_layers_dict)
+                results.append(row)
+                if store is not None:
+                    store.append(dict(row, ROI=roi, Layer=layer, ROI_label=scan_key, Layer_label=row["Layer"]), metric)
+
+            if store is not None:
+                store.flush()
+
+        return results.to_dataframe(columns)
+
+    def bootstrap(self, n_resamples=1000, mode="bootstrap", fraction=0.8, seed=0, ci=95,
+                  chunk_size=100, return_distributions=False):
+        """Confidence intervals of R2 over resampled stimulus sets. Every
+        resample is indexed from the full model and brain RDMs, which are
+        loaded once, and the correlations of a whole chunk of resamples are
+        computed in one batched operation. All layers of a ROI share the same
+        resamples. The resamples are ranked by counting, so the bootstrap
+        needs the spearman comparator.
+
+        Args:
+            n_resamples (int, optional): number of resamples. Defaults to 1000.
+            mode (str, optional): "bootstrap" or "subsample". Defaults to "bootstrap".
+            fraction (float, optional): share of stimuli per subsample. Defaults to 0.8.
+            seed (int, optional): seed of the resampling. Defaults to 0.
+            ci (float, optional): confidence level in percent. Defaults to 95.
+            chunk_size (int, optional): resamples per batch, bounds the memory. Defaults to 100.
+            return_distributions (bool, optional): Also return the R2 of every resample. Defaults to False.
+
+        Raises:
+            ValueError: If the RSA uses another comparator than spearman
+
         Returns:
-            dict: final dict containing all results
+            pandas DataFrame: R2 of the full stimulus set, mean, standard error and CI over the resamples
+            dict: {(ROI, Layer): R2 per resample (n_resamples,)}, only if return_distributions
         """
-        
-        comp_dic = dict()
-        sig_pairs = []
-	
-        for counter, roi in enumerate(self.brain_rdms):
+        if self.comparator.name != "spearman":
+            raise ValueError(f"The bootstrap does not support the {self.comparator.name} comparator")
+
+        # Rank every full RDM once, the resamples are ranked by counting
+        model_ranks = [dense_ranks(get_rdm(load(op.join(self.model_rdms_path, layer))))
+                       for layer in self.model_rdms]
 
+        rows = []
+        distributions = {}
+        for counter, roi in enumerate(self.brain_rdms):
             self.find_datatype(roi)
+            brain_ranks = dense_ranks(get_rdm(load(op.join(self.brain_rdms_path, roi))))
+            num_stimuli = brain_ranks.shape[-1]
+            indices = resample_indices(num_stimuli, n_resamples, mode, fraction, seed)
+
+            # The full stimulus set is the first "resample"
+            indices = np.concatenate([np.arange(num_stimuli)[None], indices])
+            r2 = np.empty((len(model_ranks), len(indices)))
+            for start in range(0, len(indices), chunk_size):
+                chunk = indices[start:start + chunk_size]
+                brain_vectors = standardize(resample_ranks(brain_ranks, chunk), "pearson")
+                for i, ranks in enumerate(model_ranks):
+                    model_vectors = standardize(resample_ranks(ranks, chunk), "pearson")
+                    corr = batched_correlation(model_vectors, brain_vectors, standardized=True)
+                    if self.rsa == self.rsa_meg:
+                        corr = corr.mean(-1)  # over timepoints
+                    r2[i, start:start + len(chunk)] = np.square(corr).mean(-1)
 
-            # Calculate Noise Ceiing for this ROI
-            self.this_nc = NoiseCeiling(roi, op.join(self.brain_rdms_path, roi)).noise_ceiling()
+            scan_key = "(" + str(counter) + ") " + roi[:-4]
+            for i, layer in enumerate(self.model_rdms):
+                layer_key = "(" + str(i) + ") " + layer
+                samples = r2[i, 1:]
+                rows.append({"ROI": scan_key,
+                             "Layer": layer_key,
+                             "Model": self.model_name,
+                             "R2": r2[i, 0],
+                             "R2_mean": samples.mean(),
+                             "SE": samples.std(ddof=1),
+                             "CI_low": np.percentile(samples, (100 - ci) / 2),
+                             "CI_high": np.percentile(samples, 100 - (100 - ci) / 2)})
+                distributions[(scan_key, layer_key)] = samples
+
+        df = pd.DataFrame(rows, columns=['ROI', 'Layer', 'Model', 'R2', 'R2_mean', 'SE', 'CI_low', 'CI_high'])
+        if return_distributions:
+            return df, distributions
+        return df
+
+    def time_courses(self, brain_rdm, smoothing=None, downsample=1, time_chunk=100):
+        """Time-resolved correlations of all layers with MEG/EEG RDMs, using the
+        comparator of the RSA. Each timepoint RDM is prepared once and the correlations of a chunk of
+        timepoints come from one batched product.
+        Args:
+            brain_rdm (numpy array): RDMs of ROI (subjects, timepoints, stimuli, stimuli)
+            smoothing (int, optional): width in timepoints of a moving average over the brain RDMs. Defaults to None.
+            downsample (int, optional): keep every n-th timepoint (after smoothing). Defaults to 1.
+            time_chunk (int, optional): timepoints ranked at once, bounds the memory. Defaults to 100.
+        Returns:
+            numpy array: correlations (layers, subjects, timepoints)
+        """
 
-            # Return Correlation Values for this ROI to all model layers
-            model_layers_dict = self.evaluate_roi(roi)
-            
+        brain_vectors = upper_triangles(brain_rdm)
+        if smoothing:
+            brain_vectors = ndimage.uniform_filter1d(brain_vectors.astype(np.float64), size=smoothing,
+                                                     axis=1, mode="nearest")
+        brain_vectors = brain_vectors[:, ::downsample]
+
+        num_subjects, num_timepoints = brain_vectors.shape[:2]
+        correlations = np.empty((len(self.model_rdms), num_subjects, num_timepoints))
+        for start in range(0, num_timepoints, time_chunk):
+            chunk = self.comparator.prepare(brain_vectors[:, start:start + time_chunk])
+            correlations[:, :, start:start + time_chunk] = self.comparator.compare(self.model_vectors, chunk)
+        return correlations
+
+    def evaluate_over_time(self, smoothing=None, downsample=1, metric="R2", time_chunk=100):
+        """Time-resolved RSA of all layers and all MEG/EEG ROIs (RDMs with a time
+        axis). The output can be plotted with Plotting.plotting_over_time.
+        Args:
+            smoothing (int, optional): width in timepoints of a moving average over the brain RDMs. Defaults to None.
+            downsample (int, optional): keep every n-th timepoint (after smoothing). Defaults to 1.
+            metric (str, optional): "R2" for squared or "R" for plain correlations. Defaults to "R2".
+            time_chunk (int, optional): timepoints ranked at once, bounds the memory. Defaults to 100.
+        Returns:
+            pandas DataFrame: Name, Values (subjects, timepoints), Significance (FDR corrected
+                t-test over subjects per timepoint) and Color of every ROI and layer
+        """
 
-            # Calculate Noise Ceiing for this ROI
-            other_RSA.this_nc = NoiseCeiling(roi, op.join(other_RSA.brain_rdms_path, roi)).noise_ceiling()
+        rows = []
+        for roi in self.brain_rdms:
+            brain_rdm = get_rdm(load(op.join(self.brain_rdms_path, roi)))
+            if brain_rdm.ndim != 4:
+                continue  # no time axis
+
+            correlations = self.time_courses(brain_rdm, smoothing, downsample, time_chunk)
+            if metric == "R2":
+                correlations = np.square(correlations)
+
+            significance = stats.ttest_1samp(correlations, 0, axis=1)[1]
+            for layer, values, p_values in zip(self.model_rdms, correlations, significance):
+                rows.append({"Name": roi[:-4] + " " + layer[:-4],
+                             "Values": values,
+                             "Significance": statsmodels.stats.multitest.fdrcorrection(p_values)[1],
+                             "Color": None,
+                             "ROI": roi[:-4],
+                             "Layer": layer,
+                             "Model": self.model_name})
+
+        return pd.DataFrame(rows, columns=['Name', 'Values', 'Significance', 'Color', 'ROI', 'Layer', 'Model'])
+
+    def evaluate_temporal_generalization(self, time_chunk=100, n_permutations=None, p_threshold=0.05, seed=0):
+        """Temporal generalization RSA: correlations (of the comparator) of every brain
+        timepoint with every model timepoint for all MEG/EEG ROIs (RDMs with a time axis).
+        Layer files with a stack of RDMs (e.g. per video frame) are time-resolved,
+        a single RDM counts as one timepoint.
+        Args:
+            time_chunk (int, optional): brain timepoints prepared at once, bounds the memory. Defaults to 100.
+            n_permutations (int, optional): sign-flip permutations of the cluster test, None for no test.
+                Defaults to None.
+            p_threshold (float, optional): cluster-forming p-value. Defaults to 0.05.
+            seed (int, optional): seed of the permutations. Defaults to 0.
+        Returns:
+            pandas DataFrame: ROI, Layer, Model, Values (subjects, brain time, model time) and,
+                with n_permutations, T (t-map) and Significance (cluster p-value per point, 1 outside clusters)
+        """
+
+        rows = []
+        for roi in self.brain_rdms:
+            brain_rdm = get_rdm(load(op.join(self.brain_rdms_path, roi)))
+            if brain_rdm.ndim != 4:
+                continue  # no time axis
+
+            for layer in self.model_rdms:
+                model_rdm = get_rdm(load(op.join(self.model_rdms_path, layer)))
+                maps = temporal_generalization(model_rdm, brain_rdm, time_chunk, self.comparator)
+                row = {"ROI": roi[:-4], "Layer": layer, "Model": self.model_name, "Values": maps}
+
+                if n_permutations:
+                    t_map, labels, p_values = cluster_permutation_test(maps, n_permutations,
+                                                                       p_threshold=p_threshold, seed=seed)
+                    row["T"] = t_map
+                    row["Significance"] = np.concatenate([[1.], p_values])[labels]
+                rows.append(row)
+
+        columns = ['ROI', 'Layer', 'Model', 'Values'] + (['T', 'Significance'] if n_permutations else [])
+        return pd.DataFrame(rows, columns=columns)
+
+    def permutation_test(self, n_permutations=10000, batch_size=1000, seed=0):
+        """Stimulus-label permutation test of every layer and ROI. The statistic
+        is the correlation averaged over subjects (and timepoints).
+        Permutations are index arrays into the prepared model RDMs and are
+        evaluated in batches of matrix operations.
+
+        Args:
+            n_permutations (int, optional): number of permutations. Defaults to 10000.
+            batch_size (int, optional): permutations per batch, bounds the memory. Defaults to 1000.
+            seed (int, optional): seed of the permutations. Defaults to 0.
+
+        Raises:
+            ValueError: If the comparator can not be permuted by indexing (kendall_tau_a, whitened_pearson)
+
+        Returns:
+            pandas DataFrame: mean correlation R, p-value and max-statistic FWE corrected
+                p-value over the layers for every ROI and layer
+        """
+        if not self.comparator.permutable:
+            raise ValueError(f"The permutation test does not support the {self.comparator.name} comparator")
+
+        rows = []
+        for counter, roi in enumerate(self.brain_rdms):
+            brain_vectors = self.comparator.prepare(upper_triangles(get_rdm(load(op.join(self.brain_rdms_path, roi)))))
+            observed, null = permutation_test(self.model_vectors, brain_vectors, n_permutations, batch_size, seed)
+            p, p_fwe = permutation_p_values(observed, null)
 
-            # Return Correlation Values for this ROI to all model layers
-            other_layers_dict = other_RSA.evaluate_roi(roi)
-            
-            model_ii = np.argmin([layer_dict["R2"] for layer_dict in model_layers_dict])            
-            other_ii = np.argmin([layer_dict["R2"] for layer_dict in other_layers_dict])
-            
-            tstat,p = stats.ttest_ind(other_layers_dict[other_ii]["R2_array"],model_layers_dict[model_ii]["R2_array"])
-            
             scan_key = "(" + str(counter) + ") " + roi[:-4]
-               
-            comp_dic[scan_key] = (tstat,p)
-            if p < 0.5:
+            for i, layer in enumerate(self.model_rdms):
+                rows.append({"ROI": scan_key,
+                             "Layer": "(" + str(i) + ") " + layer,
+                             "Model": self.model_name,
+                             "R": observed[i],
+                             "Significance": p[i],
+                             "Significance_FWE": p_fwe[i]})
+
+        return pd.DataFrame(rows, columns=['ROI', 'Layer', 'Model', 'R', 'Significance', 'Significance_FWE'])
+
+    def compare_model(self,other_RSA):
+        """Compares the best layers of this and another model on every ROI
+        with a paired t-test over subjects, see compare_models for N models.
+        The results differ from earlier versions of this method, which took
+        the layer with the lowest R² (argmin), used an independent t-test and
+        counted pairs as significant at p < 0.5. Now the best layer is the one
+        with the highest mean R², the test is paired since both models are
+        evaluated on the same subjects, and the threshold is p < 0.05.
+        Args:
+            other_RSA (RSA): evaluation of the other model on the same brain RDMs
+        Returns:
+            dict: {ROI: (t-statistic, p-value)} of other minus this model
+            list: pairs of (ROI, model name) that differ significantly
+        """
+
+        comparison = compare_models([self, other_RSA], n_bootstrap=0)
+
+        comp_dic = dict()
+        sig_pairs = []
+        for scan_key in comparison["T"].index.unique(level="ROI"):
+            tstat = comparison["T"].loc[(scan_key, other_RSA.model_name), self.model_name]
+            p = comparison["Significance"].loc[(scan_key, other_RSA.model_name), self.model_name]
+            comp_dic[scan_key] = (tstat, p)
+            if p < 0.05:
                 sig_pair = sorted(((scan_key,self.model_name),(scan_key,other_RSA.model_name)), key=lambda element: (element[1]))
                 sig_pairs.append(sig_pair)
         return comp_dic,sig_pairs
@@ -23,7 +23,7 @@ class Searchlight():
         self.model_rdms.sort(key=natural_keys)
 
         # Open Searchlight Path
-        searchlight_rdm = np.load(searchlight_file)['arr_0']
+        searchlight_rdm = load(searchlight_file)['arr_0']
         self.searchlight_rdm = searchlight_rdm.transpose(1, 0, 2, 3)
 
         # Other parameters
@@ -63,6 +63,8 @@ class Searchlight():
             numpy array: only the upper triangle of rdm
         """
 
+        if rdm.ndim == 1:  # already condensed
+            return rdm
         num_conditions = rdm.shape[0]
         return rdm[np.triu_indices(num_conditions, 1)]
 
@@ -270,7 +272,7 @@ class Searchlight():
             self.current_layer = layer
             self.layer_counter = counter
 
-            this_model_rdm = [np.load(op.join(self.model_rdms_path, layer))['arr_0']]
+            this_model_rdm = [get_rdm(load(op.join(self.model_rdms_path, layer)))]
             self.evaluate_searchlight(noise_ceiling, this_model_rdm)
 
         return self.final_dict
@@ -0,0 +1,113 @@
+import numpy as np
+from scipy import ndimage, stats
+
+from .comparators import get_comparator
+from .eval_helper import upper_triangles
+
+
+def time_resolved_vectors(rdms):
+    """Upper triangles of RDMs with a time axis. A single RDM counts as one timepoint.
+
+    Args:
+        rdms (numpy array): (timepoints, stimuli, stimuli), (timepoints, pairs),
+            (stimuli, stimuli) or condensed (pairs,)
+
+    Returns:
+        numpy array: (timepoints, pairs)
+    """
+    rdms = np.asarray(rdms)
+    if rdms.ndim == 1 or (rdms.ndim == 2 and rdms.shape[0] == rdms.shape[1]):
+        rdms = rdms[None]
+    return upper_triangles(rdms)
+
+
+def temporal_generalization(model_rdms, brain_rdms, time_chunk=100, comparator="spearman"):
+    """Correlations (or other comparator values) of every brain timepoint
+    with every model timepoint. The model RDMs are prepared (e.g. ranked)
+    once, the brain RDMs in chunks of timepoints, and each chunk is one
+    comparison, a single product for comparators based on a dot product.
+
+    Args:
+        model_rdms (numpy array): time-resolved model RDMs, see time_resolved_vectors
+        brain_rdms (numpy array): (subjects, brain timepoints, stimuli, stimuli)
+        time_chunk (int, optional): brain timepoints prepared at once, bounds the memory. Defaults to 100.
+        comparator (str or Comparator, optional): comparator of the RDMs, see get_comparator.
+            Defaults to "spearman".
+
+    Raises:
+        ValueError: If the model and brain RDMs have a different number of stimuli
+
+    Returns:
+        numpy array: correlations (subjects, brain timepoints, model timepoints)
+    """
+    comparator = get_comparator(comparator)
+    model_vectors = comparator.prepare(time_resolved_vectors(model_rdms))
+    brain_vectors = upper_triangles(brain_rdms)
+    if brain_vectors.shape[-1] != model_vectors.shape[-1]:
+        raise ValueError("The model and brain RDMs have a different number of stimuli")
+
+    num_subjects, num_timepoints = brain_vectors.shape[:2]
+    maps = np.empty((num_subjects, num_timepoints, len(model_vectors)))
+    for start in range(0, num_timepoints, time_chunk):
+        chunk = comparator.prepare(brain_vectors[:, start:start + time_chunk])
+        maps[:, start:start + time_chunk] = np.moveaxis(comparator.compare(model_vectors, chunk), 0, -1)
+    return maps
+
+
+def _t_values(sums, sums_of_squares, num_subjects):
+    """One-sample t-values from the sums over subjects"""
+    mean = sums / num_subjects
+    variance = (sums_of_squares - num_subjects * np.square(mean)) / (num_subjects - 1)
+    return mean / np.sqrt(np.maximum(variance, 1e-300) / num_subjects)
+
+
+def _cluster_masses(t_map, threshold):
+    """Labels of the suprathreshold clusters and their summed t-values"""
+    labels, num_clusters = ndimage.label(t_map > threshold)
+    if num_clusters == 0:
+        return labels, np.zeros(0)
+    return labels, ndimage.sum_labels(t_map, labels, index=np.arange(1, num_clusters + 1))
+
+
+def cluster_permutation_test(maps, n_permutations=1000, threshold=None, p_threshold=0.05,
+                             batch_size=100, seed=0):
+    """Cluster-based sign-flip permutation test of correlation maps over
+    subjects (one-sided, positive clusters). Under the null hypothesis the
+    maps of every subject are symmetric around 0, so their signs can be
+    flipped. The sums of squares do not change with the signs, so the
+    t-maps of a whole batch of permutations come from one matrix product.
+
+    Args:
+        maps (numpy array): maps of each subject (subjects, ...), e.g. (subjects, brain time, model time)
+        n_permutations (int, optional): number of sign-flip permutations. Defaults to 1000.
+        threshold (float, optional): cluster-forming t-value. Defaults to the t-value of p_threshold.
+        p_threshold (float, optional): one-sided p-value forming clusters if threshold is None. Defaults to 0.05.
+        batch_size (int, optional): permutations per batch, bounds the memory. Defaults to 100.
+        seed (int, optional): seed of the sign flips. Defaults to 0.
+
+    Returns:
+        numpy array: t-values, same shape as one map
+        numpy array: cluster labels (0 outside clusters), same shape as one map
+        numpy array: p-value of every cluster, cluster i has label i + 1
+    """
+    num_subjects = maps.shape[0]
+    shape = maps.shape[1:]
+    flat = maps.reshape(num_subjects, -1)
+    if threshold is None:
+        threshold = stats.t.ppf(1 - p_threshold, num_subjects - 1)
+
+    sums_of_squares = np.square(flat).sum(0)
+    t_map = _t_values(flat.sum(0), sums_of_squares, num_subjects).reshape(shape)
+    labels, masses = _cluster_masses(t_map, threshold)
+
+    rng = np.random.default_rng(seed)
+    max_masses = np.empty(n_permutations)
+    for start in range(0, n_permutations, batch_size):
+        signs = rng.choice([-1., 1.], size=(min(batch_size, n_permutations - start), num_subjects))
+        t_maps = _t_values(signs @ flat, sums_of_squares, num_subjects)
+        for i, t_values in enumerate(t_maps):
+            permuted_masses = _cluster_masses(t_values.reshape(shape), threshold)[1]
+            max_masses[start + i] = permuted_masses.max() if len(permuted_masses) else 0.
+
+    p_values = (1 + np.sum(max_masses[None] >= masses[:, None], axis=1)) / (n_permutations + 1)
+    return t_map, labels, p_values
@@ -152,6 +152,8 @@ class VPA():
         Returns:
             rdm (array): Returns the upper triangular
         """
+        if rdm.ndim == 1:  # already condensed
+            return rdm
         num_conditions = rdm.shape[0]
         return rdm[np.triu_indices(num_conditions,1)]
     
@@ -5,9 +5,9 @@ import numpy as np
 from scipy import stats
 from sklearn.model_selection import KFold
 import rsatoolbox
-import pandas as pd
 
 from .noiseceiling import NoiseCeiling
+from .results_store import ResultsStore
 from .eval_helper import *
 
 
@@ -47,6 +47,8 @@ class WRSA():
             numpy array: only the upper triangle of rdm
         """
 
+        if rdm.ndim == 1:  # already condensed
+            return rdm
         num_conditions = rdm.shape[0]
         return rdm[np.triu_indices(num_conditions, 1)]
 
@@ -81,12 +83,12 @@ class WRSA():
         layers_upper = []
         for layer in self.model_rdms:
             layer_dict = load(op.join(self.model_rdms_path, layer))
-            layer_RDM = layer_dict["arr_0"]
+            layer_RDM = get_rdm(layer_dict)
             layers_upper.append(self.get_uppertriangular(layer_RDM))
 
         """Do the same with the current ROI"""
         roi_dict = load(op.join(self.brain_rdms_path, this_roi))
-        roi_RDM = roi_dict["arr_0"]
+        roi_RDM = get_rdm(roi_dict)
 
         """Turn ROIs into arrays of upper triangle"""
         roi_upper = []
@@ -167,17 +169,29 @@ class WRSA():
                        "UNC": [self.this_nc["unc"]]}
         return output_dict
 
-    def evaluate(self):
+    def evaluate(self, store=None):
         """Function to evaluate all DNN RDMs to all ROI RDMs
 
+        Args:
+            store (ResultsStore, optional): results are appended to it after every ROI, and ROIs
+                already in it are read instead of evaluated. The store is keyed on the ROI file
+                name, the displayed key is kept as ROI_label. Defaults to None.
+
         Returns:
             dict: final dict containing all results
         """
 
-        all_rois_df = pd.DataFrame(columns=['ROI', 'Layer', "Model", 'R2', '%R2', 'Significance', 'SEM', 'LNC', 'UNC'])
+        columns = ['ROI', 'Layer', "Model", 'R2', '%R2', 'Significance', 'SEM', 'LNC', 'UNC']
+        results = ResultsStore()
 
         for counter, roi in enumerate(self.brain_rdms):
 
+            # Resume from the store, the displayed key follows the current folder
+            scan_key = "(" + str(counter) + ") " + roi[:-4]
+            if store is not None and store.contains(self.model_name, "All", roi, "wrsa"):
+                results.extend(store.read(self.model_name, roi, "wrsa").assign(ROI=scan_key)[columns])
+                continue
+
             # Calculate Noise Ceiing for this ROI
             self.this_nc = NoiseCeiling(roi, op.join(self.brain_rdms_path, roi)).noise_ceiling()
 
@@ -185,10 +199,12 @@ class WRSA():
             layer_dict = self.create_weighted_model(roi)
 
             # Create dict with these results
-            scan_key = "(" + str(counter) + ") " + roi[:-4]
-            layer_dict["ROI"] = scan_key
-            layer_dict["Model"] = self.model_name
-            layer_df = pd.DataFrame.from_dict(layer_dict)
-            all_rois_df = pd.concat([all_rois_df, layer_df], ignore_index=True)
-
-        return all_rois_df
+            row = {key: values[0] for key, values in layer_dict.items()}
+            row["ROI"] = scan_key
+            row["Model"] = self.model_name
+            results.append(row)
+            if store is not None:
+                store.append(dict(row, ROI=roi, ROI_label=scan_key), "wrsa")
+                store.flush()
+
+        return results.to_dataframe(columns)
@@ -1,13 +1,19 @@
 from collections import defaultdict
 from datetime import datetime
+import copy
+import io
+import itertools
 import os.path as op
 import os
 from pathlib import Path
+import time
 from pprint import pprint
 from PIL import Image
 import pandas as pd
+import warnings
 
 import numpy as np
+from scipy import stats
 from rsatoolbox.data.dataset import Dataset
 import torch
 import torch.nn as nn
@@ -25,6 +31,8 @@ import net2brain.architectures.unet_models as unet
 import net2brain.architectures.yolo_models as yolo
 import net2brain.architectures.toolbox_models as toolbox_models
 import net2brain.architectures.cornet_models as cornet_models
+from net2brain.architectures.taxonomy import get_catalog
+from net2brain.rdm_creation import pearson_rdm
 import random
 
 
@@ -82,26 +90,23 @@ BRAIN_DIR = op.join(INPUTS_DIR, 'brain_data')
 
 
 def open_taxonomy():
+    """Returns the model taxonomy as dataframe. The csv is only parsed once
+    per installation, see net2brain.architectures.taxonomy.
 
-    file_path = os.path.abspath(__file__)
-    directory_path = os.path.dirname(file_path)
-
-    taxonomy_path = os.path.join(directory_path, "architectures/taxonomy.csv")
-
-    # Read the CSV file
-    df = pd.read_csv(taxonomy_path)
-
-    # Replace "x" with 1 and empty cells with 0
-    df = df.replace({'x': 1, '': 0, pd.NA: 0})
-
-    # Drop the 'Unnamed: 34' column if it exists
-    if 'Unnamed: 34' in df.columns:
-        df = df.drop(columns=['Unnamed: 34'])
-
-    return df
-
+    Returns
+    -------
+    pandas DataFrame
+        Taxonomy of all models in the model zoo.
+    """
+    return get_catalog().to_frame()
 
 
+def _drop_empty_columns(df):
+    """Drops columns that do not contain a "1" in any row, except for "Model"
+    and "Netset".
+    """
+    columns_to_drop = [col for col in df.columns if col not in ['Model', 'Netset'] and not (df[col] == 1).any()]
+    return df.drop(columns=columns_to_drop)
 
 
 def show_all_architectures():
@@ -161,7 +166,8 @@ def print_netset_models(netset):
 
 def find_model_like_name(model_name, df=None):
     """Find models containing the given string. Way of finding a model within \
-        the model zoo.
+        the model zoo. The string is matched literally (no regular expression)
+        and case insensitive, with and without df.
 
     Parameters
     ----------
@@ -169,75 +175,61 @@ def find_model_like_name(model_name, df=None):
         Name models.
     """
 
-    # Get taxnomy df:
-
     if df is None:
-        df = open_taxonomy()
-
-    # Filter the DataFrame based on whether the model_name is a substring of the 'Model' column values
-    similar_models_df = df[df['Model'].str.contains(model_name, case=False)]
-
-    # Drop columns that do not contain a "1" in any row, except for "Model" and "Netset"
-    columns_to_drop = [col for col in similar_models_df.columns if col not in ['Model', 'Netset'] and not (similar_models_df[col] == 1).any()]
-    similar_models_df = similar_models_df.drop(columns=columns_to_drop)
+        # Look the name up in the catalog index instead of scanning the csv
+        catalog = get_catalog()
+        similar_models_df = catalog.to_frame(catalog.name_bits(model_name))
+    else:
+        # Filter the DataFrame based on whether the model_name is a substring of the 'Model' column values
+        similar_models_df = df[df['Model'].str.contains(model_name, case=False, regex=False)]
 
-    return similar_models_df
+    return _drop_empty_columns(similar_models_df)
 
 
 def find_model_by_custom(category, model_name=None):
-    df = open_taxonomy()
+    catalog = get_catalog()
 
     try:
-        if isinstance(category, list):
-            # Filter the DataFrame based on whether all of the category columns have a 1
-            filtered_df = df[df[category].eq(1).all(axis=1)]
-        else:
-            # Filter the DataFrame based on whether the category column has a 1
-            filtered_df = df[df[category] == 1]
+        # AND over all requested category columns
+        bitset = catalog.query_bits(all_of=category, name=model_name)
     except KeyError:
         print(f"Column '{category}' not found in the DataFrame.")
         print("Available columns are:")
-        print(df.columns.tolist())
+        print(catalog.df.columns.tolist())
         return None
 
-    if model_name != None:
-        # Apply the find_model_like_name functionality to the filtered DataFrame
-        result = find_model_like_name(model_name, filtered_df)
-    else:
-        result = filtered_df
-
-    # Drop columns that do not contain a "1" in any row, except for "Model" and "Netset"
-    columns_to_drop = [col for col in result.columns if col not in ['Model', 'Netset'] and not (result[col] == 1).any()]
-    result = result.drop(columns=columns_to_drop)
-
-    return result
-
+    return _drop_empty_columns(catalog.to_frame(bitset))
 
 
+def find_models(all_of=None, any_of=None, name=None, installed_only=True):
+    """Multi-category query over the model zoo.
 
-def show_taxonomy():
-    df = open_taxonomy()
+    Parameters
+    ----------
+    all_of : str or list, optional
+        Taxonomy columns that all need to apply (AND).
+    any_of : str or list, optional
+        Taxonomy columns of which at least one needs to apply (OR).
+    name : str, optional
+        Substring of the model name.
+    installed_only : bool, optional
+        Only return models that are in AVAILABLE_NETWORKS, by default True.
 
-    # Filter rows where 'Header' equals 'Header Category'
-    filtered_df = df.loc[df['Header'] == 'Header Category']
+    Returns
+    -------
+    list
+        (netset, model) tuples that can be passed to the FeatureExtractor.
+    """
+    catalog = get_catalog()
+    if installed_only:
+        return list(catalog.sweep(AVAILABLE_NETWORKS, all_of=all_of, any_of=any_of, name=name))
+    return catalog.query(all_of=all_of, any_of=any_of, name=name)
 
-    # Get unique values from the filtered DataFrame
-    unique_values = list(set(filtered_df.values.flatten()))
-    unique_values = [str(x) for x in unique_values]
 
-    # Remove columns if they exist in the unique_values list
-    columns_to_remove = ['Header Category', 'nan', 'Model', 'Netset']
-    for column in columns_to_remove:
-        if column in unique_values:
-            unique_values.remove(column)
 
-    # Create a dictionary with unique values as keys and corresponding column names as values
-    result = {}
-    for value in unique_values:
-        columns_with_value = filtered_df.columns[filtered_df.eq(value).any()].tolist()
-        result[value] = columns_with_value
 
-    pprint(result)
+def show_taxonomy():
+    pprint(get_catalog().categories)
 
 
 
@@ -312,6 +304,8 @@ class FeatureExtractor:
         else:
             self.device = device
         self.pretrained = pretrained
+        self.netset = netset
+        self.init_layers_to_extract = layers_to_extract
         
         # Load model from netset or load custom model
         if type(model) == str:
@@ -696,7 +690,8 @@ class FeatureExtractor:
 
 
     def extract(
-        self, dataset_path, save_format='npz', save_path=None, layers_to_extract=None):
+        self, dataset_path, save_format='npz', save_path=None, layers_to_extract=None,
+        disk_budget=None, ram_budget=None):
         """Compute feature extraction from image dataset.
 
         Parameters
@@ -712,8 +707,21 @@ class FeatureExtractor:
             Path to save the features to. If None, the folder where the
             features are saved is named after the current date in the 
             format "{year}_{month}_{day}_{hour}_{minute}".    
+        disk_budget : int, optional
+            Maximum number of bytes the features may take on disk. If the
+            estimate of plan_extraction exceeds it, nothing is extracted.
+        ram_budget : int, optional
+            Maximum number of bytes the extraction may hold in memory.
         
         """
+        # Refuse to start if the extraction will not fit the budget
+        if disk_budget is not None or ram_budget is not None:
+            self.plan_extraction(
+                dataset_path, save_format=save_format,
+                layers_to_extract=layers_to_extract, disk_budget=disk_budget,
+                ram_budget=ram_budget, strict=True
+            )
+
         # Define save parameters
         self.save_format = save_format
         if save_path is None:
@@ -728,11 +736,7 @@ class FeatureExtractor:
             self.layers_to_extract = layers_to_extract
 
         # Find all input files
-        image_files = [
-            i for i in Path(dataset_path).iterdir() 
-            if i.suffix in ['.jpeg', '.jpg', '.png']
-        ]
-        image_files.sort()
+        image_files = find_image_files(dataset_path)
 
         # Extract features from images
         if image_files != []:
@@ -745,34 +749,305 @@ class FeatureExtractor:
         return fts
 
 
-    def _extract_from_images(self, image_files):
+    def extract_from_stimuli(
+        self, stimuli, stimulus_ids=None, save_format=None, save_path=None,
+        layers_to_extract=None, batch_size=1):
+        """Compute feature extraction from stimuli held in memory.
+
+        Parameters
+        ----------
+        stimuli : iterable
+            Images as PIL Images, numpy arrays ([H, W] or [H, W, C], uint8 or
+            floats in [0, 1]), torch Tensors ([C, H, W]) or paths.
+        stimulus_ids : list of str, optional
+            Names of the stimuli, by default their position in stimuli.
+        save_format : str, optional
+            If None (default) the features are only returned. Otherwise they
+            are saved like in extract ('npz', 'pt' or 'dataset').
+        save_path : str or pathlib.Path, optional
+            Path to save the features to if save_format is given.
+        layers_to_extract : list, optional
+            Layers to extract, by default the layers of the extractor.
+        batch_size : int, optional
+            Number of stimuli passed through the model at once, by default 1.
+
+        Returns
+        -------
+        dict
+            If save_format is None, {layer: Tensor [n_stimuli, ...]}. Else
+            the same as extract.
+        """
+        if layers_to_extract is not None:
+            self.layers_to_extract = layers_to_extract
+
+        if save_format is None:
+            all_fts = defaultdict(list)
+            for _, fts in self.iter_features(stimuli, stimulus_ids, batch_size):
+                for l in fts.keys():
+                    all_fts[l].append(fts[l])
+            return {l: torch.cat(v) for l, v in all_fts.items()}
+
+        self.save_format = save_format
+        if save_path is None:
+            self.save_path = create_save_path()
+        else:
+            self.save_path = Path(save_path)
+            self.save_path.mkdir(parents=True, exist_ok=True)
+
+        return self._extract_from_images(list(stimuli), stimulus_ids, batch_size)
+
+    def iter_features(self, stimuli, stimulus_ids=None, batch_size=1):
+        """Streams features as they are computed, without touching the disk.
+
+        Parameters
+        ----------
+        stimuli : iterable
+            Paths, PIL Images, numpy arrays or torch Tensors, see
+            extract_from_stimuli. May be a generator.
+        stimulus_ids : iterable of str, optional
+            Names of the stimuli. By default the file stem for paths and the
+            running index otherwise.
+        batch_size : int, optional
+            Number of stimuli passed through the model at once, by default 1.
+            Stimuli are yielded one by one either way.
+
+        Yields
+        ------
+        (str, dict of Torch Tensors)
+            Stimulus id and its features by layer.
+        """
+        ids = iter(stimulus_ids) if stimulus_ids is not None else None
+        batch = []
+
+        for counter, stimulus in enumerate(stimuli):
+            if ids is not None:
+                stimulus_id = str(next(ids))
+            elif isinstance(stimulus, (str, Path)):
+                stimulus_id = Path(stimulus).stem
+            else:
+                stimulus_id = str(counter)
+            batch.append((stimulus_id, stimulus))
+
+            if len(batch) == batch_size:
+                yield from self._extract_batch(batch)
+                batch = []
+
+        if batch:
+            yield from self._extract_batch(batch)
+
+    def _extract_batch(self, batch):
+        """Preprocesses a batch of stimuli and extracts their features.
+
+        Parameters
+        ----------
+        batch : list of (str, stimulus)
+            Stimulus ids and stimuli.
+
+        Yields
+        ------
+        (str, dict of Torch Tensors)
+            Stimulus id and its features by layer.
+        """
+        processed = [
+            self.preprocess(_as_image_input(s), self.model_name, self.device)
+            for _, s in batch
+        ]
+        yield from self._forward_batch([stimulus_id for stimulus_id, _ in batch], processed)
+
+    def _forward_batch(self, stimulus_ids, processed):
+        """Extracts the features of already preprocessed stimuli.
+
+        Parameters
+        ----------
+        stimulus_ids : list of str
+            Stimulus ids.
+        processed : list
+            Outputs of the preprocess function.
+
+        Yields
+        ------
+        (str, dict of Torch Tensors)
+            Stimulus id and its features by layer.
+        """
+        # Plain image tensors of equal shape go through the model together,
+        # everything else (e.g. CLIP's image/text tuples) one by one
+        stackable = (
+            len(processed) > 1
+            and all(isinstance(p, torch.Tensor) for p in processed)
+            and len({tuple(p.shape) for p in processed}) == 1
+        )
+        if stackable:
+            fts = self._extractor(torch.cat(processed))
+            for i, stimulus_id in enumerate(stimulus_ids):
+                yield stimulus_id, {k: v[i:i + 1].clone() for k, v in fts.items()}
+        else:
+            for stimulus_id, p in zip(stimulus_ids, processed):
+                yield stimulus_id, self._extractor(p)
+
+    def _load_random_model(self, seed, base_model=None):
+        """Replaces the model by a freshly initialized copy of the same
+        architecture. Seeding happens right before the initialization, so the
+        same seed always gives the same weights.
+
+        Parameters
+        ----------
+        seed : int
+            Seed of the initialization.
+        base_model : PyTorch model, optional
+            For custom models: model to copy and re-initialize.
+        """
+        set_seed(seed)
+        if self.netset is None:
+            self.model = copy.deepcopy(base_model)
+            for m in self.model.modules():
+                if hasattr(m, 'reset_parameters'):
+                    m.reset_parameters()
+            self.model.apply(randomize_weights)
+            self.model.to(self.device)
+        else:
+            pretrained = self.pretrained
+            self.pretrained = False
+            try:
+                self.load_netset_model(
+                    self.model_name, self.netset, self.init_layers_to_extract
+                )
+            finally:
+                self.pretrained = pretrained
+        self.model.eval()
+
+    def extract_random_ensemble(
+        self, stimuli, seeds, output='rdm', save_path=None, batch_size=1,
+        stimulus_ids=None):
+        """Extracts features from several randomly initialized copies of the
+        model, e.g. as control for analyses with the trained network.
+
+        The stimuli are decoded and preprocessed only once and shared by all
+        copies. The copies are created one after another with their own seed,
+        so only one of them is in memory at a time.
+
+        Parameters
+        ----------
+        stimuli : str, pathlib.Path or iterable
+            Folder with images or stimuli as accepted by iter_features.
+        seeds : list of int
+            One seed per random copy, every seed at most once.
+        output : str, optional
+            'rdm' (default) to compute one pearson RDM per layer and seed,
+            'features' to return the features themselves.
+        save_path : str or pathlib.Path, optional
+            If given, the RDMs are saved as save_path/seed_{seed}/{layer}.npz
+            in the format of the RDMCreator.
+        batch_size : int, optional
+            Number of stimuli passed through the model at once, by default 1.
+        stimulus_ids : list of str, optional
+            Names of the stimuli.
+
+        Returns
+        -------
+        dict
+            {seed: {layer: RDM or Tensor [n_stimuli, ...]}}
+
+        Raises
+        ------
+        ValueError
+            If output is unknown or a seed is repeated, as the results are
+            keyed (and saved) by seed.
+        """
+        if output not in ['rdm', 'features']:
+            raise ValueError(f"output must be 'rdm' or 'features', not '{output}'")
+        seeds = list(seeds)
+        repeated = sorted({seed for seed in seeds if seeds.count(seed) > 1})
+        if repeated:
+            raise ValueError(f"Every seed can only be used once, repeated seeds: {repeated}")
+
+        if isinstance(stimuli, (str, Path)):
+            stimuli = find_image_files(stimuli)
+            if stimulus_ids is None:
+                stimulus_ids = [s.stem for s in stimuli]
+        stimuli = list(stimuli)
+        if stimulus_ids is None:
+            stimulus_ids = [str(i) for i in range(len(stimuli))]
+
+        # Decode and preprocess once for all seeds
+        processed = [
+            self.preprocess(_as_image_input(s), self.model_name, self.device)
+            for s in stimuli
+        ]
+
+        trained_model = self.model
+        trained_attributes = {
+            k: getattr(self, k) for k in
+            ['module', 'preprocess', '_extractor', '_features_cleaner', 'layers_to_extract']
+            if hasattr(self, k)
+        }
+
+        results = {}
+        try:
+            for seed in tqdm(seeds):
+                self._load_random_model(seed, base_model=trained_model)
+
+                all_fts = defaultdict(list)
+                with torch.no_grad():
+                    for start in range(0, len(processed), batch_size):
+                        for _, fts in self._forward_batch(
+                            stimulus_ids[start:start + batch_size],
+                            processed[start:start + batch_size]
+                        ):
+                            for l in fts.keys():
+                                all_fts[l].append(fts[l])
+                fts = {l: torch.cat(v) for l, v in all_fts.items()}
+
+                if output == 'features':
+                    results[seed] = fts
+                    continue
+
+                rdms = {
+                    l: pearson_rdm(torch.flatten(v, start_dim=1).numpy())
+                    for l, v in fts.items()
+                }
+                if save_path is not None:
+                    seed_path = Path(save_path) / f'seed_{seed}'
+                    seed_path.mkdir(parents=True, exist_ok=True)
+                    for l, rdm in rdms.items():
+                        np.savez(seed_path / f'{l}.npz', rdm)
+                results[seed] = rdms
+        finally:
+            # Restore the model the extractor was created with
+            self.model = trained_model
+            for k, v in trained_attributes.items():
+                setattr(self, k, v)
+
+        return results
+
+    def _extract_from_images(self, image_files, stimulus_ids=None, batch_size=1):
         ## TODO: check no weird network names for saving
         
         if self.save_format == 'dataset':
             all_fts = defaultdict(list)
+            all_ids = []
 
-        for img in tqdm(image_files):
-            
-            # Preprocess image and extract features
-            processsed_img = self.preprocess(img, self.model_name, self.device)
-            fts = self._extractor(processsed_img)
+        for stimulus_id, fts in tqdm(
+            self.iter_features(image_files, stimulus_ids, batch_size),
+            total=len(image_files)
+        ):
 
             # Save features if npz or pt
             if self.save_format == 'npz':
                 fts = {k: v.detach().numpy() for k, v in fts.items()}
-                filename = self.save_path / f'{self.model_name}_{img.stem}.npz'
+                filename = self.save_path / f'{self.model_name}_{stimulus_id}.npz'
                 np.savez(filename, **fts)
             elif self.save_format == 'pt':
-                filename = self.save_path / f'{self.model_name}_{img.stem}.pt'
+                filename = self.save_path / f'{self.model_name}_{stimulus_id}.pt'
                 torch.save(fts, filename)
             # Add features to dictionary if dataset
             elif self.save_format == 'dataset':
+                all_ids.append(stimulus_id)
                 for l in fts.keys():
                     all_fts[l].append(fts[l])
 
         # Save and return features per layer in rsa toolbox format 
         if self.save_format == 'dataset':
-            obs_imgs = {'images': np.array([i.stem for i in image_files])}
+            obs_imgs = {'images': np.array(all_ids)}
             fts_datasets = {}
             for l in all_fts.keys():
                 d = torch.flatten(torch.stack(all_fts[l]), start_dim=1)
@@ -788,6 +1063,132 @@ class FeatureExtractor:
             return
 
 
+    def quantize(self, mode='dynamic', calibration_stimuli=None, n_calibration=32):
+        """Replaces the model by an int8 quantized copy for faster CPU
+        inference. Quantized modules keep their names, so the layers to
+        extract stay the same. The float model is kept as self.float_model.
+
+        Parameters
+        ----------
+        mode : str, optional
+            'dynamic' (default) quantizes the weights of all Linear layers
+            and the activations on the fly. 'static' additionally quantizes
+            Conv2d layers, with activation ranges taken from a calibration
+            pass.
+        calibration_stimuli : str, pathlib.Path or iterable, optional
+            Folder or stimuli for the calibration pass. Required for 'static'.
+        n_calibration : int, optional
+            Maximum number of stimuli used for calibration, by default 32.
+
+        Returns
+        -------
+        PyTorch model
+            The quantized model.
+        """
+        if mode not in ['dynamic', 'static']:
+            raise ValueError(f"mode must be 'dynamic' or 'static', not '{mode}'")
+        if mode == 'static' and calibration_stimuli is None:
+            raise ValueError("Static quantization needs calibration_stimuli")
+
+        # Quantized kernels only run on CPU
+        if self.device != 'cpu':
+            warnings.warn("Quantized models only run on CPU, moving extraction to CPU.")
+            self.device = 'cpu'
+
+        if not hasattr(self, 'float_model'):
+            self.float_model = self.model
+        self.float_model.to('cpu').eval()
+        model = copy.deepcopy(self.float_model)
+
+        if mode == 'dynamic':
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {nn.Linear}, dtype=torch.qint8
+            )
+        else:
+            # Wrap every quantizable layer with quant/dequant stubs in place,
+            # so the module at each name still returns float outputs
+            qconfig = torch.ao.quantization.get_default_qconfig(
+                torch.backends.quantized.engine
+            )
+            _wrap_for_static_quantization(model, qconfig)
+            torch.ao.quantization.prepare(model, inplace=True)
+
+            # Calibrate the observers
+            if isinstance(calibration_stimuli, (str, Path)):
+                calibration_stimuli = find_image_files(calibration_stimuli)
+            self.model = model
+            with torch.no_grad():
+                for _ in itertools.islice(
+                    self.iter_features(calibration_stimuli), n_calibration
+                ):
+                    pass
+            torch.ao.quantization.convert(model, inplace=True)
+
+        self.model = model.eval()
+        return self.model
+
+    def quantization_report(self, stimuli, n_stimuli=None, batch_size=1):
+        """Compares the RDMs of the quantized and the float model, to judge
+        whether the speedup of quantize() changes the representations.
+
+        Parameters
+        ----------
+        stimuli : str, pathlib.Path or iterable
+            Folder or stimuli to compare on.
+        n_stimuli : int, optional
+            Only use the first n_stimuli stimuli, by default all.
+        batch_size : int, optional
+            Number of stimuli passed through the model at once, by default 1.
+
+        Returns
+        -------
+        pandas DataFrame
+            Per layer: Spearman and Pearson correlation between the upper
+            triangles of both RDMs, their largest absolute difference, the
+            relative error of the features and the speedup of the quantized
+            model over the whole extraction.
+        """
+        if not hasattr(self, 'float_model'):
+            raise ValueError("The model is not quantized, call quantize() first")
+
+        if isinstance(stimuli, (str, Path)):
+            stimuli = find_image_files(stimuli)
+        stimuli = list(stimuli)[:n_stimuli]
+
+        quantized_model = self.model
+        timings = {}
+        features = {}
+        try:
+            for name, model in [('float', self.float_model), ('quantized', quantized_model)]:
+                self.model = model
+                start = time.perf_counter()
+                with torch.no_grad():
+                    features[name] = self.extract_from_stimuli(stimuli, batch_size=batch_size)
+                timings[name] = time.perf_counter() - start
+        finally:
+            self.model = quantized_model
+
+        speedup = timings['float'] / timings['quantized']
+        rows = []
+        for layer, float_fts in features['float'].items():
+            float_fts = torch.flatten(float_fts, start_dim=1).double()
+            quant_fts = torch.flatten(features['quantized'][layer], start_dim=1).double()
+            float_rdm = pearson_rdm(float_fts.numpy())
+            quant_rdm = pearson_rdm(quant_fts.numpy())
+            triu = np.triu_indices(len(float_rdm), 1)
+            rows.append({
+                'Layer': layer,
+                'Spearman': stats.spearmanr(float_rdm[triu], quant_rdm[triu])[0],
+                'Pearson': np.corrcoef(float_rdm[triu], quant_rdm[triu])[0, 1],
+                'Max abs diff': np.abs(float_rdm - quant_rdm).max(),
+                'Feature error': (
+                    torch.linalg.norm(float_fts - quant_fts)
+                    / torch.linalg.norm(float_fts)
+                ).item(),
+                'Speedup': speedup
+            })
+        return pd.DataFrame(rows)
+
     def get_all_layers(self):
         """Helping function to extract all possible layers from a model
 
@@ -797,6 +1198,315 @@ class FeatureExtractor:
         layers = tx.list_module_names(self.model)
         return layers
 
+    def _dummy_stimulus(self):
+        """Creates a small gray image in memory that every image preprocess
+        function can open.
+
+        Returns
+        -------
+        io.BytesIO
+            PNG encoded image.
+        """
+        return _as_image_input(Image.new('RGB', (224, 224), (128, 128, 128)))
+
+    def _dry_run(self, stimulus=None):
+        """Runs one stimulus through the model while recording the output of
+        every hookable layer.
+
+        Parameters
+        ----------
+        stimulus : str or pathlib.Path, optional
+            Stimulus to use, by default a dummy image.
+
+        Returns
+        -------
+        (dict, dict)
+            Recorded outputs of all layers as {layer: [(shape, dtype)]} and
+            the cleaned features of the layers to extract.
+        """
+        if stimulus is None:
+            stimulus = self._dummy_stimulus()
+
+        modules = dict(self.model.named_modules())
+        records = {}
+
+        def make_hook(name):
+            def hook(module, inputs, output):
+                records[name] = [
+                    (tuple(t.shape), t.dtype) for t in _iter_tensors(output)
+                ]
+            return hook
+
+        handles = [
+            modules[name].register_forward_hook(make_hook(name))
+            for name in tx.list_module_names(self.model) if name in modules
+        ]
+        try:
+            with torch.no_grad():
+                processed = self.preprocess(stimulus, self.model_name, self.device)
+                features = self._extractor(processed)
+        finally:
+            for handle in handles:
+                handle.remove()
+
+        return records, features
+
+    def get_layer_inventory(self, stimulus=None):
+        """Lists every hookable layer with its output shape, dtype and byte
+        size per stimulus, based on a single forward pass.
+
+        Parameters
+        ----------
+        stimulus : str or pathlib.Path, optional
+            Stimulus to use for the dry run, by default a dummy image. Video
+            models need a real stimulus.
+
+        Returns
+        -------
+        pandas DataFrame
+            One row per layer output with the columns 'Layer', 'Shape',
+            'Dtype' and 'Bytes'.
+        """
+        records, _ = self._dry_run(stimulus)
+        rows = []
+        for layer, outputs in records.items():
+            for shape, dtype in outputs:
+                rows.append({
+                    'Layer': layer,
+                    'Shape': shape,
+                    'Dtype': str(dtype).replace('torch.', ''),
+                    'Bytes': int(np.prod(shape)) * _dtype_size(dtype)
+                })
+        return pd.DataFrame(rows, columns=['Layer', 'Shape', 'Dtype', 'Bytes'])
+
+    def plan_extraction(
+        self, dataset_path, save_format='npz', layers_to_extract=None,
+        disk_budget=None, ram_budget=None, strict=False):
+        """Estimates the cost of extract() and of the RDM creation that
+        follows it, before anything is computed.
+
+        Parameters
+        ----------
+        dataset_path : str, pathlib.Path or int
+            Path to the images or the number of stimuli.
+        save_format : str, optional
+            Format the features will be saved in, by default 'npz'.
+        layers_to_extract : list, optional
+            Layers to plan for, by default the layers of the extractor.
+        disk_budget : int, optional
+            Available disk space in bytes.
+        ram_budget : int, optional
+            Available memory in bytes.
+        strict : bool, optional
+            If True, raise instead of warning when a budget is exceeded.
+
+        Returns
+        -------
+        dict
+            'layers' (DataFrame with shape, dtype and bytes per stimulus of
+            each extracted layer), 'n_stimuli', 'disk_bytes',
+            'peak_ram_bytes', 'rdm_peak_ram_bytes', 'rdm_disk_bytes' and
+            'rdm_flops'.
+
+        Raises
+        ------
+        ValueError
+            If strict and the plan exceeds one of the budgets.
+        """
+        if isinstance(dataset_path, int):
+            n_stimuli = dataset_path
+            stimulus = None
+        else:
+            image_files = find_image_files(dataset_path)
+            n_stimuli = len(image_files)
+            stimulus = image_files[0] if image_files else None
+
+        previous_layers = self.layers_to_extract
+        if layers_to_extract is not None:
+            self.layers_to_extract = layers_to_extract
+        try:
+            _, features = self._dry_run(stimulus)
+        finally:
+            self.layers_to_extract = previous_layers
+
+        layers = pd.DataFrame([
+            {
+                'Layer': layer,
+                'Shape': tuple(value.shape),
+                'Dtype': str(value.dtype).replace('torch.', ''),
+                'Bytes': value.numel() * value.element_size()
+            }
+            for layer, value in features.items()
+        ], columns=['Layer', 'Shape', 'Dtype', 'Bytes'])
+
+        bytes_per_stimulus = int(layers['Bytes'].sum())
+        model_bytes = sum(
+            p.numel() * p.element_size()
+            for p in itertools.chain(self.model.parameters(), self.model.buffers())
+        )
+
+        # Features are written once per stimulus, 'dataset' additionally keeps
+        # all of them in memory and stacks them into one array per layer
+        disk_bytes = n_stimuli * bytes_per_stimulus
+        if save_format == 'dataset':
+            peak_ram = model_bytes + 2 * disk_bytes
+        else:
+            peak_ram = model_bytes + bytes_per_stimulus
+
+        # RDM creation holds one layer as float64 matrix plus its standardized
+        # copy and writes one n x n float64 matrix per layer
+        numels = [int(np.prod(shape)) for shape in layers['Shape']]
+        max_numel = max(numels) if numels else 0
+        rdm_peak_ram = 2 * n_stimuli * max_numel * 8 + n_stimuli ** 2 * 8
+        rdm_disk = len(numels) * n_stimuli ** 2 * 8
+        rdm_flops = sum(n_stimuli ** 2 * numel for numel in numels)
+
+        plan = {
+            'layers': layers,
+            'n_stimuli': n_stimuli,
+            'disk_bytes': disk_bytes,
+            'peak_ram_bytes': peak_ram,
+            'rdm_peak_ram_bytes': rdm_peak_ram,
+            'rdm_disk_bytes': rdm_disk,
+            'rdm_flops': rdm_flops
+        }
+
+        problems = []
+        if disk_budget is not None and disk_bytes > disk_budget:
+            problems.append(
+                f"'{save_format}' features need {format_bytes(disk_bytes)} on disk "
+                f"but the budget is {format_bytes(disk_budget)}"
+            )
+        if ram_budget is not None and peak_ram > ram_budget:
+            problems.append(
+                f"'{save_format}' extraction needs {format_bytes(peak_ram)} of memory "
+                f"but the budget is {format_bytes(ram_budget)}"
+            )
+        if problems:
+            message = "; ".join(problems)
+            if strict:
+                raise ValueError(message)
+            warnings.warn(message)
+
+        return plan
+
+
+def find_image_files(dataset_path):
+    """Finds all images in a folder.
+
+    Parameters
+    ----------
+    dataset_path : str or pathlib.Path
+        Folder containing the stimuli.
+
+    Returns
+    -------
+    list of pathlib Path
+        Sorted .jpg, .jpeg and .png files.
+    """
+    image_files = [
+        i for i in Path(dataset_path).iterdir() 
+        if i.suffix in ['.jpeg', '.jpg', '.png']
+    ]
+    image_files.sort()
+    return image_files
+
+
+def _as_image_input(stimulus):
+    """Turns an in-memory stimulus into something the preprocess functions of
+    all netsets can open with PIL.
+
+    Parameters
+    ----------
+    stimulus : str, pathlib.Path, PIL Image, numpy array or Torch Tensor
+        Stimulus. Arrays are [H, W] or [H, W, C] and tensors [C, H, W], either
+        as uint8 or as floats in [0, 1].
+
+    Returns
+    -------
+    str, pathlib.Path or io.BytesIO
+        Path or PNG encoded image.
+    """
+    if isinstance(stimulus, (str, Path)):
+        return stimulus
+
+    if isinstance(stimulus, torch.Tensor):
+        stimulus = stimulus.detach().cpu()
+        if stimulus.is_floating_point():
+            # to_pil_image scales by 255 without clipping, values outside [0, 1] would wrap
+            stimulus = stimulus.clamp(0, 1)
+        stimulus = T.functional.to_pil_image(stimulus)
+    elif isinstance(stimulus, np.ndarray):
+        if stimulus.dtype != np.uint8:
+            stimulus = (np.clip(stimulus, 0, 1) * 255).round().astype(np.uint8)
+        stimulus = Image.fromarray(stimulus)
+
+    if not isinstance(stimulus, Image.Image):
+        raise TypeError(
+            f"Stimuli must be paths, PIL Images, numpy arrays or tensors, got {type(stimulus)}"
+        )
+
+    buffer = io.BytesIO()
+    stimulus.convert('RGB').save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def _wrap_for_static_quantization(model, qconfig):
+    """Wraps all Conv2d and Linear modules of the model in place with
+    QuantWrapper and assigns them the qconfig.
+
+    Parameters
+    ----------
+    model : PyTorch model
+        Model to modify.
+    qconfig : torch.ao.quantization.QConfig
+        Quantization config of the wrapped modules.
+    """
+    for name, child in model.named_children():
+        if isinstance(child, (nn.Conv2d, nn.Linear)):
+            wrapper = torch.ao.quantization.QuantWrapper(child)
+            wrapper.qconfig = qconfig
+            setattr(model, name, wrapper)
+        else:
+            _wrap_for_static_quantization(child, qconfig)
+
+
+def _iter_tensors(output):
+    """Yields all tensors of a (possibly nested) layer output."""
+    if isinstance(output, torch.Tensor):
+        yield output
+    elif isinstance(output, dict):
+        for value in output.values():
+            yield from _iter_tensors(value)
+    elif isinstance(output, (list, tuple)):
+        for value in output:
+            yield from _iter_tensors(value)
+
+
+def _dtype_size(dtype):
+    """Number of bytes of one element of a torch dtype."""
+    return torch.empty((), dtype=dtype).element_size()
+
+
+def format_bytes(num_bytes):
+    """Formats a number of bytes in a human readable way.
+
+    Parameters
+    ----------
+    num_bytes : int
+        Number of bytes.
+
+    Returns
+    -------
+    str
+        e.g. '1.5 GB'
+    """
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(num_bytes) < 1024 or unit == 'TB':
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
 
 def create_save_path():
     """ Creates folder to save the image features.
@@ -1,8 +1,9 @@
 import scipy
 import numpy as np
 import collections
-from multiprocessing import Pool
+from multiprocessing import Pool, shared_memory
 from itertools import combinations
+from sklearn.covariance import ledoit_wolf
 from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
 
 class eeg_classfier:
@@ -11,7 +12,7 @@ class eeg_classfier:
         self.dataB = dataB
         #print(dataA.shape,dataB.shape)
         self.lenTrn = self.dataA.shape[0] - 1
-        
+
     def leaveOneOut(self,ii):
         clf = LDA()
         dat = np.concatenate([np.delete(self.dataA, ii, axis=0), np.delete(self.dataB, ii, axis=0)],axis=0)
@@ -20,7 +21,221 @@ class eeg_classfier:
         clf.fit(dat,lab)
         return np.mean([1,2] == clf.predict([self.dataA[ii,:],self.dataB[ii,:]]))
 
-def eeg_rdm(eeg,labels):
+
+# Tolerance on the singular values of the scaled within-class data, as in sklearn's LDA
+LDA_TOL = 1e-4
+
+
+def _pinv_weights(scatter, diff, n_train, tol=LDA_TOL):
+    """Solves scatter @ w = diff like sklearn's svd-solver LDA: every channel is
+    scaled by its within-class std and directions with singular values below
+    tol are dropped. Works on stacks of rank-deficient scatter matrices.
+
+    Args:
+        scatter (array): within-class scatter matrices (..., channels, channels)
+        diff (array): differences of the class means (..., channels)
+        n_train (int): number of training trials of both classes
+
+    Returns:
+        array: discriminant weights (..., channels)
+    """
+    std = np.sqrt(np.maximum(np.diagonal(scatter, axis1=-2, axis2=-1), 0) / n_train)
+    std[std == 0] = 1.0
+    scaled = scatter / (std[..., :, None] * std[..., None, :]) / (n_train - 2)
+    eigvals, eigvecs = np.linalg.eigh(scaled)
+    keep = eigvals > tol ** 2
+    inv_eigvals = np.divide(1.0, eigvals, out=np.zeros_like(eigvals), where=keep)
+    projected = np.einsum("...ck,...c->...k", eigvecs, diff / std) * inv_eigvals
+    return np.einsum("...ck,...k->...c", eigvecs, projected) / std
+
+
+def _dual_weights(train_a, train_b, diff, tol=LDA_TOL, exact=False):
+    """Same weights as _pinv_weights for fewer training trials than channels,
+    computed in trial space. With the std-scaled within-class data Y and
+    K = Y Y^T / (n - 2), the pseudo-inverse of the scaled covariance is
+    Y^T K^+ K^+ Y / (n - 2). The null space of K are the two class indicators,
+    so K^+ follows from the inverse of K + N, N the projector on them.
+
+    Args:
+        train_a (array): training trials of the first class (..., trials, channels)
+        train_b (array): training trials of the second class (..., trials, channels)
+        diff (array): differences of the class means (..., channels)
+        exact (bool, optional): Use an eigendecomposition of K and drop eigenvalues
+            below tol like sklearn, for nearly degenerate data. Defaults to False.
+
+    Returns:
+        array: discriminant weights (..., channels)
+    """
+    num_a = train_a.shape[-2]
+    n_train = num_a + train_b.shape[-2]
+    centered = np.concatenate([train_a - train_a.mean(axis=-2, keepdims=True),
+                               train_b - train_b.mean(axis=-2, keepdims=True)], axis=-2)
+    std = np.sqrt((centered ** 2).mean(axis=-2))
+    std[std == 0] = 1.0
+    y = centered / std[..., None, :]
+    kernel = (y @ np.swapaxes(y, -1, -2)) / (n_train - 2)
+    yz = np.einsum("...nc,...c->...n", y, diff / std)
+
+    if exact:
+        eigvals, eigvecs = np.linalg.eigh(kernel)
+        keep = eigvals > tol ** 2
+        inv_eigvals = np.divide(1.0, eigvals ** 2, out=np.zeros_like(eigvals), where=keep)
+        projected = np.einsum("...nk,...n->...k", eigvecs, yz) * inv_eigvals
+        q = np.einsum("...nk,...k->...n", eigvecs, projected)
+    else:
+        indicator = np.zeros((n_train, 2))
+        indicator[:num_a, 0] = 1 / np.sqrt(num_a)
+        indicator[num_a:, 1] = 1 / np.sqrt(n_train - num_a)
+        inverse = np.linalg.inv(kernel + indicator @ indicator.T)
+        q = np.einsum("...nk,...k->...n", inverse, np.einsum("...nk,...k->...n", inverse, yz))
+
+    return np.einsum("...nc,...n->...c", y, q) / (n_train - 2) / std
+
+
+def _smallest_eigvals(data_a, data_b, dual):
+    """Smallest relevant eigenvalue of the scaled covariance of every pair,
+    to decide which pairs can be solved without thresholding. The folds leave
+    out two trials, so their scatter has rank n_total - 4 at most, and the
+    eigenvalue that decides their regularity is the one at that rank.
+
+    Args:
+        data_a (array): trials of the first conditions (pairs, trials, channels)
+        data_b (array): trials of the second conditions (pairs, trials, channels)
+        dual (bool): Look at the trial space, where two eigenvalues are zero by construction,
+            and one more per channel missing to the rank n_total - 2 of the full data
+
+    Returns:
+        array: eigenvalue per pair
+    """
+    n_total = data_a.shape[-2] + data_b.shape[-2]
+    num_channels = data_a.shape[-1]
+    centered = np.concatenate([data_a - data_a.mean(axis=-2, keepdims=True),
+                               data_b - data_b.mean(axis=-2, keepdims=True)], axis=-2)
+    std = np.sqrt((centered ** 2).mean(axis=-2))
+    std[std == 0] = 1.0
+    y = centered / std[..., None, :]
+    if dual:
+        zeros = 2 + max(0, n_total - 2 - num_channels)
+        return np.linalg.eigvalsh(y @ np.swapaxes(y, -1, -2) / (n_total - 2))[:, zeros]
+    return np.linalg.eigvalsh(np.swapaxes(y, -1, -2) @ y / (n_total - 2))[:, 0]
+
+
+def decoding_rdm(data, pair_chunk=128):
+    """Pairwise leave-one-out LDA decoding accuracies of one timepoint. For
+    every pair of conditions and every left-out trial pair, a two-class LDA
+    with shared covariance is trained on the remaining trials and tested on
+    the left-out ones, giving the same predictions as the sklearn loop in
+    eeg_classfier. All pairs and folds are solved together:
+
+    - If the scatter of a fold, with rank n_train - 2, can have full rank,
+      leaving out one trial per class is a rank-two downdate of the pair
+      scatter, so the weights of all folds follow from one inverse per pair
+      (Woodbury identity).
+    - Otherwise the folds are solved in trial space (see _dual_weights).
+    - Pairs that are close to singular in either case, e.g. average referenced
+      data, are solved per fold with the thresholded eigendecomposition of
+      sklearn's svd solver.
+
+    Args:
+        data (array): trials of every condition (conditions, trials, channels)
+        pair_chunk (int, optional): number of pairs processed at once. Defaults to 128.
+
+    Returns:
+        array: condition x condition decoding accuracies
+    """
+    data = np.asarray(data, dtype=np.float64)
+    num_labels, num_trials, num_channels = data.shape
+    n_train = 2 * (num_trials - 1)
+    # The scatter of a fold has rank n_train - 2 at most
+    dual = n_train - 2 < num_channels
+
+    means = data.mean(axis=1)
+    deviations = data - means[:, None, :]
+    scatters = np.einsum("ltc,ltd->lcd", deviations, deviations)
+
+    # Removing trial k from a class: mean -= d_k / (m - 1), scatter -= m / (m - 1) d_k d_k^T
+    downdate = num_trials / (num_trials - 1)
+    # Training trials of every fold
+    folds = np.array([np.delete(np.arange(num_trials), k) for k in range(num_trials)])
+
+    rdm = np.zeros((num_labels, num_labels))
+    pairs = np.array(list(combinations(range(num_labels), 2)))
+
+    for start in range(0, len(pairs), pair_chunk):
+        l1, l2 = pairs[start:start + pair_chunk].T
+
+        dev_a, dev_b = deviations[l1], deviations[l2]  # (pairs, trials, channels)
+        diff = (means[l1] - means[l2])[:, None, :] - (dev_a - dev_b) / (num_trials - 1)
+        midpoint = (means[l1] + means[l2])[:, None, :] / 2 - (dev_a + dev_b) / (2 * (num_trials - 1))
+        weights = np.empty(diff.shape)
+
+        # Well-conditioned pairs stay well-conditioned when two trials are left out
+        regular = _smallest_eigvals(data[l1], data[l2], dual) > LDA_TOL
+
+        if dual:
+            for exact in (False, True):
+                chosen = regular != exact
+                if chosen.any():
+                    weights[chosen] = _dual_weights(
+                        data[l1[chosen]][:, folds], data[l2[chosen]][:, folds],
+                        diff[chosen], exact=exact)
+        else:
+            if regular.any():
+                # S_k^-1 = (S - U U^T)^-1 via Woodbury with U = sqrt(c) [d_a, d_b]
+                s_inv = np.linalg.inv(scatters[l1[regular]] + scatters[l2[regular]])
+                u = np.sqrt(downdate) * np.stack([dev_a[regular], dev_b[regular]], axis=-1)
+                s_inv_v = np.einsum("pcd,ptd->ptc", s_inv, diff[regular])
+                s_inv_u = np.einsum("pcd,ptdk->ptck", s_inv, u)
+                gram = np.eye(2) - np.einsum("ptck,ptcj->ptkj", u, s_inv_u)
+                correction = np.linalg.solve(gram, np.einsum("ptck,ptc->ptk", u, s_inv_v)[..., None])
+                weights[regular] = s_inv_v + (s_inv_u @ correction)[..., 0]
+            if not regular.all():
+                u_a, u_b = dev_a[~regular], dev_b[~regular]
+                fold_scatter = (scatters[l1[~regular]] + scatters[l2[~regular]])[:, None] - downdate * (
+                    u_a[..., :, None] * u_a[..., None, :] + u_b[..., :, None] * u_b[..., None, :])
+                weights[~regular] = _pinv_weights(fold_scatter, diff[~regular], n_train)
+
+        # Class A is predicted for a non-negative score (sklearn picks the first class on ties)
+        score_a = np.einsum("ptc,ptc->pt", data[l1] - midpoint, weights)
+        score_b = np.einsum("ptc,ptc->pt", data[l2] - midpoint, weights)
+        accuracy = ((score_a >= 0).mean(axis=1) + (score_b < 0).mean(axis=1)) / 2
+
+        rdm[l1, l2] = accuracy
+        rdm[l2, l1] = accuracy
+
+    return rdm
+
+
+_SHARED = {}
+
+
+def _init_worker(name, shape, dtype):
+    """Attaches a pool worker to the shared EEG array"""
+    shm = shared_memory.SharedMemory(name=name)
+    _SHARED["shm"] = shm
+    _SHARED["data"] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _timepoint_rdm(tt):
+    """Decoding RDM of one timepoint of the shared EEG array"""
+    return tt, decoding_rdm(_SHARED["data"][..., tt])
+
+
+def eeg_rdm(eeg, labels, n_jobs=1):
+    """Creates time-resolved decoding RDMs from EEG trials with leave-one-out
+    LDA between every pair of conditions
+
+    Args:
+        eeg (array): trials x channels x timepoints
+        labels (array): condition of every trial
+        n_jobs (int, optional): number of processes. Timepoints are streamed to one
+            persistent pool that reads the EEG from shared memory. Defaults to 1.
+
+    Returns:
+        array: conditions x conditions x timepoints decoding accuracies
+    """
+    labels = np.asarray(labels)
+
     # Calculate minimum number of trial instances
     counts = collections.Counter(labels)
     counts = collections.OrderedDict(sorted(counts.items()))
@@ -31,16 +246,149 @@ def eeg_rdm(eeg,labels):
     numLabels = len(counts)
     index_dict = {l : np.where(labels==l)[0][:minCount] for l in counts.keys()}
     ########
+    # conditions x trials x channels x timepoints
+    data = np.stack([np.asarray(eeg)[index_dict[l]] for l in ordered_labels]).astype(np.float64)
     rdms = np.zeros((numLabels,numLabels,timepoints))
-    for tt in range(timepoints):
-        for l1,l2 in combinations(range(numLabels),2):
-            #print(ii,jj)
-            ii = ordered_labels[l1]
-            jj = ordered_labels[l2]
-            classify = eeg_classfier(np.squeeze(eeg[index_dict[ii],:,tt]),np.squeeze(eeg[index_dict[jj],:,tt]))
-            results = []
-            with Pool(4) as p:
-                results.append(p.map(classify.leaveOneOut, list(range(0,minCount))))
-            rdms[l1,l2,tt] = np.mean(results)
-            rdms[l2,l1,tt] = np.mean(results)
-    return rdms
\ No newline at end of file
+
+    if n_jobs <= 1:
+        for tt in range(timepoints):
+            rdms[:, :, tt] = decoding_rdm(data[..., tt])
+        return rdms
+
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+        with Pool(n_jobs, initializer=_init_worker, initargs=(shm.name, data.shape, data.dtype)) as pool:
+            for tt, rdm in pool.imap_unordered(_timepoint_rdm, range(timepoints)):
+                rdms[:, :, tt] = rdm
+    finally:
+        shm.close()
+        shm.unlink()
+    return rdms
+
+
+def assign_folds(labels, n_folds):
+    """Splits the trials of every condition round-robin into folds
+
+    Args:
+        labels (array): condition of every trial
+        n_folds (int): number of folds
+
+    Returns:
+        array: fold of every trial
+    """
+    labels = np.asarray(labels)
+    folds = np.zeros(len(labels), dtype=int)
+    for label in np.unique(labels):
+        trials = np.where(labels == label)[0]
+        folds[trials] = np.arange(len(trials)) % n_folds
+    return folds
+
+
+def noise_precision(residuals, shrinkage=None):
+    """Inverse of the shrinkage estimate of the noise covariance. The
+    pseudo-inverse keeps it defined if the residuals span too few dimensions.
+
+    Args:
+        residuals (array): residuals of the trials from their condition means (samples, channels)
+        shrinkage (float, optional): Shrinkage towards a scaled identity. If None, use Ledoit-Wolf.
+
+    Returns:
+        array: channels x channels precision matrix
+    """
+    if shrinkage is None:
+        covariance = ledoit_wolf(residuals, assume_centered=True)[0]
+    else:
+        covariance = residuals.T @ residuals / len(residuals)
+        mu = np.trace(covariance) / len(covariance)
+        covariance = (1 - shrinkage) * covariance + shrinkage * mu * np.eye(len(covariance))
+    return np.linalg.pinv(covariance, hermitian=True)
+
+
+def crossnobis_rdm(data, labels, folds=None, n_folds=5, noise="shrinkage", shrinkage=None):
+    """Creates cross-validated Mahalanobis (crossnobis) RDMs from trials.
+    For every fold, the condition means of the fold are compared with the
+    condition means of all other folds, whitened with a noise covariance
+    estimated from the trials of the other folds only, as residuals from the
+    condition means pooled over those folds (so one trial per condition and
+    run still leaves residuals):
+
+        d(i, j) = mean_f (m_i^f - m_j^f)^T P_f (m_i^-f - m_j^-f) / channels
+
+    The noise covariance is estimated once per fold, pooled over time, and
+    all condition pairs of all timepoints follow from one batched matrix
+    product per fold. As the two sides are independent, noise does not bias
+    the distances, so they are centered on zero for indistinguishable conditions.
+
+    Args:
+        data (array): trials x channels x timepoints (M/EEG) or trials x channels (fMRI)
+        labels (array): condition of every trial
+        folds (array, optional): fold (e.g. run) of every trial. If None, the trials
+            of every condition are split round-robin into n_folds folds.
+        n_folds (int, optional): number of folds if folds is None, capped at the
+            smallest number of trials per condition. Defaults to 5.
+        noise (str, optional): "shrinkage" for the crossnobis distance, "identity" for
+            the cross-validated euclidean distance. Defaults to "shrinkage".
+        shrinkage (float, optional): Shrinkage of the noise covariance. If None, use Ledoit-Wolf.
+
+    Raises:
+        ValueError: If noise is unknown, there are less than two folds or a
+            condition is missing in a fold
+
+    Returns:
+        array: conditions x conditions (x timepoints) dissimilarities
+    """
+    if noise not in ["shrinkage", "identity"]:
+        raise ValueError(f"noise must be 'shrinkage' or 'identity', got '{noise}'")
+
+    data = np.asarray(data, dtype=np.float64)
+    squeeze = data.ndim == 2
+    if squeeze:
+        data = data[..., None]
+    labels = np.asarray(labels)
+    conditions = np.unique(labels)
+    num_channels, timepoints = data.shape[1:]
+
+    if folds is None:
+        min_count = min(np.sum(labels == c) for c in conditions)
+        folds = assign_folds(labels, min(n_folds, min_count))
+    folds = np.asarray(folds)
+    fold_ids = np.unique(folds)
+    if len(fold_ids) < 2:
+        raise ValueError("Crossnobis needs at least two folds")
+
+    # Sums and counts per condition and fold: (folds, conditions, channels, time)
+    sums = np.zeros((len(fold_ids), len(conditions), num_channels, timepoints))
+    counts = np.zeros((len(fold_ids), len(conditions)))
+    for f, fold in enumerate(fold_ids):
+        for c, condition in enumerate(conditions):
+            trials = (folds == fold) & (labels == condition)
+            if not trials.any():
+                raise ValueError(f"Condition {condition} has no trials in fold {fold}")
+            sums[f, c] = data[trials].sum(axis=0)
+            counts[f, c] = trials.sum()
+    means = sums / counts[..., None, None]
+    trial_fold = np.searchsorted(fold_ids, folds)
+    trial_condition = np.searchsorted(conditions, labels)
+
+    rdms = np.zeros((len(conditions), len(conditions), timepoints))
+    for f in range(len(fold_ids)):
+        others = np.arange(len(fold_ids)) != f
+        test = means[f]
+        train = sums[others].sum(axis=0) / counts[others].sum(axis=0)[:, None, None]
+
+        if noise == "shrinkage":
+            # Residuals of the training trials from the training means (samples, channels)
+            trials = trial_fold != f
+            resid = data[trials] - train[trial_condition[trials]]
+            resid = resid.transpose(0, 2, 1).reshape(-1, num_channels)
+            test = np.einsum("cd,kdt->kct", noise_precision(resid, shrinkage), test)
+
+        # Inner products of all condition pairs for all timepoints at once
+        gram = np.einsum("ict,jct->tij", test, train)
+        diag = np.diagonal(gram, axis1=1, axis2=2)
+        dist = diag[:, :, None] + diag[:, None, :] - gram - gram.transpose(0, 2, 1)
+        rdms += dist.transpose(1, 2, 0)
+
+    rdms /= len(fold_ids) * num_channels
+    return rdms[..., 0] if squeeze else rdms
@@ -1,10 +1,17 @@
+import hashlib
 import json
-import glob
 import os
+import shutil
+import tempfile
+import warnings
 import numpy as np
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.preprocessing import StandardScaler as SS
 from datetime import datetime
+from net2brain.utils.feature_readers import open_features
+from net2brain.utils.rdm_distances import (
+    APPROXIMATE_DISTANCES, INCREMENTAL_DISTANCES, GramAccumulator, accumulate, approximate_rdms,
+    check_distances, compute_rdms, rank_rows)
 
 
 def ensure_directory(path):
@@ -40,21 +47,205 @@ def create_save_folder():
     return save_path
 
 
+def pearson_rdm(activations):
+    """Calculates the pearson distance between the standardized activations
+
+    Args:
+        activations (array): flattened activations for each image (78, 193600)
+
+    Returns:
+       array: image x image array
+    """
+    r_scaled = SS().fit_transform(np.array(activations))  # list to npy array and normalize the values
+    rdm = 1 - np.corrcoef(r_scaled)  # Perform pearson correlation coefficient
+    rdm = np.array(rdm)
+    return rdm
+
+
+def pearson_rdm_blockwise(activations, block_size=4096):
+    """Calculates the same pearson distance as pearson_rdm, but streams the
+    features in blocks of columns. Only the image x image cross-product is
+    accumulated, so memory stays at O(n² + n * block_size) no matter how
+    many features the layer has.
+
+    Args:
+        activations (array or str): (memmapped) activations for each image (78, 193600)
+            or path to such a .npy file
+        block_size (int, optional): number of features per block. Defaults to 4096.
+
+    Returns:
+       array: image x image array
+    """
+    return compute_rdms(activations, "pearson", block_size, dtype=np.float64)["pearson"]
+
+
+def rank_activations(activations, distances):
+    """Ranks the activations of every image if spearman is requested
+
+    Args:
+        activations (array or str): flattened activations for each image (78, 193600)
+            or path to a memmapped .npy file with them
+        distances (list): requested distances
+
+    Returns:
+        array: the activations (opened if a path was given)
+        array or None: the ranks, memmapped next to memmapped activations
+    """
+    if isinstance(activations, str):
+        activations = np.load(activations, mmap_mode='r')
+    if "spearman" not in distances:
+        return activations, None
+    if isinstance(activations, np.memmap):
+        # Out-of-core: the ranks go next to the activations on disk
+        out = np.lib.format.open_memmap(
+            activations.filename[:-len(".npy")] + "_ranks.npy", mode="w+",
+            dtype=np.float32, shape=activations.shape)
+        return activations, rank_rows(activations, out=out)
+    return activations, rank_rows(activations)
+
+
+def layer_rdms(activations, distances, block_size=None, shrinkage=None, approximate=None, seed=0, n_check=20):
+    """Calculates all requested distances of one layer. This is what the
+    workers of RDMCreator.create_rdms run, so they only receive the layer
+    and the distance parameters. A single pearson RDM keeps the original
+    computation, every other request goes through the shared Gram matrix of
+    rdm_distances.compute_rdms, and with approximate through
+    rdm_distances.approximate_rdms.
+
+    Args:
+        activations (array or str): flattened activations for each image (78, 193600)
+            or path to a memmapped .npy file with them
+        distances (list): requested distances, see rdm_distances.check_distances
+        block_size (int, optional): number of features per block, None for in-memory. Defaults to None.
+        shrinkage (float, optional): shrinkage of the mahalanobis covariance. Defaults to None.
+        approximate (float, optional): target relative error of the random projection,
+            None for exact RDMs. Defaults to None.
+        seed (int, optional): seed of the random projection. Defaults to 0.
+        n_check (int, optional): number of images the approximation is checked on. Defaults to 20.
+
+    Returns:
+        dict: {distance: image x image array}
+        dict or None: {distance: {"dimensions", "max", "mean"}} relative errors on n_check
+            images, None for exact RDMs
+    """
+    if approximate is not None:
+        return approximate_rdms(activations, distances, eps=approximate, seed=seed,
+                                block_size=block_size, n_check=n_check)
+
+    if distances == ["pearson"]:
+        if isinstance(activations, str):
+            activations = np.load(activations, mmap_mode='r')
+        if block_size is not None:
+            return {"pearson": pearson_rdm_blockwise(activations, block_size)}, None
+        return {"pearson": pearson_rdm(activations)}, None
+
+    activations, ranks = rank_activations(activations, distances)
+    return compute_rdms(activations, distances, block_size=block_size,
+                        shrinkage=shrinkage, ranks=ranks), None
+
+
+def feature_hash(activations, chunk_rows=64, rows=None):
+    """Hash of the activations a RDM was computed from, to later check if the
+    RDM still belongs to the features on disk
+
+    Args:
+        activations (array): (memmapped) activations for each image (78, 193600)
+        chunk_rows (int, optional): number of images hashed at once. Defaults to 64.
+        rows (list, optional): only hash these images, in this order. Defaults to all.
+
+    Returns:
+        str: sha1 hex digest
+    """
+    if rows is None:
+        rows = np.arange(activations.shape[0])
+    rows = np.asarray(rows, dtype=int)
+    digest = hashlib.sha1(str(((len(rows),) + activations.shape[1:], activations.dtype.str)).encode())
+    for start in range(0, len(rows), chunk_rows):
+        digest.update(np.ascontiguousarray(activations[rows[start:start + chunk_rows]]).data)
+    return digest.hexdigest()
+
+
+def save_condensed_rdm(path, rdm, stimuli=None, metric=None, model=None, layer=None, feature_hash=None):
+    """Saves only the upper triangle of a RDM as float32 vector together with
+    its metadata. The file can be read with eval_helper.load / load_rdm.
+
+    Args:
+        path (str): path of the .npz file
+        rdm (numpy array): image x image array
+        stimuli (list, optional): stimulus IDs in the order of the RDM
+        metric (str, optional): distance metric
+        model (str, optional): name of the model
+        layer (str, optional): name of the layer
+        feature_hash (str, optional): hash of the features the RDM was computed from
+    """
+    rdm = np.asarray(rdm)
+    if rdm.ndim == 2:
+        rdm = rdm[np.triu_indices(rdm.shape[0], 1)]
+    data = {"rdm": rdm.astype(np.float32)}
+    if stimuli is not None:
+        data["stimuli"] = np.array([str(s) for s in stimuli])
+    for key, value in [("metric", metric), ("model", model), ("layer", layer), ("feature_hash", feature_hash)]:
+        if value is not None:
+            data[key] = np.array(str(value))
+    np.savez(path, **data)
+
+
 class RDMCreator:
     """This class creates RDMs from the features that have been extracted witht the feature extraction
     module
     """
 
-    def __init__(self, feat_path, save_path=None, distance="pearson"):
+    def __init__(self, feat_path, save_path=None, distance="pearson", block_size=None, shrinkage=None,
+                 condensed=False, model_name=None, incremental=False, stimulus_ids=None,
+                 approximate=None, seed=0, n_check=20, memmap_dir=None):
         """Initiation for RDM Creation
 
         Args:
-            feat_path (str): path where to find earlier generated features
+            feat_path (str or dict): path where to find earlier generated features, saved as
+                npz, pt or dataset (hdf5), or in-memory features {layer: array or tensor
+                (num_stimuli, ...)} as returned by FeatureExtractor.extract_from_stimuli
             save_path (str, optional): Path where to save RDMs Defaults to None.
-            distance (str, optional): Distance metric for RDM creation. Defaults to "pearson".
+            distance (str or list, optional): Distance metric(s) for RDM creation, any of
+                "pearson", "cosine", "euclidean", "sqeuclidean", "spearman" and "mahalanobis".
+                Several metrics are computed in a single pass over the features and saved
+                to one subfolder per metric. Defaults to "pearson".
+            block_size (int, optional): If given, the activations are kept in memmapped
+                files on disk and the RDMs are computed in blocks of this many features.
+                Use this for layers that do not fit into memory. Defaults to None.
+            memmap_dir (str, optional): Folder on disk for the memmapped activations of
+                block_size. A temporary subfolder is created in it and removed afterwards.
+                Avoid RAM-backed folders like /tmp on tmpfs. Defaults to save_path.
+            shrinkage (float, optional): Shrinkage of the feature covariance for
+                "mahalanobis". If None, the Ledoit-Wolf estimate is used. Defaults to None.
+            condensed (bool, optional): Save only the upper triangle in float32 together
+                with stimulus IDs, metric, model, layer and feature hash (see
+                save_condensed_rdm) instead of the full matrix. Defaults to False.
+            model_name (str, optional): Model name stored in condensed RDMs. Defaults to None.
+            incremental (bool, optional): Keep the per-layer Gram matrices and row sums in
+                feat_path/rdm_stats. When feature files are added later, create_rdms only
+                computes the cross-products of the new images and updates the RDMs.
+                Not possible for "pearson", which is then recomputed from scratch, or for
+                in-memory features. Defaults to False.
+            stimulus_ids (list, optional): IDs of in-memory features. Defaults to None.
+            approximate (float, optional): If given, the features are reduced with a seeded sparse
+                random projection before the distances are computed, with as many dimensions as
+                needed to keep the distortion below this value (Johnson-Lindenstrauss). Meant for
+                screening many layers, the errors against exact RDMs of n_check images are kept
+                in approximation_errors.json. Only for "pearson", "cosine", "euclidean" and
+                "sqeuclidean". Defaults to None.
+            seed (int, optional): Seed of the random projection. Defaults to 0.
+            n_check (int, optional): Number of images on which approximate RDMs are compared
+                to exact ones. Defaults to 20.
+
+        Raises:
+            ValueError: If a distance is not implemented or cannot be approximated
         """
 
         self.feat_path = feat_path
+        self.stimulus_ids = stimulus_ids
+        self._reader = None
+        self.block_size = block_size
+        self.memmap_dir = memmap_dir
 
         # Create save_path
         if save_path is None:
@@ -64,9 +255,36 @@ class RDMCreator:
             self.save_path = save_path
 
         self.distance_name = distance
-        # Create distance metric
-        if distance == "pearson":
-            self.distance = self.pearson_dist
+        self.distances = check_distances(distance)
+        self.shrinkage = shrinkage
+        self.distance = self.compute_distances
+        self.condensed = condensed
+        self.model_name = model_name
+        self._feature_hashes = {}
+
+        self.approximate = approximate
+        self.seed = seed
+        self.n_check = n_check
+        self.approximation_errors = {}
+        if approximate is not None:
+            for d in self.distances:
+                if d not in APPROXIMATE_DISTANCES:
+                    raise ValueError(f"Distance '{d}' cannot be approximated. "
+                                     f"Available distances are {APPROXIMATE_DISTANCES}")
+            self.distance = self.approximate_distances
+            if incremental:
+                warnings.warn("Approximate RDMs are not updated incrementally, they will be computed from scratch.")
+                incremental = False
+
+        self.incremental = incremental
+        if incremental and any(d not in INCREMENTAL_DISTANCES for d in self.distances):
+            warnings.warn("Pearson RDMs standardize every feature over all images and cannot "
+                          "be updated incrementally, they will be recomputed from scratch.")
+            self.incremental = False
+        if incremental and not isinstance(feat_path, str):
+            warnings.warn("Statistics of in-memory features cannot be kept, the RDMs will be computed from scratch.")
+            self.incremental = False
+        self.stats_path = os.path.join(feat_path, "rdm_stats") if isinstance(feat_path, str) else None
 
     def create_json(self):
         """Saves arguments in json used for creating RDMs
@@ -75,7 +293,7 @@ class RDMCreator:
         args_file = os.path.join(self.save_path, 'args.json')
         args = {
             "distance": self.distance_name,
-            "feat_dir": self.feat_path,
+            "feat_dir": self.feat_path if isinstance(self.feat_path, str) else "in-memory",
             "save_dir": self.save_path}
 
         with open(args_file, 'w') as fp:
@@ -93,14 +311,31 @@ class RDMCreator:
             numpy array: activations from layer
         """
 
-        activations = glob.glob(self.feat_path + "/*" + ".npz")
-        activations.sort()
-        feat = np.load(activations[i], allow_pickle=True)[layer_id]
+        return self.reader.get_features(layer_id, i)
 
-        return feat.ravel()
+    @property
+    def reader(self):
+        """Reader of the feature source (see net2brain.utils.feature_readers).
+        The directory is only listed once.
+
+        Returns:
+            FeatureReader: the reader
+        """
+        if self._reader is None:
+            self._reader = open_features(self.feat_path, self.stimulus_ids)
+        return self._reader
+
+    @property
+    def feature_files(self):
+        """Sorted list of all feature files
+
+        Returns:
+            list: paths to the npz, pt or hdf5 files
+        """
+        return self.reader.files
 
     def get_layers_ncondns(self):
-        """Function to return facts about the npz-file
+        """Function to return facts about the features
 
         Returns:
             num_layers (int): Amount of layers
@@ -109,23 +344,10 @@ class RDMCreator:
 
         """
 
-        activations = glob.glob(self.feat_path + "/*.npz")
-        num_condns = len(activations)
-        feat = np.load(activations[0], allow_pickle=True)
-
-        num_layers = 0
-        layer_list = []
-
-        for key in feat:
-            if "__" in key:  # key: __header__, __version__, __globals__
-                continue
-            else:
-                num_layers += 1
-                layer_list.append(key)  # collect all layer names
-
+        layer_list = self.reader.layers
         # Liste: ['conv1', 'conv2', 'conv3', 'conv4', 'conv5', 'fc6', 'fc7', 'fc8']
 
-        return num_layers, layer_list, num_condns
+        return len(layer_list), layer_list, len(self.reader)
 
     def pearson_dist(self, activations):
         """This function calculates the pearson distance between the activations
@@ -136,12 +358,165 @@ class RDMCreator:
         Returns:
            array: image x image array
         """
-        r_scaled = SS().fit_transform(np.array(activations))  # list to npy array and normalize the values
-        rdm = 1 - np.corrcoef(r_scaled)  # Perform pearson correlation coefficient
-        rdm = np.array(rdm)
-        return rdm
+        if self.block_size is not None:
+            return pearson_rdm_blockwise(activations, self.block_size)
+        return pearson_rdm(activations)
+
+    def compute_distances(self, activations):
+        """Calculates all requested distances between the activations (see layer_rdms)
+
+        Args:
+            activations (array or str): flattened activations for each image (78, 193600)
+                or path to a memmapped .npy file with them
+
+        Returns:
+            dict: {distance: image x image array}
+            None: exact RDMs have no approximation errors, kept to match approximate_distances
+        """
+        return layer_rdms(activations, self.distances, block_size=self.block_size, shrinkage=self.shrinkage)
+
+    def approximate_distances(self, activations):
+        """Calculates all requested distances on a random projection of the
+        activations (see rdm_distances.approximate_rdms)
+
+        Args:
+            activations (array or str): flattened activations for each image (78, 193600)
+                or path to a memmapped .npy file with them
+
+        Returns:
+            dict: {distance: image x image array}
+            dict: {distance: {"dimensions", "max", "mean"}} relative errors on n_check images
+        """
+        return layer_rdms(activations, self.distances, block_size=self.block_size, approximate=self.approximate,
+                          seed=self.seed, n_check=self.n_check)
+
+    def rank_activations(self, activations):
+        """Ranks the activations of every image if spearman is requested
 
-    def create_rdms(self):
+        Args:
+            activations (array or str): flattened activations for each image (78, 193600)
+                or path to a memmapped .npy file with them
+
+        Returns:
+            array: the activations (opened if a path was given)
+            array or None: the ranks, memmapped next to memmapped activations
+        """
+        return rank_activations(activations, self.distances)
+
+    def load_stats(self, layer_id, stimuli, activations=None):
+        """Loads the saved statistics of a layer if they can be extended to the
+        current feature files
+
+        Args:
+            layer_id (str): name of layer
+            stimuli (list): IDs of the current stimuli
+            activations (array, optional): current activations in the order of stimuli. If given,
+                the statistics are only used if they were computed from the same features
+                (e.g. not from another checkpoint with the same shapes). Defaults to None.
+
+        Returns:
+            GramAccumulator or None: the statistics, None if there are no usable ones
+            list: stimuli covered by the statistics
+        """
+        stats_file = os.path.join(self.stats_path, layer_id + ".npz")
+        if not os.path.exists(stats_file):
+            return None, []
+
+        with np.load(stats_file, allow_pickle=False) as state:
+            old_stimuli = state["stimuli"].tolist()
+            if not set(old_stimuli) <= set(stimuli):
+                return None, []  # images were removed or renamed
+            if activations is not None:
+                position = {stimulus: i for i, stimulus in enumerate(stimuli)}
+                old_hash = str(state["feature_hash"]) if "feature_hash" in state else None
+                if old_hash != feature_hash(activations, rows=[position[s] for s in old_stimuli]):
+                    return None, []  # the features changed since
+            try:
+                accumulator = GramAccumulator.from_state(state, self.distances)
+            except KeyError:
+                return None, []  # statistics were saved for other distances
+        return accumulator, old_stimuli
+
+    def save_stats(self, layer_id, accumulator, stimuli, features_hash=None):
+        """Saves the statistics of a layer
+
+        Args:
+            layer_id (str): name of layer
+            accumulator (GramAccumulator): statistics
+            stimuli (list): stimuli in the order of the statistics
+            features_hash (str, optional): feature_hash of the activations in that order
+        """
+        ensure_directory(self.stats_path)
+        extra = {} if features_hash is None else {"feature_hash": np.array(features_hash)}
+        np.savez(os.path.join(self.stats_path, layer_id + ".npz"),
+                 stimuli=np.array(stimuli), **extra, **accumulator.state())
+
+    def update_distances(self, layer_id, activations):
+        """Calculates the distances of a layer from its saved statistics. Only
+        images that are not in the statistics yet are added, the statistics
+        are saved again afterwards.
+
+        Args:
+            layer_id (str): name of layer
+            activations (array): flattened activations for each image (78, 193600)
+
+        Returns:
+            dict: {distance: image x image array}
+        """
+        stimuli = self.reader.stimuli
+        activations, ranks = self.rank_activations(activations)
+        accumulator, old_stimuli = self.load_stats(layer_id, stimuli, activations)
+
+        if accumulator is None or accumulator.num_features != activations.shape[1]:
+            accumulator = accumulate(activations, self.distances, self.block_size,
+                                     ranks=ranks, incremental=True)
+        elif len(old_stimuli) < len(stimuli):
+            position = {stimulus: i for i, stimulus in enumerate(stimuli)}
+            old_rows = [position[s] for s in old_stimuli]
+            new_rows = sorted(set(range(len(stimuli))) - set(old_rows))
+            accumulator.add_rows(activations, old_rows, new_rows, ranks, self.block_size)
+
+            # Back into the order of the feature files
+            current = old_rows + new_rows
+            accumulator.reorder(np.argsort(current))
+
+        features_hash = self._feature_hashes.get(layer_id) or feature_hash(activations)
+        self.save_stats(layer_id, accumulator, stimuli, features_hash)
+        return accumulator.rdms(self.shrinkage)
+
+    def load_activations(self, layer_list, memmap_dir=None):
+        """Reads all features in a single pass into one preallocated matrix per
+        layer. Every npz or pt file is opened once, hdf5 files are read in
+        slices of rows.
+
+        Args:
+            layer_list (list): names of the layers to load
+            memmap_dir (str, optional): If given, the matrices are memmapped .npy
+                files in this folder instead of arrays in memory. Defaults to None.
+
+        Returns:
+            dict: {layer: array (num_condns, num_features)}
+        """
+
+        num_condns = len(self.reader)
+        layer_info = self.reader.layer_info()
+
+        # Allocate the matrices with shape and dtype of the first stimulus
+        activations = {}
+        for counter, layer in enumerate(layer_list):
+            num_features, dtype = layer_info[layer]
+            shape = (num_condns, num_features)
+            if memmap_dir is None:
+                activations[layer] = np.empty(shape, dtype=dtype)
+            else:
+                activations[layer] = np.lib.format.open_memmap(
+                    os.path.join(memmap_dir, f"{counter}.npy"), mode="w+",
+                    dtype=dtype, shape=shape)
+
+        self.reader.read_into(activations)
+        return activations
+
+    def create_rdms(self, n_jobs=1):
         """
         Main function to create RDMs from before created features
 
@@ -149,6 +524,7 @@ class RDMCreator:
         feat_dir: Directory containing activations generated using generate_features.py
         save_dir : directory to save the computed RDM
         dist : dist used for computing RDM (e.g. 1-Pearson's R)
+        n_jobs : number of processes that compute the RDMs of different layers in parallel
 
         Output:
         One RDM per Network Layer in npy-format
@@ -161,22 +537,86 @@ class RDMCreator:
         # layer_list = ['conv1', 'conv2', 'conv3', 'conv4', 'conv5', 'fc6', 'fc7', 'fc8']
         # num_conds = 78 (amount of images)
 
-        cwd = os.getcwd()  # current working dir
-
-        for layer in range(num_layers):  # for each layer
+        # Out-of-core: keep the activations in memmapped files on disk, by
+        # default next to the RDMs rather than in a possibly RAM-backed /tmp
+        memmap_dir = None
+        if self.block_size is not None:
+            parent = self.save_path if self.memmap_dir is None else self.memmap_dir
+            os.makedirs(parent, exist_ok=True)
+            memmap_dir = tempfile.mkdtemp(prefix=".net2brain_memmap_", dir=parent)
+
+        try:
+            # One pass over all files collects the activations of all layers
+            activations = self.load_activations(layer_list, memmap_dir)
+            if self.condensed:
+                self._feature_hashes = {layer: feature_hash(activations[layer]) for layer in layer_list}
+
+            if self.incremental:
+                for layer_id in layer_list:
+                    self.save_rdms(layer_id, self.update_distances(layer_id, activations.pop(layer_id)))
+            elif n_jobs > 1:
+                with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                    futures = {}
+                    for layer_id in layer_list:
+                        layer_activations = activations.pop(layer_id)
+                        if isinstance(layer_activations, np.memmap):
+                            # Send the path, not a pickled copy of the data
+                            layer_activations.flush()
+                            layer_activations = layer_activations.filename
+                        # A module-level function, pickling self.distance would send the reader along
+                        futures[layer_id] = pool.submit(
+                            layer_rdms, layer_activations, self.distances, block_size=self.block_size,
+                            shrinkage=self.shrinkage, approximate=self.approximate, seed=self.seed,
+                            n_check=self.n_check)
+                    for layer_id, future in futures.items():
+                        self.save_rdms(layer_id, *future.result())
+            else:
+                for layer_id in layer_list:
+                    # Calculate distance of RDMs and free the layer right after
+                    rdms, errors = self.distance(activations.pop(layer_id))
+                    self.save_rdms(layer_id, rdms, errors)
+                    del rdms
+        finally:
+            if memmap_dir is not None:
+                shutil.rmtree(memmap_dir, ignore_errors=True)
+
+        if self.approximation_errors:
+            with open(os.path.join(self.save_path, 'approximation_errors.json'), 'w') as fp:
+                json.dump(self.approximation_errors, fp, sort_keys=True, indent=4)
+
+    def save_rdms(self, layer_id, rdms, errors=None):
+        """Saves the RDMs of a layer
 
-            os.chdir(cwd)  # go to current dir, otherwise we will have path errors
-            layer_id = layer_list[layer]  # current layer name
-            RDM_filename_fmri = os.path.join(self.save_path, layer_id + ".npz")  # the savepaths
-            activations = []
+        Args:
+            layer_id (str): name of layer
+            rdms (dict): {distance: image x image array}
+            errors (dict, optional): approximation errors of the RDMs, written to
+                approximation_errors.json. Defaults to None.
+        """
+        if errors is not None:
+            self.approximation_errors[layer_id] = errors
+        for distance, rdm in rdms.items():
+            self.save_rdm(layer_id, rdm, distance)
 
-            for i in tqdm(range(num_condns)):  # for each datafile for the current layer
-                feature_i = self.get_features(layer_id, i)  # get activations of the current layer
-                activations.append(feature_i)  # collect in a list
+    def save_rdm(self, layer_id, rdm, distance=None):
+        """Saves the RDM of a layer. With a single distance it goes straight
+        into save_path, with several into one subfolder per distance.
 
-            # Calculate distance of RDMs
-            rdm = self.distance(activations)
+        Args:
+            layer_id (str): name of layer
+            rdm (numpy array): image x image array
+            distance (str, optional): distance of the RDM. Defaults to the first requested one.
+        """
+        distance = distance or self.distances[0]
+        save_path = self.save_path
+        if len(self.distances) > 1:
+            save_path = os.path.join(save_path, distance)
+            ensure_directory(save_path)
 
-            # saving RDM
+        RDM_filename_fmri = os.path.join(save_path, layer_id + ".npz")  # the savepaths
+        if self.condensed:
+            save_condensed_rdm(RDM_filename_fmri, rdm, stimuli=self.reader.stimuli, metric=distance,
+                               model=self.model_name, layer=layer_id,
+                               feature_hash=self._feature_hashes.get(layer_id))
+        else:
             np.savez(RDM_filename_fmri, rdm)
-            del rdm
@@ -1,9 +1,21 @@
+import shutil
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import pytest
+from scipy import stats
 
+from net2brain.evaluations.comparators import KendallTauA, count_inversions, get_comparator, kendall_tau_a
+from net2brain.evaluations.resampling import (batched_correlation, dense_ranks, permutation_indices,
+                                              permutation_test, resample_indices, resample_ranks,
+                                              resample_rdms)
+from net2brain.evaluations.eval_helper import RDMCache, sq, standardize, upper_triangles
+from net2brain.evaluations.leaderboard import Leaderboard
+from net2brain.evaluations.model_comparison import compare_models
+from net2brain.evaluations.results_store import ResultsStore
 from net2brain.evaluations.rsa import RSA
+from net2brain.evaluations.temporal_generalization import cluster_permutation_test, temporal_generalization
 
 
 @pytest.mark.parametrize(
@@ -34,3 +46,391 @@ def test_rsa(root_path, case, model_name):
     gt = gt.sort_values(by=["ROI", "Layer"]).reset_index(drop=True)
 
     pd.testing.assert_frame_equal(df, gt)
+
+
+def test_rsa_bootstrap(root_path):
+    data_path = root_path / "test_cases"
+    brain_path = root_path / Path("data", "brain_data")
+    rsa = RSA(
+        brain_rdms_path=brain_path,
+        model_rdms_path=str(data_path / "case1" / "rdm"),
+        model_name="ResNet18",
+    )
+
+    df, distributions = rsa.bootstrap(n_resamples=50, return_distributions=True)
+    gt = pd.read_csv(data_path / "case1" / "rsa" / "results.csv")
+    assert np.allclose(df.sort_values(by=["ROI", "Layer"])["R2"], gt.sort_values(by=["ROI", "Layer"])["R2"])
+    assert (df["CI_low"] <= df["CI_high"]).all()
+    assert all(len(samples) == 50 for samples in distributions.values())
+
+    # A resample indexed from the full RDMs equals the RSA of the resampled stimuli
+    brain_rdms = np.load(brain_path / "fmri_EVC_RDMs.npz")["arr_0"]
+    model_rdm = np.load(data_path / "case1" / "rdm" / rsa.model_rdms[0])["arr_0"]
+    for mode in ["bootstrap", "subsample"]:
+        indices = resample_indices(len(model_rdm), 3, mode=mode, seed=1)
+        corr = batched_correlation(resample_rdms(model_rdm, indices), resample_rdms(brain_rdms, indices))
+        rows, cols = np.triu_indices(indices.shape[1], 1)
+        for resample, idx in zip(corr, indices):
+            i, j = np.minimum(idx[rows], idx[cols]), np.maximum(idx[rows], idx[cols])
+            keep = i != j
+            expected = [stats.spearmanr(model_rdm[i[keep], j[keep]], rdm[i[keep], j[keep]])[0]
+                        for rdm in brain_rdms]
+            assert np.allclose(resample, expected)
+
+        ranks = resample_ranks(dense_ranks(brain_rdms), indices)
+        assert np.allclose(ranks, stats.rankdata(resample_rdms(brain_rdms, indices), axis=-1, nan_policy="omit"),
+                           equal_nan=True)
+
+
+def test_rsa_layer_correlations(root_path):
+    brain_path = root_path / Path("data", "brain_data")
+    rsa = RSA(
+        brain_rdms_path=brain_path,
+        model_rdms_path=str(root_path / "test_cases" / "case1" / "rdm"),
+        model_name="ResNet18",
+    )
+    model_rdms = [np.load(Path(rsa.model_rdms_path, layer))["arr_0"] for layer in rsa.model_rdms]
+    brain_rdms = np.load(brain_path / "fmri_IT_RDMs.npz")["arr_0"]
+    rows, cols = np.triu_indices(brain_rdms.shape[-1], 1)
+
+    # fMRI (subjects, stimuli, stimuli) and MEG-like (subjects, timepoints, stimuli, stimuli)
+    for rdms in [brain_rdms, brain_rdms.reshape(5, 3, *brain_rdms.shape[1:])]:
+        correlations = rsa.layer_correlations(rdms)
+        for model_rdm, layer_correlations in zip(model_rdms, correlations):
+            expected = [stats.spearmanr(model_rdm[rows, cols], rdm[rows, cols])[0]
+                        for rdm in rdms.reshape(-1, *rdms.shape[-2:])]
+            assert np.allclose(layer_correlations.ravel(), expected)
+
+
+def test_rdm_cache(tmp_path):
+    cache = RDMCache(max_bytes=2 * 8 * 100)
+    paths = [tmp_path / f"rdm_{i}.npz" for i in range(3)]
+    for i, path in enumerate(paths):
+        np.savez(path, np.full((10, 10), i, dtype=np.float64))
+
+    first = cache.load(paths[0])
+    assert cache.load(paths[0]) is first and cache.hits == 1
+    with pytest.raises(ValueError):
+        first["arr_0"][0, 0] = 1  # cached arrays are read-only
+
+    # A rewritten file is loaded again
+    np.savez(paths[0], np.full((10, 11), 5, dtype=np.float64))
+    assert cache.load(paths[0])["arr_0"].shape == (10, 11)
+
+    # Only two arrays fit, the least recently used one is dropped
+    cache.load(paths[1])
+    cache.load(paths[2])
+    assert cache.nbytes <= cache.max_bytes
+    misses = cache.misses
+    cache.load(paths[2])
+    assert cache.misses == misses
+    cache.load(paths[0])
+    assert cache.misses == misses + 1
+
+    # Shrinking drops the least recently used entries, clear drops all
+    cache.resize(8 * 110)
+    assert cache.nbytes <= 8 * 110
+    cache.load(paths[0])
+    assert cache.misses == misses + 1
+    cache.clear()
+    assert cache.nbytes == 0
+    cache.load(paths[0])
+    assert cache.misses == misses + 2
+
+    # A cache of size 0 keeps nothing
+    cache.resize(0)
+    cache.load(paths[1])
+    assert cache.nbytes == 0
+
+
+@pytest.mark.parametrize("distance_metric", ["spearman", "pearson", "kendall_tau_a"])
+def test_leaderboard(root_path, distance_metric):
+    data_path = root_path / "test_cases"
+    brain_path = root_path / Path("data", "brain_data")
+    models = {"ResNet18": str(data_path / "case1" / "rdm"), "RN50": str(data_path / "case2" / "rdm")}
+
+    df = Leaderboard(list(models.values()), brain_path, model_names=list(models), n_jobs=2,
+                     distance_metric=distance_metric).evaluate()
+    expected = pd.concat([RSA(path, brain_path, name, distance_metric=distance_metric).evaluate()
+                          for name, path in models.items()], ignore_index=True)
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("distance_metric", ["spearman", "pearson", "cosine"])
+def test_rsa_partial(root_path, distance_metric):
+    brain_path = root_path / Path("data", "brain_data")
+    rsa = RSA(
+        brain_rdms_path=brain_path,
+        model_rdms_path=str(root_path / "test_cases" / "case1" / "rdm"),
+        model_name="ResNet18",
+        distance_metric=distance_metric,
+    )
+    brain_rdms = np.load(brain_path / "fmri_IT_RDMs.npz")["arr_0"]
+    model_rdms = [sq(np.load(Path(rsa.model_rdms_path, layer))["arr_0"]) for layer in rsa.model_rdms]
+    covariate = np.random.default_rng(0).random(len(model_rdms[0]))
+
+    # Partial correlation as the correlation (cosine) of the residuals of a regression on the covariates
+    transform = stats.rankdata if distance_metric == "spearman" else np.asarray
+    design = np.column_stack([transform(covariate), transform(model_rdms[1])])
+    if distance_metric != "cosine":
+        design = np.column_stack([np.ones(len(covariate)), design])
+    residuals = lambda v: v - design @ np.linalg.lstsq(design, v, rcond=None)[0]
+    cosine = lambda a, b: a @ b / np.linalg.norm(a) / np.linalg.norm(b)
+    expected = np.mean([cosine(residuals(transform(model_rdms[0])), residuals(transform(sq(rdm))))
+                        for rdm in brain_rdms])
+
+    df = rsa.evaluate_partial([covariate, model_rdms[1]])
+    it = df[df["ROI"].str.contains("IT")]
+    assert np.isclose(it["R"].iloc[0], expected)
+
+    # A layer that is a covariate has no unique contribution
+    assert it["R"].iloc[1] == 0 and it["Beta"].iloc[1] == 0
+
+
+def test_rsa_partial_unsupported(root_path):
+    rsa = RSA(str(root_path / "test_cases" / "case1" / "rdm"), root_path / Path("data", "brain_data"),
+              "ResNet18", distance_metric="kendall_tau_a")
+    with pytest.raises(ValueError):
+        rsa.evaluate_partial([np.ones(rsa.model_vectors.shape[-1])])
+
+
+def test_compare_models(root_path):
+    data_path = root_path / "test_cases"
+    brain_path = root_path / Path("data", "brain_data")
+    rsas = [RSA(str(data_path / case / "rdm"), brain_path, name)
+            for case, name in [("case1", "ResNet18"), ("case2", "RN50"), ("case1", "Copy")]]
+    comparison = compare_models(rsas, n_bootstrap=200)
+
+    roi = rsas[0].brain_rdms[0]
+    scan_key = "(0) " + roi[:-4]
+    t = comparison["T"].loc[scan_key]
+    assert t.shape == (3, 3)
+    np.testing.assert_allclose(t.values, -t.values.T)
+    assert comparison["Difference"].loc[(scan_key, "ResNet18"), "Copy"] == 0
+    assert (comparison["CI_low"] <= comparison["CI_high"]).all().all()
+
+    best = [np.square(rsa.roi_correlations(roi)).mean(-1).argmax() for rsa in rsas[:2]]
+    r2 = [np.square(rsa.roi_correlations(roi)[i]) for rsa, i in zip(rsas, best)]
+    expected = stats.ttest_rel(r2[1], r2[0])
+    assert np.isclose(t.loc["RN50", "ResNet18"], expected[0])
+    assert np.isclose(comparison["Significance"].loc[(scan_key, "RN50"), "ResNet18"], expected[1])
+
+    comp_dic, sig_pairs = rsas[0].compare_model(rsas[1])
+    assert np.allclose(comp_dic[scan_key], expected)
+
+
+def test_compare_model_changes(root_path):
+    # Pins how compare_model differs from its first version: best layer by argmax,
+    # paired t-test and significance at p < 0.05
+    brain_path = root_path / Path("data", "brain_data")
+    rsas = [RSA(str(root_path / "test_cases" / "case1" / "rdm"), brain_path, name) for name in ["A", "B"]]
+    rng = np.random.default_rng(0)
+    base = rng.uniform(0.4, 0.8, 8)
+    worst = np.full(8, 0.1)
+    for roi, (offset, sd) in zip(rsas[0].brain_rdms, [(0.05, 0.02), (0.01, 0.03)]):
+        other = base + offset + rng.normal(0, sd, 8)
+        rsas[0]._roi_correlations[roi] = np.stack([base, worst])
+        rsas[1]._roi_correlations[roi] = np.stack([other, worst + 0.05])
+
+    comp_dic, sig_pairs = rsas[0].compare_model(rsas[1])
+    significant = [pair[0][0] for pair in sig_pairs]
+    for counter, roi in enumerate(rsas[0].brain_rdms):
+        scan_key = "(" + str(counter) + ") " + roi[:-4]
+        best = [rsa._roi_correlations[roi][0] ** 2 for rsa in rsas]
+        expected = stats.ttest_rel(best[1], best[0])
+        assert np.allclose(comp_dic[scan_key], expected)
+        assert not np.isclose(comp_dic[scan_key][1], stats.ttest_ind(best[1], best[0])[1])
+        assert (scan_key in significant) == (expected[1] < 0.05)
+
+    # One ROI is significant, the other only at the former threshold of 0.5
+    p_values = sorted(p for _, p in comp_dic.values())
+    assert p_values[0] < 0.05 < p_values[1] < 0.5
+    assert len(sig_pairs) == 1
+
+
+def test_results_store(root_path, tmp_path):
+    store = ResultsStore()
+    store.append({"Model": "A", "Layer": "l1", "ROI": "IT", "R2": 0.1}, "rsa")
+    store.extend({"Model": ["A", "A"], "Layer": ["l2", "l1"], "ROI": ["IT", "IT"], "R2": [0.2, 0.3]}, "rsa")
+    df = store.to_dataframe()
+    assert list(df["Layer"]) == ["l2", "l1"] and list(df["R2"]) == [0.2, 0.3]
+    assert store.contains("A", "l1", "IT", "rsa") and not store.contains("A", "l1", "IT", "wrsa")
+
+    # Evaluations resume from the store
+    rsa = RSA(str(root_path / "test_cases" / "case1" / "rdm"), root_path / Path("data", "brain_data"), "ResNet18")
+    store = ResultsStore()
+    df = rsa.evaluate(store=store)
+    rsa.evaluate_roi = None  # nothing is evaluated again
+    pd.testing.assert_frame_equal(rsa.evaluate(store=store), df)
+
+    # Resuming is keyed on the file names, not on the position of the ROI
+    brain_path = tmp_path / "brain"
+    brain_path.mkdir()
+    shutil.copy(root_path / "data" / "brain_data" / "fmri_IT_RDMs.npz", brain_path)
+    store = ResultsStore()
+    RSA(rsa.model_rdms_path, brain_path, "ResNet18").evaluate(store=store)
+    shutil.copy(root_path / "data" / "brain_data" / "fmri_EVC_RDMs.npz", brain_path)
+    rsa = RSA(rsa.model_rdms_path, brain_path, "ResNet18")
+    rsa.brain_rdms = ["fmri_EVC_RDMs.npz", "fmri_IT_RDMs.npz"]
+    evaluated = []
+    evaluate_roi = rsa.evaluate_roi
+    rsa.evaluate_roi = lambda roi: evaluated.append(roi) or evaluate_roi(roi)
+    df = rsa.evaluate(store=store)
+    assert evaluated == ["fmri_EVC_RDMs.npz"]
+    assert list(df["ROI"].unique()) == ["(0) fmri_EVC_RDMs", "(1) fmri_IT_RDMs"]
+    assert set(store.to_dataframe()["ROI"]) == {"fmri_EVC_RDMs.npz", "fmri_IT_RDMs.npz"}
+
+    pytest.importorskip("pyarrow")
+    store = ResultsStore(tmp_path / "results")
+    store.extend(df, "rsa_spearman")
+    store.flush()
+    store.append(dict(df.iloc[0], R2=1.), "rsa_spearman")
+    store.flush()
+    stored = ResultsStore(tmp_path / "results").read(model="ResNet18", roi=df["ROI"][0])
+    assert len(stored) == (df["ROI"] == df["ROI"][0]).sum()
+    assert stored.set_index("Layer").loc[df["Layer"][0], "R2"] == 1.
+
+
+def test_rsa_permutation_test(root_path):
+    brain_path = root_path / Path("data", "brain_data")
+    rsa = RSA(
+        brain_rdms_path=brain_path,
+        model_rdms_path=str(root_path / "test_cases" / "case1" / "rdm"),
+        model_name="ResNet18",
+    )
+    df = rsa.permutation_test(n_permutations=200, batch_size=64)
+    assert ((df["Significance"] >= 1 / 201) & (df["Significance"] <= 1)).all()
+    assert (df["Significance_FWE"] >= df["Significance"]).all()
+
+    # The null distribution equals the RSA of explicitly permuted model RDMs
+    brain_rdms = np.load(brain_path / "fmri_IT_RDMs.npz")["arr_0"]
+    model_rdm = np.load(Path(rsa.model_rdms_path, rsa.model_rdms[0]))["arr_0"]
+    brain_vectors = standardize(upper_triangles(brain_rdms))
+    observed, null = permutation_test(rsa.model_vectors, brain_vectors, n_permutations=3, batch_size=2, seed=1)
+    for permutation, value in zip(permutation_indices(len(model_rdm), 3, seed=1), null[0]):
+        permuted = model_rdm[np.ix_(permutation, permutation)]
+        expected = np.mean([stats.spearmanr(sq(permuted), sq(rdm))[0] for rdm in brain_rdms])
+        assert np.isclose(value, expected)
+
+
+def test_comparators():
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 5, 300).astype(float)  # ties, like a categorical model RDM
+    y = np.concatenate([rng.integers(0, 20, (3, 300)), rng.random((2, 300))]).astype(float)
+
+    # Kendall tau-a from scipy's tau-b and the number of tied pairs
+    pairs = 300 * 299 / 2
+    for row, tau in zip(y, kendall_tau_a(x, y)):
+        tied_x = sum(c * (c - 1) / 2 for c in np.unique(x, return_counts=True)[1])
+        tied_y = sum(c * (c - 1) / 2 for c in np.unique(row, return_counts=True)[1])
+        expected = stats.kendalltau(x, row)[0] * np.sqrt((pairs - tied_x) * (pairs - tied_y)) / pairs
+        assert np.isclose(tau, expected)
+
+    values = rng.random((4, 50))
+    expected = [sum(v[i] > v[j] for i in range(50) for j in range(i + 1, 50)) for v in values]
+    np.testing.assert_array_equal(count_inversions(values), expected)
+
+    comparator = KendallTauA()
+    np.testing.assert_allclose(comparator.compare(comparator.prepare(x[None]), comparator.prepare(y)),
+                               kendall_tau_a(x, y)[None])
+
+    for name, reference in [("spearman", lambda a, b: stats.spearmanr(a, b)[0]),
+                            ("pearson", lambda a, b: stats.pearsonr(a, b)[0]),
+                            ("cosine", lambda a, b: a @ b / np.linalg.norm(a) / np.linalg.norm(b))]:
+        comparator = get_comparator(name)
+        values = comparator.compare(comparator.prepare(x[None]), comparator.prepare(y))
+        np.testing.assert_allclose(values[0], [reference(x, row) for row in y])
+
+    # Whitened Pearson is invariant to a common shift and scale
+    comparator = get_comparator("whitened_pearson")
+    rdms = rng.random((2, 25, 25))
+    vectors = upper_triangles(rdms)
+    values = comparator.compare(comparator.prepare(vectors[:1]), comparator.prepare(3 * vectors + 1))
+    assert np.isclose(values[0, 0], 1)
+    assert -1 <= values[0, 1] <= 1
+
+    with pytest.raises(ValueError):
+        get_comparator("manhattan")
+
+
+@pytest.mark.parametrize("distance_metric", ["pearson", "kendall_tau_a"])
+def test_rsa_distance_metric(root_path, distance_metric):
+    brain_path = root_path / Path("data", "brain_data")
+    rsa = RSA(
+        brain_rdms_path=brain_path,
+        model_rdms_path=str(root_path / "test_cases" / "case1" / "rdm"),
+        model_name="ResNet18",
+        distance_metric=distance_metric,
+    )
+    brain_rdms = np.load(brain_path / "fmri_IT_RDMs.npz")["arr_0"]
+    model_rdm = np.load(Path(rsa.model_rdms_path, rsa.model_rdms[0]))["arr_0"]
+    correlations = rsa.layer_correlations(brain_rdms)
+    assert correlations.shape == (len(rsa.model_rdms), len(brain_rdms))
+    np.testing.assert_allclose(correlations[0], rsa.distance(model_rdm, brain_rdms))
+    if distance_metric == "pearson":
+        np.testing.assert_allclose(correlations[0], [stats.pearsonr(sq(model_rdm), sq(rdm))[0] for rdm in brain_rdms])
+    else:
+        with pytest.raises(ValueError):
+            rsa.permutation_test(n_permutations=10)
+    with pytest.raises(ValueError):
+        rsa.bootstrap(n_resamples=2)
+
+
+def test_rsa_over_time(root_path, tmp_path):
+    rng = np.random.default_rng(0)
+    meg_rdms = rng.random((3, 8, 78, 78))
+    np.savez(tmp_path / "meg_test.npz", meg_rdms)
+    rsa = RSA(
+        brain_rdms_path=tmp_path,
+        model_rdms_path=str(root_path / "test_cases" / "case1" / "rdm"),
+        model_name="ResNet18",
+    )
+    model_rdm = np.load(Path(rsa.model_rdms_path, rsa.model_rdms[0]))["arr_0"]
+
+    df = rsa.evaluate_over_time(metric="R", time_chunk=3)
+    assert list(df.columns[:4]) == ["Name", "Values", "Significance", "Color"]
+    expected = [[stats.spearmanr(sq(model_rdm), sq(rdm))[0] for rdm in subject] for subject in meg_rdms]
+    assert np.allclose(df["Values"][0], expected)
+    assert df["Significance"][0].shape == (8,)
+
+    df = rsa.evaluate_over_time(smoothing=3, downsample=2)
+    assert df["Values"][0].shape == (3, 4)
+
+
+def test_rsa_temporal_generalization_comparator(root_path, tmp_path):
+    rng = np.random.default_rng(0)
+    meg_rdms = rng.random((2, 3, 78, 78))
+    np.savez(tmp_path / "meg_test.npz", meg_rdms)
+    rsa = RSA(
+        brain_rdms_path=tmp_path,
+        model_rdms_path=str(root_path / "test_cases" / "case1" / "rdm"),
+        model_name="ResNet18",
+        distance_metric="pearson",
+    )
+    model_rdm = np.load(Path(rsa.model_rdms_path, rsa.model_rdms[0]))["arr_0"]
+
+    df = rsa.evaluate_temporal_generalization()
+    assert df["Values"][0].shape == (2, 3, 1)
+    assert np.isclose(df["Values"][0][1, 2, 0], stats.pearsonr(sq(meg_rdms[1, 2]), sq(model_rdm))[0])
+
+
+def test_temporal_generalization():
+    rng = np.random.default_rng(0)
+    shared = rng.random((20, 20))
+    brain_rdms = rng.random((6, 15, 20, 20))
+    model_rdms = rng.random((5, 20, 20))
+    brain_rdms[:, 5:10] += 2 * (shared + shared.T)
+    model_rdms[1:3] += 2 * (shared + shared.T)
+
+    maps = temporal_generalization(model_rdms, brain_rdms, time_chunk=4)
+    assert maps.shape == (6, 15, 5)
+    assert np.isclose(maps[2, 7, 1], stats.spearmanr(sq(brain_rdms[2, 7]), sq(model_rdms[1]))[0])
+    pearson = temporal_generalization(model_rdms, brain_rdms, time_chunk=4, comparator="pearson")
+    assert np.isclose(pearson[2, 7, 1], stats.pearsonr(sq(brain_rdms[2, 7]), sq(model_rdms[1]))[0])
+    kendall = temporal_generalization(model_rdms[:2], brain_rdms[:2, :3], comparator="kendall_tau_a")
+    assert np.isclose(kendall[1, 2, 1], stats.kendalltau(sq(brain_rdms[1, 2]), sq(model_rdms[1]))[0])
+
+    t_map, labels, p_values = cluster_permutation_test(maps, n_permutations=200)
+    assert np.allclose(t_map, stats.ttest_1samp(maps, 0, axis=0)[0])
+    significant = np.isin(labels, np.flatnonzero(p_values < 0.05) + 1)
+    assert significant[5:10, 1:3].all()
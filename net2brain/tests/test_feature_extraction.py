@@ -1,10 +1,12 @@
 from pathlib import Path
 
+import numpy as np
 import pytest
+import torch
 from torchvision import models
 from torchvision import transforms as T
 
-from net2brain.feature_extraction import FeatureExtractor
+from net2brain.feature_extraction import FeatureExtractor, _as_image_input, find_model_like_name
 
 
 @pytest.mark.parametrize(
@@ -119,6 +121,92 @@ def test_feature_extraction_custom(root_path, tmp_path):
     return
 
 
+def test_plan_extraction(root_path, tmp_path):
+    imgs_path = root_path / "images"
+    fx = FeatureExtractor(
+        models.alexnet(), layers_to_extract=["features.0", "classifier.1"], device="cpu"
+    )
+
+    inventory = fx.get_layer_inventory()
+    assert set(fx.layers_to_extract) <= set(inventory["Layer"])
+
+    plan = fx.plan_extraction(imgs_path)
+    assert list(plan["layers"]["Layer"]) == ["features.0", "classifier.1"]
+    assert plan["disk_bytes"] == 2 * (64 * 55 * 55 + 4096) * 4
+
+    with pytest.raises(ValueError):
+        fx.extract(imgs_path, save_path=tmp_path, disk_budget=1)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_extract_from_stimuli_in_memory():
+    from PIL import Image
+
+    fx = FeatureExtractor(
+        models.alexnet().eval(), layers_to_extract=["features.0"], device="cpu"
+    )
+    stimuli = [
+        np.random.rand(32, 32, 3),
+        Image.new("RGB", (40, 30)),
+        torch.rand(3, 48, 48),
+    ]
+
+    streamed = list(fx.iter_features(stimuli, stimulus_ids=["a", "b", "c"], batch_size=2))
+    assert [stimulus_id for stimulus_id, _ in streamed] == ["a", "b", "c"]
+
+    feats = fx.extract_from_stimuli(stimuli, batch_size=2)
+    assert feats["features.0"].shape[0] == 3
+    for i, (_, fts) in enumerate(streamed):
+        assert torch.allclose(fts["features.0"][0], feats["features.0"][i], atol=1e-5)
+
+    # Float tensors and arrays outside [0, 1] are clipped, not wrapped around
+    for stimulus in (torch.tensor([[[1.5, -0.5]]] * 3), np.array([[[1.5] * 3, [-0.5] * 3]])):
+        pixels = np.asarray(Image.open(_as_image_input(stimulus)))
+        assert (pixels[0, 0] == 255).all() and (pixels[0, 1] == 0).all()
+
+
+def test_random_ensemble(root_path):
+    model = models.alexnet()
+    fx = FeatureExtractor(model, layers_to_extract=["classifier.1"], device="cpu")
+    with pytest.raises(ValueError):
+        fx.extract_random_ensemble(root_path / "images", seeds=[1, 2, 1])
+    rdms = fx.extract_random_ensemble(root_path / "images", seeds=[1, 2], batch_size=2)
+
+    assert sorted(rdms.keys()) == [1, 2]
+    assert rdms[1]["classifier.1"].shape == (2, 2)
+    assert fx.model is model
+
+    feats = fx.extract_random_ensemble(root_path / "images", seeds=[1, 2], output="features")
+    assert not np.allclose(feats[1]["classifier.1"], feats[2]["classifier.1"])
+    again = fx.extract_random_ensemble(root_path / "images", seeds=[1], output="features")
+    assert np.allclose(feats[1]["classifier.1"], again[1]["classifier.1"])
+
+
+def test_quantized_extraction(root_path):
+    layers = ["features.3", "classifier.1"]
+    fx = FeatureExtractor(models.alexnet().eval(), layers_to_extract=layers, device="cpu")
+    fx.quantize("dynamic")
+
+    report = fx.quantization_report(root_path / "data" / "stimuli_data", n_stimuli=10)
+    assert list(report["Layer"]) == layers
+    assert (report["Spearman"] > 0.9).all()
+
+    fx.quantize("static", calibration_stimuli=root_path / "images")
+    feats = fx.extract_from_stimuli(sorted((root_path / "images").iterdir()))
+    assert list(feats.keys()) == layers
+
+
+def test_find_model_like_name_literal():
+    from net2brain.architectures.taxonomy import read_taxonomy_csv
+
+    df = read_taxonomy_csv()
+    # The same literal, case insensitive match with and without df
+    assert list(find_model_like_name("RESNET")["Model"]) == list(find_model_like_name("resnet", df)["Model"])
+    assert len(find_model_like_name("resnet")) > 0
+    assert len(find_model_like_name("res.et")) == 0
+    assert len(find_model_like_name("res.et", df)) == 0
+
+
 def test_missing_netset():
     with pytest.raises(NameError):
         FeatureExtractor("alexnet")
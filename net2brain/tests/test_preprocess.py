@@ -0,0 +1,99 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from net2brain.preprocess.rdm import eeg_classfier, eeg_rdm
+
+
+def loop_eeg_rdm(eeg, labels):
+    """Reference: one sklearn LDA per pair, timepoint and left-out trial"""
+    conditions = sorted(set(labels))
+    min_count = min(np.sum(labels == c) for c in conditions)
+    index = {c: np.where(labels == c)[0][:min_count] for c in conditions}
+
+    rdms = np.zeros((len(conditions), len(conditions), eeg.shape[-1]))
+    for tt in range(eeg.shape[-1]):
+        for l1, l2 in combinations(range(len(conditions)), 2):
+            classify = eeg_classfier(
+                eeg[index[conditions[l1]], :, tt], eeg[index[conditions[l2]], :, tt]
+            )
+            accuracy = np.mean([classify.leaveOneOut(i) for i in range(min_count)])
+            rdms[l1, l2, tt] = rdms[l2, l1, tt] = accuracy
+    return rdms
+
+
+@pytest.mark.parametrize(
+    "num_trials,num_channels,average_reference",
+    [
+        (8, 4, False),  # more trials than channels
+        (5, 12, False),  # fewer trials than channels
+        (6, 9, False),  # fold scatter rank one below the channels
+        (6, 10, False),  # as many training trials as channels
+        (10, 6, True),  # singular covariance
+    ],
+)
+def test_eeg_rdm(num_trials, num_channels, average_reference):
+    rng = np.random.default_rng(0)
+    labels = np.repeat(np.arange(5), num_trials + 1)[:-1]
+    eeg = rng.normal(size=(len(labels), num_channels, 2)) + (labels % 3)[:, None, None]
+    if average_reference:
+        eeg -= eeg.mean(axis=1, keepdims=True)
+
+    assert np.allclose(eeg_rdm(eeg, labels), loop_eeg_rdm(eeg, labels))
+
+
+def test_eeg_rdm_parallel():
+    rng = np.random.default_rng(0)
+    labels = np.repeat(np.arange(4), 6)
+    eeg = rng.normal(size=(len(labels), 5, 4))
+
+    assert np.array_equal(eeg_rdm(eeg, labels, n_jobs=2), eeg_rdm(eeg, labels))
+
+
+def test_crossnobis_rdm():
+    from sklearn.covariance import ledoit_wolf
+
+    from net2brain.preprocess.rdm import assign_folds, crossnobis_rdm
+
+    rng = np.random.default_rng(0)
+    labels = np.repeat(np.arange(4), 6)
+    eeg = rng.normal(size=(len(labels), 5, 3)) + labels[:, None, None] * rng.normal(size=(1, 5, 3))
+    folds = assign_folds(labels, 3)
+
+    # Reference with explicit loops over folds, timepoints and pairs
+    reference = np.zeros((4, 4, 3))
+    for fold in range(3):
+        def means(trials):
+            return np.stack([eeg[trials & (labels == c)].mean(axis=0) for c in range(4)])
+
+        test, train = means(folds == fold), means(folds != fold)
+        residuals = []
+        for trial in np.where(folds != fold)[0]:
+            residuals.append((eeg[trial] - train[labels[trial]]).T)
+        precision = np.linalg.inv(ledoit_wolf(np.concatenate(residuals), assume_centered=True)[0])
+        for tt in range(3):
+            for i, j in combinations(range(4), 2):
+                d = (test[i, :, tt] - test[j, :, tt]) @ precision @ (train[i, :, tt] - train[j, :, tt])
+                reference[i, j, tt] += d / 15
+                reference[j, i, tt] += d / 15
+
+    assert np.allclose(crossnobis_rdm(eeg, labels, folds=folds), reference)
+    assert crossnobis_rdm(eeg[..., 0], labels, folds=folds).shape == (4, 4)
+
+
+@pytest.mark.parametrize("explicit_folds", [False, True])
+def test_crossnobis_rdm_one_trial_per_fold(explicit_folds):
+    from net2brain.preprocess.rdm import crossnobis_rdm
+
+    # One beta per condition and run, as in most fMRI designs
+    rng = np.random.default_rng(0)
+    labels = np.repeat(np.arange(4), 5)
+    data = rng.normal(size=(len(labels), 30)) + 3 * labels[:, None] * rng.normal(size=(1, 30))
+    folds = np.tile(np.arange(5), 4) if explicit_folds else None
+
+    rdm = crossnobis_rdm(data, labels, folds=folds)
+    assert rdm.shape == (4, 4) and np.all(np.isfinite(rdm))
+    assert np.allclose(rdm, rdm.T) and np.allclose(np.diag(rdm), 0)
+    # Conditions further apart in signal are further apart in the RDM
+    assert rdm[0, 3] > rdm[0, 1] > 0
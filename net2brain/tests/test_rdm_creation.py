@@ -22,3 +22,274 @@ def test_rdm_creator(root_path, tmp_path, case):
         gt = np.load(gt_file)["arr_0"]
         test = np.load(test_file)["arr_0"]
         assert np.allclose(gt, test)
+
+
+@pytest.mark.parametrize("source", ["npz", "dict"])
+def test_rdm_creator_parallel(root_path, tmp_path, source):
+    data_path = root_path / "test_cases" / "case1"
+
+    feat_path = str(data_path / "features")
+    if source == "dict":
+        # In-memory features stay in the parent, workers only get their layer
+        features = [dict(np.load(f)) for f in sorted((data_path / "features").glob("*.npz"))]
+        feat_path = {layer: np.concatenate([feat[layer] for feat in features]) for layer in features[0]}
+    rdm = RDMCreator(feat_path=feat_path, save_path=str(tmp_path))
+    rdm.create_rdms(n_jobs=2)
+
+    for gt_file in (data_path / "rdm").glob("*.npz"):
+        gt = np.load(gt_file)["arr_0"]
+        test = np.load(tmp_path / gt_file.name)["arr_0"]
+        assert np.allclose(gt, test)
+
+
+def test_rdm_creator_blockwise(root_path, tmp_path, case):
+    data_path = root_path / "test_cases" / case
+
+    memmap_dir = tmp_path / "memmaps"
+    rdm = RDMCreator(
+        feat_path=str(data_path / "features"), save_path=str(tmp_path), block_size=1000,
+        memmap_dir=str(memmap_dir)
+    )
+    rdm.create_rdms()
+
+    for gt_file in (data_path / "rdm").glob("*.npz"):
+        gt = np.load(gt_file)["arr_0"]
+        test = np.load(tmp_path / gt_file.name)["arr_0"]
+        assert np.allclose(gt, test)
+
+    # The memmapped activations are removed afterwards
+    assert list(memmap_dir.iterdir()) == []
+
+
+def test_rdm_creator_invalid_distance(tmp_path):
+    with pytest.raises(ValueError):
+        RDMCreator(feat_path=str(tmp_path), save_path=str(tmp_path), distance="manhattan")
+
+
+@pytest.mark.parametrize("block_size", [None, 1000])
+def test_rdm_creator_multiple_distances(root_path, tmp_path, block_size):
+    from scipy.spatial.distance import cdist
+    from scipy.stats import spearmanr
+
+    data_path = root_path / "test_cases" / "case1"
+    distances = ["pearson", "cosine", "euclidean", "sqeuclidean", "spearman"]
+
+    rdm = RDMCreator(
+        feat_path=str(data_path / "features"),
+        save_path=str(tmp_path),
+        distance=distances,
+        block_size=block_size,
+    )
+    rdm.create_rdms()
+
+    layer = "layer4.1.bn2.npz"
+    activations = np.stack(
+        [np.load(f)["layer4.1.bn2"].ravel().astype(np.float64) for f in rdm.feature_files]
+    )
+    expected = {
+        "pearson": np.load(data_path / "rdm" / layer)["arr_0"],
+        "cosine": cdist(activations, activations, "cosine"),
+        "euclidean": cdist(activations, activations, "euclidean"),
+        "sqeuclidean": cdist(activations, activations, "sqeuclidean"),
+        "spearman": 1 - spearmanr(activations, axis=1)[0],
+    }
+    for distance, gt in expected.items():
+        test = np.load(tmp_path / distance / layer)["arr_0"]
+        assert np.allclose(gt, test, rtol=1e-4, atol=1e-5 * gt.max())
+    assert not list(tmp_path.glob(".net2brain_memmap_*"))
+
+
+def test_mahalanobis_rdm():
+    from sklearn.covariance import ledoit_wolf
+    from net2brain.utils.rdm_distances import compute_rdms
+
+    rng = np.random.default_rng(0)
+    activations = rng.normal(size=(12, 40))
+
+    cov, _ = ledoit_wolf(activations)
+    diff = activations[:, None, :] - activations[None, :, :]
+    gt = np.sqrt(np.einsum("ijk,kl,ijl->ij", diff, np.linalg.inv(cov), diff))
+
+    test = compute_rdms(activations, "mahalanobis", block_size=16, dtype=np.float64)["mahalanobis"]
+    assert np.allclose(gt, test)
+
+
+def test_rdm_creator_condensed(root_path, tmp_path):
+    from net2brain.evaluations.eval_helper import load_rdm, sq
+
+    data_path = root_path / "test_cases" / "case1"
+
+    rdm = RDMCreator(
+        feat_path=str(data_path / "features"),
+        save_path=str(tmp_path),
+        condensed=True,
+        model_name="ResNet18",
+    )
+    rdm.create_rdms()
+
+    for gt_file in (data_path / "rdm").glob("*.npz"):
+        gt = np.load(gt_file)["arr_0"]
+        test, metadata = load_rdm(tmp_path / gt_file.name)
+        assert test.dtype == np.float32 and test.ndim == 1
+        assert np.allclose(sq(gt), test, atol=1e-6)
+        assert np.allclose(gt, load_rdm(tmp_path / gt_file.name, square=True)[0], atol=1e-6)
+        assert metadata["metric"] == "pearson"
+        assert metadata["model"] == "ResNet18"
+        assert metadata["layer"] == gt_file.stem
+        assert len(metadata["stimuli"]) == gt.shape[0]
+        assert len(metadata["feature_hash"]) == 40
+
+
+def test_rdm_creator_incremental(root_path, tmp_path):
+    import shutil
+
+    feature_files = sorted((root_path / "test_cases" / "case1" / "features").glob("*.npz"))
+    feat_path = tmp_path / "features"
+    feat_path.mkdir()
+    distances = ["cosine", "euclidean", "spearman", "mahalanobis"]
+
+    # Start with every other image, the rest arrives later
+    for feature_file in feature_files[::2]:
+        shutil.copy(feature_file, feat_path)
+    RDMCreator(
+        feat_path=str(feat_path), save_path=str(tmp_path / "rdm"),
+        distance=distances, incremental=True,
+    ).create_rdms()
+
+    for feature_file in feature_files[1::2]:
+        shutil.copy(feature_file, feat_path)
+    rdm = RDMCreator(
+        feat_path=str(feat_path), save_path=str(tmp_path / "rdm"),
+        distance=distances, incremental=True,
+    )
+    stats, covered = rdm.load_stats("layer4.1.bn2", [f.stem for f in feature_files])
+    assert len(covered) == len(feature_files[::2])
+    rdm.create_rdms()
+
+    def assert_matches_full():
+        RDMCreator(
+            feat_path=str(feat_path), save_path=str(tmp_path / "full"), distance=distances
+        ).create_rdms()
+
+        for distance in distances:
+            for full_file in (tmp_path / "full" / distance).glob("*.npz"):
+                full = np.load(full_file)["arr_0"]
+                test = np.load(tmp_path / "rdm" / distance / full_file.name)["arr_0"]
+                assert np.allclose(full, test, atol=1e-5 * full.max())
+
+    assert_matches_full()
+
+    # Re-extracted features of the same shape (e.g. another checkpoint) are not
+    # mixed with the saved statistics
+    def layer_stats():
+        rdm = RDMCreator(
+            feat_path=str(feat_path), save_path=str(tmp_path / "rdm"),
+            distance=distances, incremental=True,
+        )
+        activations = rdm.load_activations(["layer4.1.bn2"])["layer4.1.bn2"]
+        return rdm, rdm.load_stats("layer4.1.bn2", rdm.reader.stimuli, activations)[0]
+
+    assert layer_stats()[1] is not None
+    changed = feat_path / feature_files[0].name
+    features = dict(np.load(changed))
+    np.savez(changed, **{layer: 2 * value + 1 for layer, value in features.items()})
+    rdm, stats = layer_stats()
+    assert stats is None
+    rdm.create_rdms()
+    assert_matches_full()
+
+
+@pytest.mark.parametrize("source", ["pt", "dataset", "dict"])
+def test_rdm_creator_feature_sources(root_path, tmp_path, source):
+    import torch
+    from rsatoolbox.data.dataset import Dataset
+
+    data_path = root_path / "test_cases" / "case1"
+    feature_files = sorted((data_path / "features").glob("*.npz"))
+    features = [dict(np.load(f)) for f in feature_files]
+    layers = list(features[0])
+
+    feat_path = tmp_path / "features"
+    feat_path.mkdir()
+    if source == "pt":
+        for f, feat in zip(feature_files, features):
+            torch.save({k: torch.from_numpy(v) for k, v in feat.items()}, feat_path / f"{f.stem}.pt")
+        feat_path = str(feat_path)
+    elif source == "dataset":
+        for layer in layers:
+            Dataset(
+                measurements=np.stack([feat[layer].ravel() for feat in features]),
+                descriptors={"dnn": "ResNet18", "layer": layer},
+                obs_descriptors={"images": np.array([f.stem for f in feature_files])},
+            ).save(str(feat_path / f"ResNet18_{layer}.hdf5"))
+        feat_path = str(feat_path)
+    else:
+        feat_path = {
+            layer: torch.from_numpy(np.concatenate([feat[layer] for feat in features]))
+            for layer in layers
+        }
+
+    rdm = RDMCreator(feat_path=feat_path, save_path=str(tmp_path / "rdm"))
+    rdm.create_rdms()
+
+    for gt_file in (data_path / "rdm").glob("*.npz"):
+        gt = np.load(gt_file)["arr_0"]
+        test = np.load(tmp_path / "rdm" / gt_file.name)["arr_0"]
+        assert np.allclose(gt, test)
+
+
+def test_hdf5_reader_stimulus_order(tmp_path):
+    from rsatoolbox.data.dataset import Dataset
+
+    from net2brain.utils.feature_readers import FeatureReader, HDF5Reader
+
+    with pytest.raises(TypeError):
+        FeatureReader()
+
+    rng = np.random.default_rng(0)
+    files = []
+    for layer, images in [("a", ["x", "y", "z"]), ("b", ["x", "z", "y"])]:
+        files.append(str(tmp_path / f"{layer}.hdf5"))
+        Dataset(
+            measurements=rng.random((3, 4)),
+            descriptors={"layer": layer},
+            obs_descriptors={"images": np.array(images)},
+        ).save(files[-1])
+
+    assert HDF5Reader(files[:1]).stimuli == ["x", "y", "z"]
+    with pytest.raises(ValueError):
+        HDF5Reader(files)
+
+
+def test_rdm_creator_approximate(root_path, tmp_path):
+    import json
+
+    data_path = root_path / "test_cases" / "case1"
+
+    with pytest.raises(ValueError):
+        RDMCreator(
+            feat_path=str(data_path / "features"), save_path=str(tmp_path),
+            distance="spearman", approximate=0.2,
+        )
+
+    rdm = RDMCreator(
+        feat_path=str(data_path / "features"),
+        save_path=str(tmp_path),
+        distance=["pearson", "euclidean"],
+        approximate=0.2,
+    )
+    rdm.create_rdms()
+
+    with open(tmp_path / "approximation_errors.json") as f:
+        errors = json.load(f)
+
+    for gt_file in (data_path / "rdm").glob("*.npz"):
+        gt = np.load(gt_file)["arr_0"]
+        test = np.load(tmp_path / "pearson" / gt_file.name)["arr_0"]
+        off_diagonal = ~np.eye(len(gt), dtype=bool)
+        relative = np.abs(test - gt)[off_diagonal] / gt[off_diagonal]
+        assert relative.mean() < 0.2
+
+        layer_errors = errors[gt_file.stem]
+        assert layer_errors["pearson"]["dimensions"] < rdm.reader.layer_info()[gt_file.stem][0]
+        assert layer_errors["euclidean"]["mean"] <= layer_errors["euclidean"]["max"] < 0.2
@@ -0,0 +1,45 @@
+import pickle
+
+import pytest
+
+from net2brain.architectures.taxonomy import ModelCatalog, read_taxonomy_csv
+
+
+def test_catalog_matches_dataframe_queries(tmp_path):
+    df = read_taxonomy_csv()
+    catalog = ModelCatalog.load(cache_dir=str(tmp_path))
+
+    # AND over categories
+    expected = df[df[["ImageNet", "Supervised"]].eq(1).all(axis=1)]
+    result = catalog.to_frame(catalog.query_bits(all_of=["ImageNet", "Supervised"]))
+    assert list(result["Model"]) == list(expected["Model"])
+
+    # OR over categories
+    expected = df[df[["SimCLR", "MoCo"]].eq(1).any(axis=1)]
+    result = catalog.query(any_of=["SimCLR", "MoCo"])
+    assert [m for _, m in result] == list(expected["Model"])
+
+    # Name lookup
+    expected = df[df["Model"].str.contains("resnet", case=False)]
+    assert list(catalog.to_frame(catalog.name_bits("ResNet"))["Model"]) == list(expected["Model"])
+    assert all(m.lower().startswith("resnet") for _, m in catalog.query(name="resnet", prefix=True))
+    # Names are matched literally, not as regular expressions
+    assert catalog.name_bits("res.et") == 0
+
+    # Second load comes from the binary cache
+    assert (tmp_path / "taxonomy.pkl").exists()
+    assert ModelCatalog.load(cache_dir=str(tmp_path)).query(any_of="MoCo") == catalog.query(any_of="MoCo")
+
+
+def test_catalog_sweep_only_available():
+    catalog = ModelCatalog(read_taxonomy_csv())
+    available = {"standard": ["AlexNet"]}
+    assert list(catalog.sweep(available, name="alexnet")) == [("standard", "AlexNet")]
+
+
+@pytest.mark.parametrize("stale", [b"cnet2brain_removed_module\nCatalog\n.", pickle.dumps((0, 1)), b"garbage"])
+def test_catalog_rebuilds_stale_cache(tmp_path, stale):
+    # Caches written by other versions may fail to unpickle in any way
+    (tmp_path / "taxonomy.pkl").write_bytes(stale)
+    catalog = ModelCatalog.load(cache_dir=str(tmp_path))
+    assert catalog.models == ModelCatalog(read_taxonomy_csv()).models
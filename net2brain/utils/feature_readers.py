@@ -0,0 +1,270 @@
+import glob
+import os
+from abc import ABC, abstractmethod
+
+import h5py
+import numpy as np
+import torch
+from tqdm import tqdm
+
+
+class FeatureReader(ABC):
+    """Common interface of all feature sources RDMCreator can read from. A
+    reader knows the stimuli and layers of its source and fills one
+    (num_stimuli, num_features) matrix per layer with the access pattern
+    that suits the source best.
+    """
+
+    files = []
+
+    def __len__(self):
+        return len(self.stimuli)
+
+    @property
+    @abstractmethod
+    def stimuli(self):
+        """IDs of the stimuli in the order of the rows"""
+
+    @property
+    @abstractmethod
+    def layers(self):
+        """Names of the layers"""
+
+    @abstractmethod
+    def layer_info(self):
+        """Number of features and dtype of every layer
+
+        Returns:
+            dict: {layer: (num_features, dtype)}
+        """
+
+    @abstractmethod
+    def read_into(self, activations):
+        """Fills the preallocated matrices with the flattened features
+
+        Args:
+            activations (dict): {layer: array (num_stimuli, num_features)}, e.g. memmaps
+        """
+
+    @abstractmethod
+    def get_features(self, layer_id, i):
+        """Flattened features of one layer for stimulus i
+
+        Args:
+            layer_id (str): name of layer
+            i (int): index of the stimulus
+
+        Returns:
+            numpy array: activations from layer
+        """
+
+
+class NpzReader(FeatureReader):
+    """One .npz file per stimulus with one array per layer (save_format='npz')"""
+
+    def __init__(self, files):
+        self.files = files
+
+    @property
+    def stimuli(self):
+        return [os.path.splitext(os.path.basename(f))[0] for f in self.files]
+
+    def _load(self, i):
+        return np.load(self.files[i], allow_pickle=True)
+
+    @property
+    def layers(self):
+        with self._load(0) as feat:
+            # skip keys like __header__, __version__, __globals__
+            return [key for key in feat if "__" not in key]
+
+    def layer_info(self):
+        with self._load(0) as feat:
+            return {layer: (feat[layer].size, feat[layer].dtype) for layer in self.layers}
+
+    def read_into(self, activations):
+        # Every file is opened once for all layers
+        for i in tqdm(range(len(self.files))):
+            with self._load(i) as feat:
+                for layer, out in activations.items():
+                    out[i] = feat[layer].ravel()
+
+    def get_features(self, layer_id, i):
+        with self._load(i) as feat:
+            return feat[layer_id].ravel()
+
+
+class PtReader(NpzReader):
+    """One .pt file per stimulus with a dict of tensors (save_format='pt').
+    A single torch.load per file covers all layers."""
+
+    def _load(self, i):
+        return _ClosingDict(torch.load(self.files[i], map_location="cpu"))
+
+    @property
+    def layers(self):
+        with self._load(0) as feat:
+            return list(feat.keys())
+
+    def layer_info(self):
+        with self._load(0) as feat:
+            return {layer: (feat[layer].numel(), _numpy_dtype(feat[layer])) for layer in feat}
+
+    def read_into(self, activations):
+        for i in tqdm(range(len(self.files))):
+            with self._load(i) as feat:
+                for layer, out in activations.items():
+                    out[i] = _to_numpy(feat[layer]).ravel()
+
+    def get_features(self, layer_id, i):
+        with self._load(i) as feat:
+            return _to_numpy(feat[layer_id]).ravel()
+
+
+class HDF5Reader(FeatureReader):
+    """One rsatoolbox Dataset .hdf5 file per layer (save_format='dataset').
+    The measurements are read in slices of rows straight into the output."""
+
+    def __init__(self, files, rows_per_read=None):
+        """
+        Args:
+            files (list): paths to the .hdf5 files
+            rows_per_read (int, optional): rows per read. If None, about 64 MB per read.
+
+        Raises:
+            ValueError: If the files do not list the same stimuli in the same order
+        """
+        self.files = files
+        self.rows_per_read = rows_per_read
+        self._layer_files = {}
+        self._stimuli = None
+        for filename in files:
+            with h5py.File(filename, "r") as f:
+                layer = f["descriptors"].attrs.get("layer") if "descriptors" in f else None
+                if layer is None:
+                    layer = os.path.splitext(os.path.basename(filename))[0]
+                self._layer_files[str(layer)] = filename
+
+                # The rows of all layers have to be the same stimuli
+                stimuli = self._file_stimuli(f)
+                if self._stimuli is None:
+                    self._stimuli = stimuli
+                elif stimuli != self._stimuli:
+                    raise ValueError(f"{filename} does not list the stimuli of {files[0]} in the same order")
+
+    @staticmethod
+    def _file_stimuli(f):
+        """Stimulus IDs of an open dataset file, the row numbers without image descriptors"""
+        if "obs_descriptors/images" in f:
+            return [s.decode() if isinstance(s, bytes) else str(s)
+                    for s in f["obs_descriptors/images"][()]]
+        return [str(i) for i in range(f["measurements"].shape[0])]
+
+    @property
+    def stimuli(self):
+        return self._stimuli
+
+    @property
+    def layers(self):
+        return list(self._layer_files)
+
+    def layer_info(self):
+        info = {}
+        for layer, filename in self._layer_files.items():
+            with h5py.File(filename, "r") as f:
+                measurements = f["measurements"]
+                info[layer] = (int(np.prod(measurements.shape[1:])), measurements.dtype)
+        return info
+
+    def read_into(self, activations):
+        for layer, out in tqdm(activations.items()):
+            with h5py.File(self._layer_files[layer], "r") as f:
+                measurements = f["measurements"]
+                rows = self.rows_per_read or max(1, (64 << 20) // max(1, out[0].nbytes))
+                for start in range(0, len(out), rows):
+                    stop = min(start + rows, len(out))
+                    out[start:stop] = measurements[start:stop].reshape(stop - start, -1)
+
+    def get_features(self, layer_id, i):
+        with h5py.File(self._layer_files[layer_id], "r") as f:
+            return f["measurements"][i].ravel()
+
+
+class DictReader(FeatureReader):
+    """In-memory features {layer: array or tensor (num_stimuli, ...)}, e.g. as
+    returned by FeatureExtractor.extract_from_stimuli"""
+
+    def __init__(self, features, stimulus_ids=None):
+        self.features = features
+        num_stimuli = len(next(iter(features.values())))
+        self._stimuli = [str(s) for s in stimulus_ids] if stimulus_ids is not None \
+            else [str(i) for i in range(num_stimuli)]
+
+    @property
+    def stimuli(self):
+        return self._stimuli
+
+    @property
+    def layers(self):
+        return list(self.features)
+
+    def layer_info(self):
+        info = {}
+        for layer, values in self.features.items():
+            values = _to_numpy(values)
+            info[layer] = (values[0].size, values.dtype)
+        return info
+
+    def read_into(self, activations):
+        for layer, out in activations.items():
+            out[:] = _to_numpy(self.features[layer]).reshape(len(out), -1)
+
+    def get_features(self, layer_id, i):
+        return _to_numpy(self.features[layer_id][i]).ravel()
+
+
+class _ClosingDict(dict):
+    """dict usable in a with statement like np.load's NpzFile"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.clear()
+
+
+def _to_numpy(values):
+    if isinstance(values, torch.Tensor):
+        return values.detach().cpu().numpy()
+    return np.asarray(values)
+
+
+def _numpy_dtype(tensor):
+    return torch.empty(0, dtype=tensor.dtype).numpy().dtype
+
+
+READERS = {".npz": NpzReader, ".pt": PtReader, ".hdf5": HDF5Reader}
+
+
+def open_features(source, stimulus_ids=None):
+    """Returns the reader for a feature source
+
+    Args:
+        source (str or dict): folder with .npz, .pt or .hdf5 features, or
+            {layer: array or tensor (num_stimuli, ...)}
+        stimulus_ids (list, optional): IDs of the stimuli of in-memory features
+
+    Raises:
+        ValueError: If the folder contains no features
+
+    Returns:
+        FeatureReader: the reader
+    """
+    if isinstance(source, dict):
+        return DictReader(source, stimulus_ids)
+
+    for extension, reader in READERS.items():
+        files = sorted(glob.glob(os.path.join(str(source), "*" + extension)))
+        if files:
+            return reader(files)
+    raise ValueError(f"No features ({', '.join(READERS)}) found in {source}")
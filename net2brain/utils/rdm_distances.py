@@ -0,0 +1,532 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.stats import rankdata
+from sklearn.random_projection import johnson_lindenstrauss_min_dim
+
+
+DISTANCES = ["pearson", "cosine", "euclidean", "sqeuclidean", "spearman", "mahalanobis"]
+
+# Pearson standardizes every feature over all images, so its Gram matrix
+# changes completely when images are added
+INCREMENTAL_DISTANCES = ["cosine", "euclidean", "sqeuclidean", "spearman", "mahalanobis"]
+
+# A random projection keeps inner products, but neither ranks nor the feature covariance
+APPROXIMATE_DISTANCES = ["pearson", "cosine", "euclidean", "sqeuclidean"]
+
+
+def check_distances(distances):
+    """Turns the requested distance(s) into a list and checks that they exist
+
+    Args:
+        distances (str or list): name(s) of the distance metrics
+
+    Raises:
+        ValueError: If a distance is not implemented
+
+    Returns:
+        list: lower-cased names of the distances
+    """
+    if isinstance(distances, str):
+        distances = [distances]
+    distances = [d.lower() for d in distances]
+    for d in distances:
+        if d not in DISTANCES:
+            raise ValueError(f"Distance '{d}' is not implemented. Available distances are {DISTANCES}")
+    return distances
+
+
+def rank_rows(activations, out=None):
+    """Ranks the features of every image (average rank for ties)
+
+    Args:
+        activations (array): activations for each image (n_images, n_features)
+        out (array, optional): array (e.g. a memmap) to write the ranks into. Defaults to None.
+
+    Returns:
+        array: ranks, same shape as activations
+    """
+    if out is None:
+        out = np.empty(activations.shape, dtype=np.float32)
+    for i in range(activations.shape[0]):
+        out[i] = rankdata(activations[i])
+    return out
+
+
+class GramAccumulator:
+    """Accumulates the image x image cross-products that all distances are
+    computed from. Features are streamed in blocks of columns, every block
+    has to contain all images. Which cross-products are kept depends on
+    the requested distances:
+
+    - pearson: features standardized over images (as the StandardScaler does)
+    - cosine, euclidean, sqeuclidean: raw features
+    - mahalanobis: features centered over images
+    - spearman: features ranked within each image
+
+    In incremental mode only cross-products of per-image features (raw and
+    ranked) are kept, so images can be added later with add_rows. The
+    centered cross-products of mahalanobis are then derived from the raw ones.
+    """
+
+    def __init__(self, num_condns, distances, dtype=np.float32, incremental=False):
+        """Initiates the accumulator
+
+        Args:
+            num_condns (int): number of images
+            distances (str or list): distances that will be computed
+            dtype (numpy dtype, optional): precision of the block products. The
+                sums are always kept in float64. Defaults to np.float32.
+            incremental (bool, optional): Keep only statistics that can be extended
+                with new images. Defaults to False.
+
+        Raises:
+            ValueError: If a distance is not implemented or cannot be updated incrementally
+        """
+        self.distances = check_distances(distances)
+        self.num_condns = num_condns
+        self.dtype = dtype
+        self.incremental = incremental
+        self.num_features = 0
+
+        if incremental:
+            for d in self.distances:
+                if d not in INCREMENTAL_DISTANCES:
+                    raise ValueError(f"Distance '{d}' cannot be updated incrementally")
+
+        self.gram = {}
+        self.row_sums = {}
+        needs = set()
+        for d in self.distances:
+            if d == "pearson":
+                needs.add("standardized")
+            elif d == "spearman":
+                needs.add("ranked")
+            elif d == "mahalanobis":
+                needs.add("raw" if incremental else "centered")
+            else:
+                needs.add("raw")
+        for kind in needs:
+            self.gram[kind] = np.zeros((num_condns, num_condns))
+            self.row_sums[kind] = np.zeros(num_condns)
+
+    @property
+    def needs_ranks(self):
+        return "ranked" in self.gram
+
+    def state(self):
+        """Sufficient statistics of the accumulator, e.g. to save them with np.savez
+
+        Returns:
+            dict: {name: array}
+        """
+        state = {"num_features": np.array(self.num_features)}
+        for kind in self.gram:
+            state[f"gram_{kind}"] = self.gram[kind]
+            state[f"row_sums_{kind}"] = self.row_sums[kind]
+        return state
+
+    @classmethod
+    def from_state(cls, state, distances, dtype=np.float32):
+        """Restores an incremental accumulator from its state
+
+        Args:
+            state (dict or NpzFile): as returned by state()
+            distances (str or list): distances that will be computed
+            dtype (numpy dtype, optional): precision of the block products. Defaults to np.float32.
+
+        Raises:
+            KeyError: If the state lacks statistics the distances need
+
+        Returns:
+            GramAccumulator: the accumulator
+        """
+        num_condns = len(state[next(k for k in state.keys() if k.startswith("row_sums_"))])
+        accumulator = cls(num_condns, distances, dtype, incremental=True)
+        accumulator.num_features = int(state["num_features"])
+        for kind in accumulator.gram:
+            accumulator.gram[kind] = np.array(state[f"gram_{kind}"], dtype=np.float64)
+            accumulator.row_sums[kind] = np.array(state[f"row_sums_{kind}"], dtype=np.float64)
+        return accumulator
+
+    def add_rows(self, activations, old_rows, new_rows, ranks=None, block_size=None):
+        """Extends the statistics with new images. Only the cross-products of
+        the new images with all images are computed, the existing ones are kept.
+
+        Args:
+            activations (array): activations of old and new images (n_images, n_features)
+            old_rows (array): rows of activations that belong to the images already in the
+                statistics, in the same order
+            new_rows (array): rows of activations of the new images
+            ranks (array, optional): ranked activations, required for spearman
+            block_size (int, optional): number of features per block. If None, all at once.
+
+        Raises:
+            ValueError: If the number of features changed
+        """
+        num_features = activations.shape[1]
+        if num_features != self.num_features:
+            raise ValueError(f"Statistics were computed from {self.num_features} features, got {num_features}")
+
+        old_rows, new_rows = np.asarray(old_rows), np.asarray(new_rows)
+        num_old, num_new = len(old_rows), len(new_rows)
+        block_size = block_size or num_features
+
+        for kind in self.gram:
+            source = ranks if kind == "ranked" else activations
+            if source is None:
+                raise ValueError("Spearman needs the ranked activations")
+
+            cross = np.zeros((num_old, num_new))
+            inner = np.zeros((num_new, num_new))
+            sums = np.zeros(num_new)
+            for start in range(0, num_features, block_size):
+                block = np.asarray(source[:, start:start + block_size])
+                new_block = np.ascontiguousarray(block[new_rows], dtype=self.dtype)
+                old_block = np.ascontiguousarray(block[old_rows], dtype=self.dtype)
+                cross += old_block @ new_block.T
+                inner += new_block @ new_block.T
+                sums += new_block.sum(axis=1, dtype=np.float64)
+
+            gram = np.empty((num_old + num_new, num_old + num_new))
+            gram[:num_old, :num_old] = self.gram[kind]
+            gram[:num_old, num_old:] = cross
+            gram[num_old:, :num_old] = cross.T
+            gram[num_old:, num_old:] = inner
+            self.gram[kind] = gram
+            self.row_sums[kind] = np.concatenate([self.row_sums[kind], sums])
+
+        self.num_condns = num_old + num_new
+
+    def reorder(self, order):
+        """Reorders the images of the statistics
+
+        Args:
+            order (array): new order as indices into the current images
+        """
+        order = np.asarray(order)
+        for kind in self.gram:
+            self.gram[kind] = self.gram[kind][np.ix_(order, order)]
+            self.row_sums[kind] = self.row_sums[kind][order]
+
+    def _add(self, kind, block):
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        self.gram[kind] += block @ block.T
+        self.row_sums[kind] += block.sum(axis=1, dtype=np.float64)
+
+    def update(self, block, ranked_block=None):
+        """Adds a block of feature columns
+
+        Args:
+            block (array): activations of all images for some features (n_images, block_size)
+            ranked_block (array, optional): the same columns of the ranked activations.
+                Required for spearman.
+        """
+        block = np.asarray(block, dtype=np.float64)
+        self.num_features += block.shape[1]
+
+        if "raw" in self.gram:
+            self._add("raw", block)
+
+        if "centered" in self.gram or "standardized" in self.gram:
+            centered = block - block.mean(axis=0)
+            if "centered" in self.gram:
+                self._add("centered", centered)
+            if "standardized" in self.gram:
+                scale = centered.std(axis=0)
+                scale[scale == 0.0] = 1.0
+                self._add("standardized", centered / scale)
+
+        if "ranked" in self.gram:
+            if ranked_block is None:
+                raise ValueError("Spearman needs the ranked activations")
+            self._add("ranked", ranked_block)
+
+    def correlation(self, kind):
+        """Pearson correlation between the rows from their cross-products"""
+        row_means = self.row_sums[kind] / self.num_features
+        cov = self.gram[kind] / self.num_features - np.outer(row_means, row_means)
+        std = np.sqrt(np.diag(cov))
+        return cov / np.outer(std, std)
+
+    def squared_euclidean(self, gram):
+        """Squared euclidean distances from a Gram matrix"""
+        norms = np.diag(gram)
+        dist = norms[:, None] + norms[None, :] - 2 * gram
+        np.maximum(dist, 0, out=dist)
+        np.fill_diagonal(dist, 0)
+        return dist
+
+    def centered_gram(self):
+        """Cross-products of the features centered over images. In incremental
+        mode they are derived from the raw ones as H G H with the centering matrix H.
+
+        Returns:
+            array: image x image array
+        """
+        if "centered" in self.gram:
+            return self.gram["centered"]
+        gram = self.gram["raw"]
+        col_means = gram.mean(axis=0)
+        return gram - col_means[None, :] - col_means[:, None] + gram.mean()
+
+    def ledoit_wolf_shrinkage(self):
+        """Ledoit-Wolf shrinkage of the feature covariance, computed from the
+        centered Gram matrix (same estimate as sklearn.covariance.ledoit_wolf)
+
+        Returns:
+            float: shrinkage between 0 and 1
+        """
+        gram = self.centered_gram()
+        n, p = self.num_condns, self.num_features
+        mu = np.trace(gram) / (n * p)
+        delta_ = np.sum(gram ** 2) / n ** 2
+        beta_ = np.sum(np.diag(gram) ** 2)
+        beta = (beta_ / n - delta_) / (p * n)
+        delta = (delta_ - 2.0 * mu * np.trace(gram) / n + p * mu ** 2) / p
+        beta = min(beta, delta)
+        return 0.0 if beta == 0 else beta / delta
+
+    def mahalanobis(self, shrinkage=None):
+        """Mahalanobis distances with the shrinkage covariance
+        (1 - shrinkage) * S + shrinkage * mu * I of the features. The
+        p x p covariance is never formed: with the Woodbury identity the
+        distances only need the n x n centered Gram matrix.
+
+        Args:
+            shrinkage (float, optional): shrinkage intensity. If None, use Ledoit-Wolf.
+
+        Returns:
+            array: image x image array
+        """
+        gram = self.centered_gram()
+        n, p = self.num_condns, self.num_features
+        if shrinkage is None:
+            shrinkage = self.ledoit_wolf_shrinkage()
+        mu = np.trace(gram) / (n * p)
+
+        # X S^-1 X^T = V diag(l / (a * l + b)) V^T with K = V diag(l) V^T
+        a = (1 - shrinkage) / n
+        b = shrinkage * mu
+        eigvals, eigvecs = np.linalg.eigh(gram)
+        eigvals = np.clip(eigvals, 0, None)
+        denom = a * eigvals + b
+        scale = np.divide(eigvals, denom, out=np.zeros_like(eigvals), where=denom > 1e-12 * eigvals.max())
+        whitened_gram = (eigvecs * scale) @ eigvecs.T
+        return np.sqrt(self.squared_euclidean(whitened_gram))
+
+    def rdms(self, shrinkage=None):
+        """Computes the RDMs of all requested distances
+
+        Args:
+            shrinkage (float, optional): shrinkage for mahalanobis. If None, use Ledoit-Wolf.
+
+        Returns:
+            dict: {distance: image x image array}
+        """
+        out = {}
+        for d in self.distances:
+            if d == "pearson":
+                out[d] = 1 - self.correlation("standardized")
+            elif d == "spearman":
+                out[d] = 1 - self.correlation("ranked")
+            elif d == "cosine":
+                norms = np.sqrt(np.diag(self.gram["raw"]))
+                out[d] = 1 - self.gram["raw"] / np.outer(norms, norms)
+            elif d == "sqeuclidean":
+                out[d] = self.squared_euclidean(self.gram["raw"])
+            elif d == "euclidean":
+                out[d] = np.sqrt(self.squared_euclidean(self.gram["raw"]))
+            elif d == "mahalanobis":
+                out[d] = self.mahalanobis(shrinkage)
+        return out
+
+
+def accumulate(activations, distances, block_size=None, dtype=np.float32, ranks=None, incremental=False):
+    """Accumulates the statistics of one layer in a single pass over its features
+
+    Args:
+        activations (array or str): (memmapped) activations for each image (78, 193600)
+            or path to such a .npy file
+        distances (str or list): distance(s) to compute, see DISTANCES
+        block_size (int, optional): number of features per block. If None, all at once.
+        dtype (numpy dtype, optional): precision of the block products. Defaults to np.float32.
+        ranks (array, optional): precomputed ranked activations for spearman.
+        incremental (bool, optional): Keep statistics that can be extended with new images.
+            Defaults to False.
+
+    Returns:
+        GramAccumulator: the filled accumulator
+    """
+    if isinstance(activations, str):
+        activations = np.load(activations, mmap_mode='r')
+
+    num_condns, num_features = activations.shape
+    accumulator = GramAccumulator(num_condns, distances, dtype, incremental)
+
+    if accumulator.needs_ranks and ranks is None:
+        ranks = rank_rows(activations)
+
+    block_size = block_size or num_features
+    for start in range(0, num_features, block_size):
+        block = activations[:, start:start + block_size]
+        ranked_block = None if ranks is None else ranks[:, start:start + block_size]
+        accumulator.update(block, ranked_block)
+
+    return accumulator
+
+
+def compute_rdms(activations, distances, block_size=None, dtype=np.float32, shrinkage=None, ranks=None):
+    """Computes several RDMs of one layer in a single pass over its features
+
+    Args:
+        activations (array or str): (memmapped) activations for each image (78, 193600)
+            or path to such a .npy file
+        distances (str or list): distance(s) to compute, see DISTANCES
+        block_size (int, optional): number of features per block. If None, all at once.
+        dtype (numpy dtype, optional): precision of the block products. Defaults to np.float32.
+        shrinkage (float, optional): shrinkage for mahalanobis. If None, use Ledoit-Wolf.
+        ranks (array, optional): precomputed ranked activations for spearman.
+
+    Returns:
+        dict: {distance: image x image array}
+    """
+    return accumulate(activations, distances, block_size, dtype, ranks).rdms(shrinkage)
+
+
+def projection_dimension(num_condns, eps):
+    """Number of dimensions that keep all pairwise squared distances of
+    num_condns points within a factor of 1 +- eps (Johnson-Lindenstrauss)
+
+    Args:
+        num_condns (int): number of images
+        eps (float): target distortion between 0 and 1
+
+    Returns:
+        int: number of dimensions
+    """
+    return int(johnson_lindenstrauss_min_dim(num_condns, eps=eps))
+
+
+def sparse_projection(num_features, dimensions, seed=0, dtype=np.float32):
+    """Sparse random projection matrix with density 1 / sqrt(num_features)
+    and entries +-sqrt(1 / density) / sqrt(dimensions), the same distribution
+    as sklearn's SparseRandomProjection, drawn column by column without a
+    loop over the features
+
+    Args:
+        num_features (int): number of input features
+        dimensions (int): number of output dimensions
+        seed (int, optional): seed of the random generator. Defaults to 0.
+        dtype (numpy dtype, optional): dtype of the entries. Defaults to np.float32.
+
+    Returns:
+        scipy.sparse.csr_matrix: features x dimensions matrix
+    """
+    rng = np.random.default_rng(seed)
+    density = 1 / np.sqrt(num_features)
+    counts = rng.binomial(num_features, density, size=dimensions)
+    rows = np.concatenate([rng.choice(num_features, c, replace=False) for c in counts])
+    cols = np.repeat(np.arange(dimensions), counts)
+    values = np.where(rng.random(len(rows)) < 0.5, -1.0, 1.0) * np.sqrt(1 / density) / np.sqrt(dimensions)
+    return sp.csr_matrix((values.astype(dtype), (rows, cols)), shape=(num_features, dimensions))
+
+
+def _rdm_from_gram(gram, distance):
+    """RDM of one distance from the inner products of (projected) features"""
+    if distance in ["pearson", "cosine"]:
+        norms = np.sqrt(np.diag(gram))
+        return 1 - gram / np.outer(norms, norms)
+    norms = np.diag(gram)
+    dist = np.maximum(norms[:, None] + norms[None, :] - 2 * gram, 0)
+    np.fill_diagonal(dist, 0)
+    return np.sqrt(dist) if distance == "euclidean" else dist
+
+
+def approximate_rdms(activations, distances, eps=0.1, seed=0, block_size=None, n_check=20, dtype=np.float32):
+    """Computes RDMs on a seeded sparse random projection of the features.
+    The number of dimensions follows from the target distortion eps, so the
+    cost no longer grows with the number of features. In the same pass, the
+    exact RDMs of a random sample of n_check images are computed to report
+    the relative error of the approximation.
+
+    Pearson standardizes every feature over images first (as the exact RDM
+    does) and projects the row-centered features: the row means are removed
+    after the projection with the projected vector of ones.
+
+    Args:
+        activations (array or str): (memmapped) activations for each image (78, 193600)
+            or path to such a .npy file
+        distances (str or list): distance(s) to compute, see APPROXIMATE_DISTANCES
+        eps (float, optional): target distortion. Defaults to 0.1.
+        seed (int, optional): seed of the projection and the error sample. Defaults to 0.
+        block_size (int, optional): number of features per block. If None, all at once.
+        n_check (int, optional): number of images the error is measured on. Defaults to 20.
+        dtype (numpy dtype, optional): precision of the block products. Defaults to np.float32.
+
+    Raises:
+        ValueError: If a distance cannot be approximated
+
+    Returns:
+        dict: {distance: image x image array}
+        dict: {distance: {"dimensions", "max", "mean"}} relative errors on the sample
+    """
+    distances = check_distances(distances)
+    for d in distances:
+        if d not in APPROXIMATE_DISTANCES:
+            raise ValueError(f"Distance '{d}' cannot be approximated by a random projection. "
+                             f"Available distances are {APPROXIMATE_DISTANCES}")
+    if isinstance(activations, str):
+        activations = np.load(activations, mmap_mode='r')
+
+    num_condns, num_features = activations.shape
+    dimensions = projection_dimension(num_condns, eps)
+    if dimensions >= num_features:
+        rdms = compute_rdms(activations, distances, block_size, dtype)
+        return rdms, {d: {"dimensions": num_features, "max": 0.0, "mean": 0.0} for d in distances}
+
+    # Features x dimensions, row slices give the projection of a block of features
+    projection = sparse_projection(num_features, dimensions, seed, dtype)
+
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(num_condns, min(n_check, num_condns), replace=False))
+    exact = GramAccumulator(len(sample), distances, dtype)
+
+    kinds = ["standardized"] if "pearson" in distances else []
+    kinds += ["raw"] if any(d != "pearson" for d in distances) else []
+    projected = {kind: np.zeros((num_condns, dimensions)) for kind in kinds}
+    row_sums = np.zeros(num_condns)
+
+    block_size = block_size or num_features
+    for start in range(0, num_features, block_size):
+        block = np.asarray(activations[:, start:start + block_size], dtype=dtype)
+        rows = projection[start:start + block_size]
+        exact.num_features += block.shape[1]
+
+        if "raw" in projected:
+            projected["raw"] += block @ rows
+            exact._add("raw", block[sample])
+        if "standardized" in projected:
+            block = block - block.mean(axis=0, dtype=np.float64).astype(dtype)
+            scale = np.sqrt(np.mean(np.square(block), axis=0, dtype=np.float64)).astype(dtype)
+            scale[scale == 0.0] = 1.0
+            block /= scale
+            projected["standardized"] += block @ rows
+            row_sums += block.sum(axis=1, dtype=np.float64)
+            exact._add("standardized", block[sample])
+
+    if "standardized" in projected:
+        ones = np.asarray(projection.sum(axis=0)).ravel()
+        projected["standardized"] -= np.outer(row_sums / num_features, ones)
+
+    grams = {kind: values @ values.T for kind, values in projected.items()}
+    exact_rdms = exact.rdms()
+    rdms, errors = {}, {}
+    upper = np.triu_indices(len(sample), 1)
+    for d in distances:
+        rdms[d] = _rdm_from_gram(grams["standardized" if d == "pearson" else "raw"], d)
+        truth = exact_rdms[d][upper]
+        approx = rdms[d][np.ix_(sample, sample)][upper]
+        relative = np.abs(approx - truth) / np.maximum(np.abs(truth), np.finfo(float).eps)
+        errors[d] = {"dimensions": dimensions, "max": float(relative.max(initial=0)),
+                     "mean": float(relative.mean()) if relative.size else 0.0}
+    return rdms, errors